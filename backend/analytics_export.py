@@ -0,0 +1,396 @@
+# backend/analytics_export.py
+
+"""
+列式分析导出（Parquet / Arrow IPC）
+
+使用记录、试剂和设备预约按主键顺序从数据库游标分批读取（yield_per，
+使用记录和设备预约的日期范围早于归档边界时连同归档分区一起读取），
+每批直接转成一个 Arrow RecordBatch 写出——Parquet 每批一个 row group，
+Arrow 使用 IPC 流格式。列带有明确类型（整数、浮点、时间戳、布尔），
+取值重复度高的列（物品类型、单位、用户名、状态等）按字典编码，文件
+体积和解析时间都远小于同等内容的 CSV。
+
+导出作为后台任务运行，进度通过 JobTracker 汇报，完成后文件保存在
+ANALYTICS_EXPORT_DIR 中供下载，超过保留时间由周期任务清理。
+
+pyarrow 为可选依赖，未安装时导出接口返回 503，其他功能不受影响。
+"""
+
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, aliased
+
+from config import ANALYTICS_EXPORT_DIR
+from database import SessionLocal
+from data_archive import SOURCES, archive_boundary, history_query
+from models import Device, DeviceReservation, Reagent, UsageRecord, User
+from job_tracker import JOB_TTL, JobTracker
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - 取决于部署环境
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+PYARROW_AVAILABLE = pa is not None
+
+FORMAT_PARQUET = "parquet"
+FORMAT_ARROW = "arrow"
+
+FORMAT_EXTENSIONS = {FORMAT_PARQUET: "parquet", FORMAT_ARROW: "arrows"}
+FORMAT_MEDIA_TYPES = {
+    FORMAT_PARQUET: "application/vnd.apache.parquet",
+    FORMAT_ARROW: "application/vnd.apache.arrow.stream",
+}
+
+# 每批读取的行数，即 Parquet row group / Arrow RecordBatch 的行数
+ROW_GROUP_SIZE = 50000
+
+COMPRESSION = "zstd"
+
+# 列类型
+KIND_INT = "int"
+KIND_FLOAT = "float"
+KIND_BOOL = "bool"
+KIND_STRING = "string"
+KIND_CATEGORY = "category"  # 字典编码的字符串
+KIND_TIMESTAMP = "timestamp"
+
+export_tracker = JobTracker("analytics_export")
+
+
+@dataclass
+class ExportColumn:
+    name: str
+    expr: object  # SQL 列表达式
+    kind: str
+
+
+@dataclass
+class ExportDataset:
+    name: str
+    description: str
+    table: object  # 热表
+    columns: Callable[[object], List[ExportColumn]]  # 参数为读取源（热表或历史子查询）
+    joins: Callable[[object, object], object]  # (select, 读取源)，在 select 上追加 JOIN
+    key: str  # 主键列名，决定读取顺序
+    time_column: Optional[str] = None  # 日期过滤所用的列名
+    archive_source: Optional[str] = None  # 参与按月归档时的源表名（data_archive.SOURCES）
+
+    def source(self, db: Session, start: Optional[datetime] = None, end: Optional[datetime] = None):
+        """
+        读取源：起始日期早于归档边界（或未指定）时读取热表与归档分区的
+        合并子查询，否则只读热表
+        """
+        if self.archive_source is None:
+            return self.table
+        boundary = archive_boundary(db, self.archive_source)
+        if boundary is None or (start is not None and start.date() >= boundary):
+            return self.table
+        if self.time_column != SOURCES[self.archive_source].time_column:
+            # 归档按另一列（如预约结束时间，不早于开始时间）分区，只用下界裁剪分区
+            end = None
+        return history_query(db, self.archive_source, start, end)
+
+    def statement(self, db: Session, start_date: Optional[date] = None, end_date: Optional[date] = None):
+        start = datetime.combine(start_date, datetime.min.time()) if start_date else None
+        end = datetime.combine(end_date + timedelta(days=1), datetime.min.time()) if end_date else None
+        source = self.source(db, start, end)
+        stmt = self.joins(select(*[c.expr.label(c.name) for c in self.columns(source)]), source)
+        if self.time_column is not None:
+            if start:
+                stmt = stmt.where(source.c[self.time_column] >= start)
+            if end:
+                stmt = stmt.where(source.c[self.time_column] < end)
+        return stmt.order_by(source.c[self.key])
+
+
+# ---------- 数据集定义 ----------
+
+_UsageUser = aliased(User)
+_UsageApprover = aliased(User)
+_ReservationUser = aliased(User)
+
+
+def _usage_columns(source) -> List[ExportColumn]:
+    U = source.c
+    return [
+        ExportColumn("id", U.id, KIND_INT),
+        ExportColumn("request_id", U.request_id, KIND_INT),
+        ExportColumn("item_type", U.item_type, KIND_CATEGORY),
+        ExportColumn("item_id", U.item_id, KIND_INT),
+        ExportColumn("item_name", U.item_name, KIND_CATEGORY),
+        ExportColumn("quantity_used", U.quantity_used, KIND_FLOAT),
+        ExportColumn("unit", U.unit, KIND_CATEGORY),
+        ExportColumn("user_id", U.user_id, KIND_INT),
+        ExportColumn("user_name", _UsageUser.username, KIND_CATEGORY),
+        ExportColumn("approved_by_id", U.approved_by_id, KIND_INT),
+        ExportColumn("approved_by_name", _UsageApprover.username, KIND_CATEGORY),
+        ExportColumn("purpose", U.purpose, KIND_STRING),
+        ExportColumn("notes", U.notes, KIND_STRING),
+        ExportColumn("used_at", U.used_at, KIND_TIMESTAMP),
+        ExportColumn("created_at", U.created_at, KIND_TIMESTAMP),
+    ]
+
+
+def _usage_joins(stmt, source):
+    return stmt.select_from(source).outerjoin(
+        _UsageUser, _UsageUser.id == source.c.user_id
+    ).outerjoin(
+        _UsageApprover, _UsageApprover.id == source.c.approved_by_id
+    )
+
+
+def _reagent_columns(source) -> List[ExportColumn]:
+    R = source.c
+    return [
+        ExportColumn("id", R.id, KIND_INT),
+        ExportColumn("name", R.name, KIND_STRING),
+        ExportColumn("category", R.category, KIND_CATEGORY),
+        ExportColumn("manufacturer", R.manufacturer, KIND_CATEGORY),
+        ExportColumn("product_number", R.product_number, KIND_STRING),
+        ExportColumn("batch_number", R.batch_number, KIND_STRING),
+        ExportColumn("expiry_date", R.expiry_date, KIND_TIMESTAMP),
+        ExportColumn("quantity", R.quantity, KIND_FLOAT),
+        ExportColumn("unit", R.unit, KIND_CATEGORY),
+        ExportColumn("storage_temperature", R.storage_temperature, KIND_CATEGORY),
+        ExportColumn("storage_location", R.storage_location, KIND_CATEGORY),
+        ExportColumn("cas_number", R.cas_number, KIND_STRING),
+        ExportColumn("molecular_formula", R.molecular_formula, KIND_STRING),
+        ExportColumn("molecular_weight", R.molecular_weight, KIND_FLOAT),
+        ExportColumn("purity", R.purity, KIND_FLOAT),
+        ExportColumn("supplier", R.supplier, KIND_CATEGORY),
+        ExportColumn("specification", R.specification, KIND_STRING),
+        ExportColumn("price", R.price, KIND_FLOAT),
+        ExportColumn("min_threshold", R.min_threshold, KIND_FLOAT),
+        ExportColumn("is_low_stock", R.is_low_stock, KIND_BOOL),
+        ExportColumn("created_at", R.created_at, KIND_TIMESTAMP),
+        ExportColumn("updated_at", R.updated_at, KIND_TIMESTAMP),
+    ]
+
+
+def _reservation_columns(source) -> List[ExportColumn]:
+    D = source.c
+    return [
+        ExportColumn("id", D.id, KIND_INT),
+        ExportColumn("device_id", D.device_id, KIND_INT),
+        ExportColumn("device_name", Device.name, KIND_CATEGORY),
+        ExportColumn("user_id", D.user_id, KIND_INT),
+        ExportColumn("user_name", _ReservationUser.username, KIND_CATEGORY),
+        ExportColumn("start_time", D.start_time, KIND_TIMESTAMP),
+        ExportColumn("end_time", D.end_time, KIND_TIMESTAMP),
+        ExportColumn("purpose", D.purpose, KIND_STRING),
+        ExportColumn("status", D.status, KIND_CATEGORY),
+        ExportColumn("notes", D.notes, KIND_STRING),
+        ExportColumn("created_at", D.created_at, KIND_TIMESTAMP),
+        ExportColumn("updated_at", D.updated_at, KIND_TIMESTAMP),
+    ]
+
+
+def _reservation_joins(stmt, source):
+    return stmt.select_from(source).outerjoin(
+        Device, Device.id == source.c.device_id
+    ).outerjoin(
+        _ReservationUser, _ReservationUser.id == source.c.user_id
+    )
+
+
+DATASETS: Dict[str, ExportDataset] = {
+    "usage_records": ExportDataset(
+        name="usage_records",
+        description="试剂/耗材使用记录（按使用时间过滤，含已归档记录）",
+        table=UsageRecord.__table__,
+        columns=_usage_columns,
+        joins=_usage_joins,
+        key="id",
+        time_column="used_at",
+        archive_source="usage_records",
+    ),
+    "reagents": ExportDataset(
+        name="reagents",
+        description="试剂库存（当前全量）",
+        table=Reagent.__table__,
+        columns=_reagent_columns,
+        joins=lambda stmt, source: stmt.select_from(source),
+        key="id",
+    ),
+    "device_reservations": ExportDataset(
+        name="device_reservations",
+        description="设备预约（按开始时间过滤，含已归档记录）",
+        table=DeviceReservation.__table__,
+        columns=_reservation_columns,
+        joins=_reservation_joins,
+        key="id",
+        time_column="start_time",
+        archive_source="device_reservations",
+    ),
+}
+
+
+def describe_datasets() -> List[dict]:
+    return [
+        {
+            "name": dataset.name,
+            "description": dataset.description,
+            "date_filter": dataset.time_column is not None,
+            "columns": [{"name": c.name, "kind": c.kind} for c in dataset.columns(dataset.table)],
+        }
+        for dataset in DATASETS.values()
+    ]
+
+
+# ---------- Arrow 转换与写出 ----------
+
+def _arrow_type(kind: str):
+    return {
+        KIND_INT: pa.int64(),
+        KIND_FLOAT: pa.float64(),
+        KIND_BOOL: pa.bool_(),
+        KIND_STRING: pa.string(),
+        KIND_CATEGORY: pa.dictionary(pa.int32(), pa.string()),
+        KIND_TIMESTAMP: pa.timestamp("us"),
+    }[kind]
+
+
+def arrow_schema(columns: Sequence[ExportColumn]):
+    return pa.schema([pa.field(c.name, _arrow_type(c.kind)) for c in columns])
+
+
+def to_record_batch(columns: Sequence[ExportColumn], schema, rows: Sequence[tuple]):
+    """把一批查询结果按列转换为 RecordBatch"""
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    arrays = []
+    for column, data in zip(columns, values):
+        if column.kind == KIND_CATEGORY:
+            arrays.append(pa.array(data, type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(data, type=_arrow_type(column.kind)))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class _ParquetSink:
+    def __init__(self, path: str, schema):
+        self.writer = pq.ParquetWriter(path, schema, compression=COMPRESSION)
+
+    def write(self, batch):
+        # 每次写入一个 row group
+        self.writer.write_table(pa.Table.from_batches([batch]))
+
+    def close(self):
+        self.writer.close()
+
+
+class _ArrowStreamSink:
+    """Arrow IPC 流格式（允许各批次使用不同的字典）"""
+
+    def __init__(self, path: str, schema):
+        self.file = pa.OSFile(path, "wb")
+        self.writer = pa.ipc.new_stream(self.file, schema, options=pa.ipc.IpcWriteOptions(compression=COMPRESSION))
+
+    def write(self, batch):
+        self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+        self.file.close()
+
+
+_SINKS = {FORMAT_PARQUET: _ParquetSink, FORMAT_ARROW: _ArrowStreamSink}
+
+
+def write_export(db: Session, dataset: ExportDataset, fmt: str, path: str,
+                 start_date: Optional[date] = None, end_date: Optional[date] = None,
+                 on_batch: Optional[Callable[[int], None]] = None) -> int:
+    """
+    分批读取数据集并写入文件，返回写出的行数
+
+    Raises:
+        RuntimeError: 未安装 pyarrow
+    """
+    if not PYARROW_AVAILABLE:
+        raise RuntimeError("未安装 pyarrow，无法导出 Parquet/Arrow")
+
+    stmt = dataset.statement(db, start_date, end_date).execution_options(yield_per=ROW_GROUP_SIZE)
+    columns = dataset.columns(dataset.table)
+    schema = arrow_schema(columns)
+
+    sink = _SINKS[fmt](path, schema)
+    total = 0
+    try:
+        for rows in db.execute(stmt).partitions():
+            sink.write(to_record_batch(columns, schema, rows))
+            total += len(rows)
+            if on_batch:
+                on_batch(len(rows))
+    finally:
+        sink.close()
+    return total
+
+
+# ---------- 后台任务与文件管理 ----------
+
+def export_path(job_id: str, fmt: str) -> str:
+    return os.path.join(ANALYTICS_EXPORT_DIR, f"{job_id}.{FORMAT_EXTENSIONS[fmt]}")
+
+
+def download_name(job: dict) -> str:
+    return f"{job['dataset']}_{job['created_at'][:10]}.{FORMAT_EXTENSIONS[job['format']]}"
+
+
+def run_analytics_export(job_id: str, dataset_name: str, fmt: str,
+                         start_date: Optional[date] = None, end_date: Optional[date] = None):
+    """后台执行导出任务（在线程池中运行）"""
+    os.makedirs(ANALYTICS_EXPORT_DIR, exist_ok=True)
+    path = export_path(job_id, fmt)
+    partial = f"{path}.part"
+    db = SessionLocal()
+    try:
+        export_tracker.start(job_id)
+        started = time.monotonic()
+        rows = write_export(
+            db, DATASETS[dataset_name], fmt, partial, start_date, end_date,
+            on_batch=lambda count: export_tracker.advance(job_id, processed=count, succeeded=count),
+        )
+        os.replace(partial, path)
+        export_tracker.complete(
+            job_id,
+            result={
+                "rows": rows,
+                "size_bytes": os.path.getsize(path),
+                "duration_seconds": round(time.monotonic() - started, 3),
+            },
+            message="导出完成",
+        )
+    except Exception as e:
+        export_tracker.fail(job_id, f"导出失败: {e}")
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+    finally:
+        db.close()
+
+
+def purge_expired_exports(max_age: int = JOB_TTL) -> dict:
+    """删除超过保留时间的导出文件（任务记录过期后文件无法再下载）"""
+    if not os.path.isdir(ANALYTICS_EXPORT_DIR):
+        return {"removed": 0}
+    cutoff = time.time() - max_age
+    removed = 0
+    for entry in os.scandir(ANALYTICS_EXPORT_DIR):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError as e:
+            logger.warning(f"删除过期导出文件失败 {entry.path}: {e}")
+    return {"removed": removed}
@@ -55,7 +55,7 @@ from backend.models import (
 )
 
 print("正在导入路由模块...")
-from backend.routers import records, reagents, consumables, users, approvals
+from backend.routers import records, reagents, consumables, users, approvals, inventory, exports, archive
 from backend.routers.mcp_routes import router as mcp_router
 
 from backend.cached_reagents import router as cached_reagents_router
@@ -64,9 +64,19 @@ from backend.cached_devices import router as cached_devices_router
 
 print("正在导入认证与工具模块...")
 from backend.auth import get_current_user
-from backend.notification_routes import router as notification_router
+from backend.notification_routes import router as notification_router, notification_manager, run_heartbeat_flush
 from backend.query_optimization import OptimizedQueries, monitor_query_performance
-from backend.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from backend.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, SCHEDULER_ENABLED, MAINTENANCE_SCHEDULE_INTERVAL, DEVICE_USAGE_ROLLUP_INTERVAL, REAGENT_EXPIRY_ROLLOVER_INTERVAL, LOW_STOCK_CHECK_INTERVAL, INVENTORY_SNAPSHOT_INTERVAL, STOCK_FORECAST_INTERVAL, USAGE_ROLLUP_INTERVAL, ANALYTICS_EXPORT_CLEANUP_INTERVAL, ARCHIVE_INTERVAL, NOTIFICATION_BACKPLANE, HEARTBEAT_FLUSH_INTERVAL
+from backend.background_jobs import scheduler
+from backend.maintenance_scheduler import run_maintenance_job
+from backend.device_usage_rollup import run_usage_rollup
+from backend.reagent_expiry import run_expiry_rollover
+from backend.low_stock import run_low_stock_job
+from backend.inventory_ledger import run_inventory_snapshot
+from backend.consumption_forecast import run_forecast_job
+from backend.usage_rollup import run_usage_daily_rollup
+from backend.analytics_export import purge_expired_exports
+from backend.data_archive import run_archive_job
 
 from pydantic import BaseModel
 from passlib.context import CryptContext
@@ -184,6 +194,9 @@ app.include_router(reagents.router)
 app.include_router(consumables.router)
 app.include_router(users.router)
 app.include_router(approvals.router)
+app.include_router(inventory.router)
+app.include_router(exports.router)
+app.include_router(archive.router)
 
 app.include_router(cached_reagents_router, prefix="/api")
 app.include_router(cached_consumables_router, prefix="/api")
@@ -199,6 +212,34 @@ app.include_router(mcp_router)
 async def on_startup():
     init_database()
     print("数据库初始化完成")
+
+    await notification_manager.start_backplane(NOTIFICATION_BACKPLANE)
+
+    # 心跳写回处理的是本进程内的状态，与 SCHEDULER_ENABLED 无关，每个 worker 都要运行
+    scheduler.register("websocket_heartbeat_flush", run_heartbeat_flush, HEARTBEAT_FLUSH_INTERVAL,
+                       initial_delay=HEARTBEAT_FLUSH_INTERVAL, per_worker=True)
+
+    if SCHEDULER_ENABLED:
+        scheduler.register("maintenance_schedule", run_maintenance_job, MAINTENANCE_SCHEDULE_INTERVAL, initial_delay=30)
+        scheduler.register("device_usage_rollup", run_usage_rollup, DEVICE_USAGE_ROLLUP_INTERVAL, initial_delay=60)
+        scheduler.register("reagent_expiry_rollover", run_expiry_rollover, REAGENT_EXPIRY_ROLLOVER_INTERVAL, initial_delay=20)
+        scheduler.register("low_stock_check", run_low_stock_job, LOW_STOCK_CHECK_INTERVAL, initial_delay=40)
+        scheduler.register("inventory_snapshot", run_inventory_snapshot, INVENTORY_SNAPSHOT_INTERVAL, initial_delay=90)
+        scheduler.register("stock_forecast", run_forecast_job, STOCK_FORECAST_INTERVAL, initial_delay=120)
+        scheduler.register("usage_daily_rollup", run_usage_daily_rollup, USAGE_ROLLUP_INTERVAL, initial_delay=75)
+        scheduler.register("analytics_export_cleanup", purge_expired_exports, ANALYTICS_EXPORT_CLEANUP_INTERVAL, initial_delay=300)
+        scheduler.register("data_archive", run_archive_job, ARCHIVE_INTERVAL, initial_delay=600)
+    await scheduler.start()
+    print("后台任务调度器已启动" if SCHEDULER_ENABLED else "后台任务调度器已启动（仅运行每个 worker 的心跳写回）")
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await scheduler.stop()
+    await notification_manager.stop_backplane()
+    run_heartbeat_flush()
+
+
 if __name__ == "__main__":
     uvicorn.run(
         "backend.app:app",
@@ -0,0 +1,113 @@
+# backend/approval_events.py
+
+"""
+审批队列实时推送
+
+申请创建和审批决定提交后，通过通知 WebSocket 向拥有
+request.approve 权限的用户推送变更（审批决定同时推送给申请人），
+审批端不再轮询申请列表。推送经背板送到用户所在的 worker，只有
+在线用户收到，不写通知表；单 worker 部署下没有在线用户时不产生
+任何查询。
+
+消息格式：
+    {"type": "approval_queue", "event": "request_created" | "request_decided",
+     "requests": [...]}
+
+推送消息不带同步游标：推送在提交后立即发出，更新时间更早的其他申请
+可能稍后才提交，用推送的位置作为游标会跳过这些申请。客户端按
+request_id 合并推送的申请，游标只取自 /api/approvals/changes 的返回值，
+断线重连后从最后一次同步返回的游标继续增量同步。
+"""
+
+import logging
+from datetime import datetime
+from typing import Iterable, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from notification_backplane import CHANNEL_APPROVAL_QUEUE
+from notification_service import notification_manager
+from permissions import Permissions, users_with_permission
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_TYPE = "approval_queue"
+EVENT_CREATED = "request_created"
+EVENT_DECIDED = "request_decided"
+
+_CURSOR_SEPARATOR = "_"
+
+
+def encode_cursor(updated_at: datetime, request_id: int) -> str:
+    return f"{updated_at.isoformat()}{_CURSOR_SEPARATOR}{request_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Raises:
+        ValueError: 游标格式无效
+    """
+    timestamp, _, request_id = cursor.rpartition(_CURSOR_SEPARATOR)
+    return datetime.fromisoformat(timestamp), int(request_id)
+
+
+def request_payload(req) -> dict:
+    """申请的推送数据（字段与 ApprovalRequest 一致，另附审批信息）"""
+    return {
+        "request_id": req.id,
+        "request_type": req.request_type,
+        "item_id": req.item_id,
+        "item_name": req.item_name,
+        "quantity": req.quantity,
+        "unit": req.unit,
+        "purpose": req.purpose,
+        "notes": req.notes,
+        "requester_id": req.requester_id,
+        "requester_name": req.requester.username if req.requester else "",
+        "created_at": req.created_at.isoformat() if req.created_at else None,
+        "status": req.status,
+        "approved_by_id": req.approved_by_id,
+        "approved_at": req.approved_at.isoformat() if req.approved_at else None,
+        "updated_at": req.updated_at.isoformat() if req.updated_at else None,
+    }
+
+
+def _message(event: str, payloads: List[dict]) -> dict:
+    return {
+        "type": MESSAGE_TYPE,
+        "event": event,
+        "requests": payloads,
+    }
+
+
+def publish_request_events(db: Session, event: str, payloads: Iterable[dict]) -> int:
+    """
+    推送一批申请变更（在提交之后调用；payloads 应在提交前构造，避免提交后逐行刷新）
+
+    Returns:
+        推送的目标用户数
+    """
+    payloads = list(payloads)
+    if not payloads:
+        return 0
+    # 跨 worker 分发时在线用户可能连接在其他 worker 上，推送给全部审批人
+    online = None if notification_manager.is_distributed else notification_manager.get_online_users()
+    if online is not None and not online:
+        return 0
+
+    try:
+        approvers = users_with_permission(db, Permissions.REQUEST_APPROVE, online)
+    except Exception as e:
+        logger.warning(f"查询审批人失败，跳过审批队列推送: {e}")
+        return 0
+
+    delivered = notification_manager.publish_to_users(approvers, _message(event, payloads), CHANNEL_APPROVAL_QUEUE)
+    if event == EVENT_DECIDED:
+        # 申请人只收到自己的申请
+        by_requester = {}
+        for payload in payloads:
+            if payload["requester_id"] not in approvers:
+                by_requester.setdefault(payload["requester_id"], []).append(payload)
+        for requester_id, own in by_requester.items():
+            delivered += notification_manager.publish_to_users([requester_id], _message(event, own), CHANNEL_APPROVAL_QUEUE)
+    return delivered
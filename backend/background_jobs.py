@@ -0,0 +1,166 @@
+# backend/background_jobs.py
+
+"""
+周期性后台任务调度
+
+在应用事件循环中按固定间隔运行注册的任务。同步任务放到线程池执行，
+不阻塞请求处理；Redis 可用时每个周期通过 SET NX 抢占一把带过期时间的锁，
+保证多 worker 部署下同一任务每个周期只在一个进程中运行。
+"""
+
+import asyncio
+import inspect
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from redis_cache import redis_cache
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY_PREFIX = "locks:jobs:"
+
+
+@dataclass
+class ScheduledJob:
+    """已注册的周期任务"""
+    name: str
+    func: Callable[[], Any]
+    interval: int  # 运行间隔（秒）
+    initial_delay: int = 0
+    lock_ttl: int = 0  # 周期锁过期时间（秒），0 表示略短于运行间隔
+    per_worker: bool = False  # 每个 worker 都运行（处理进程内状态），不抢占周期锁
+    last_started: Optional[datetime] = None
+    last_finished: Optional[datetime] = None
+    last_status: Optional[str] = None
+    last_error: Optional[str] = None
+    last_duration: Optional[float] = None
+    last_result: Any = None
+    runs: int = 0
+    skipped: int = 0
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+
+class JobScheduler:
+    """基于 asyncio 的周期任务调度器"""
+
+    def __init__(self, cache=None):
+        self.cache = cache or redis_cache
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self.running = False
+
+    def register(self, name: str, func: Callable[[], Any], interval: int,
+                 initial_delay: int = 0, lock_ttl: int = 0, per_worker: bool = False) -> ScheduledJob:
+        """注册周期任务（同步函数或协程函数均可）"""
+        job = ScheduledJob(
+            name=name,
+            func=func,
+            interval=interval,
+            initial_delay=initial_delay,
+            lock_ttl=lock_ttl or max(interval - 1, 1),
+            per_worker=per_worker,
+        )
+        self.jobs[name] = job
+        if self.running:
+            job.task = asyncio.create_task(self._loop(job))
+        return job
+
+    async def start(self):
+        """启动所有已注册任务，需在事件循环内调用"""
+        if self.running:
+            return
+        self.running = True
+        for job in self.jobs.values():
+            job.task = asyncio.create_task(self._loop(job))
+        logger.info(f"后台任务调度器已启动，共 {len(self.jobs)} 个任务")
+
+    async def stop(self):
+        """停止所有任务"""
+        self.running = False
+        tasks = [job.task for job in self.jobs.values() if job.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for job in self.jobs.values():
+            job.task = None
+
+    async def run_now(self, name: str) -> Dict[str, Any]:
+        """立即运行一次指定任务（不占用周期锁）并返回其状态"""
+        job = self.jobs.get(name)
+        if job is None:
+            raise KeyError(name)
+        await self._run(job, force=True)
+        return self._describe(job)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """所有任务的运行状态"""
+        return {name: self._describe(job) for name, job in self.jobs.items()}
+
+    async def _loop(self, job: ScheduledJob):
+        if job.initial_delay:
+            await asyncio.sleep(job.initial_delay)
+        while self.running:
+            await self._run(job)
+            await asyncio.sleep(job.interval)
+
+    def _acquire_lock(self, job: ScheduledJob) -> bool:
+        """
+        抢占本周期的运行锁
+
+        锁在 lock_ttl 后自然过期而不主动释放，这样各 worker 的定时器
+        错开时也不会在同一周期内重复运行；Redis 不可用时视为单进程。
+        """
+        if not self.cache.is_connected:
+            return True
+        try:
+            return bool(self.cache.redis_client.set(
+                LOCK_KEY_PREFIX + job.name, uuid.uuid4().hex, nx=True, ex=job.lock_ttl
+            ))
+        except Exception as e:
+            logger.warning(f"获取任务锁失败 {job.name}: {e}")
+            return True
+
+    async def _run(self, job: ScheduledJob, force: bool = False):
+        if not force and not job.per_worker and not self._acquire_lock(job):
+            # 本周期已由其他 worker 运行
+            job.skipped += 1
+            return
+
+        job.last_started = datetime.utcnow()
+        started = time.time()
+        try:
+            if inspect.iscoroutinefunction(job.func):
+                job.last_result = await job.func()
+            else:
+                job.last_result = await asyncio.to_thread(job.func)
+            job.last_status = "success"
+            job.last_error = None
+        except Exception as e:
+            job.last_status = "failed"
+            job.last_error = str(e)
+            logger.exception(f"后台任务 {job.name} 执行失败: {e}")
+        finally:
+            job.runs += 1
+            job.last_duration = round(time.time() - started, 3)
+            job.last_finished = datetime.utcnow()
+
+    @staticmethod
+    def _describe(job: ScheduledJob) -> Dict[str, Any]:
+        return {
+            "interval": job.interval,
+            "runs": job.runs,
+            "skipped": job.skipped,
+            "last_status": job.last_status,
+            "last_error": job.last_error,
+            "last_duration": job.last_duration,
+            "last_started": job.last_started.isoformat() if job.last_started else None,
+            "last_finished": job.last_finished.isoformat() if job.last_finished else None,
+            "last_result": job.last_result,
+        }
+
+
+# 全局调度器实例
+scheduler = JobScheduler()
@@ -12,6 +12,8 @@ from pydantic import BaseModel
 from redis_cache import RedisCache, cache_result, invalidate_cache_pattern
 from redis_config import redis_config
 from cache_config import CacheConfig, CacheType, invalidate_related_caches
+from low_stock import low_stock_query
+from inventory_ledger import REASON_RECEIVE, REASON_USE, set_movement_context
 
 # 创建路由器
 router = APIRouter(prefix="/consumables", tags=["consumables"])
@@ -157,7 +159,7 @@ def get_consumables(
             Consumable.model.contains(search)
         )
     if low_stock:
-        query = query.filter(Consumable.quantity <= Consumable.min_stock)
+        query = query.filter(Consumable.is_low_stock == True)
     
     # 排序
     if sort_by == "name":
@@ -320,7 +322,7 @@ def get_low_stock_consumables(
         return [deserialize_consumable(item) for item in cached_data]
     
     # 从数据库查询
-    consumables = db.query(Consumable).filter(Consumable.quantity <= Consumable.min_stock).all()
+    consumables = low_stock_query(db, Consumable).all()
     result = [serialize_consumable(consumable) for consumable in consumables]
     
     # 缓存结果
@@ -343,6 +345,7 @@ def receive_consumable(
         raise HTTPException(status_code=404, detail="耗材不存在")
     
     # 更新库存
+    set_movement_context(db, REASON_RECEIVE, user_id=current_user.id)
     consumable.quantity = (consumable.quantity or 0) + receive_data.quantity
     if receive_data.supplier:
         consumable.supplier = receive_data.supplier
@@ -375,6 +378,7 @@ def use_consumable(
         raise HTTPException(status_code=400, detail="库存不足")
     
     # 更新库存
+    set_movement_context(db, REASON_USE, user_id=current_user.id)
     consumable.quantity = (consumable.quantity or 0) - quantity
     consumable.updated_at = datetime.utcnow()
     
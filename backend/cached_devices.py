@@ -1,18 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Query, UploadFile, status
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+from fastapi.encoders import jsonable_encoder
 from typing import List, Optional, Dict, Any
 from datetime import datetime, date, timedelta
 import json
+import os
+import tempfile
 
 from database import get_db
-from models import Device, DeviceMaintenance, DeviceReservation, User, ExperimentRecord
+from models import Device, DeviceMaintenance, DeviceReservation, DeviceBorrow, DeviceUsageDaily, User, ExperimentRecord
 from auth import get_current_user, require_admin
-from permissions import require_permission, Permissions, PermissionChecker, get_permission_checker
+from permissions import require_permission, Permissions, AuthContext, get_auth_context
 from pydantic import BaseModel
 from redis_cache import RedisCache, cache_result, invalidate_cache_pattern
 from redis_config import redis_config
 from cache_config import CacheConfig, CacheType, invalidate_related_cache
 from query_optimization import OptimizedQueries, monitor_query_performance
+from device_import import import_tracker, detect_format, find_existing_serials, run_device_import
+from device_availability import get_availability_calendar, BUSY_RESERVATION_STATUSES
+from reservation_locks import device_locks, LockTimeout
+from maintenance_scheduler import get_due_snapshot, select_due, sync_due_snapshot
+from device_usage_rollup import get_utilization_leaderboard, get_monthly_trend, run_usage_rollup
 
 # 创建路由器
 router = APIRouter(prefix="/devices", tags=["devices"])
@@ -192,14 +202,13 @@ def get_devices(
     sort_by: Optional[str] = "name",
     sort_order: Optional[str] = "asc",
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
-    permission_checker: PermissionChecker = Depends(get_permission_checker)
+    auth: AuthContext = Depends(get_auth_context)
 ):
     """获取设备列表（带缓存）"""
     # 检查权限
-    if not permission_checker.user_has_permission(current_user, Permissions.DEVICE_READ):
+    if not auth.has_permission(Permissions.DEVICE_READ):
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
+            status_code=403,  # 参数status遮蔽了fastapi.status模块
             detail="权限不足：需要设备读取权限"
         )
     
@@ -375,6 +384,7 @@ def create_device(
     patterns = CacheConfig.get_invalidation_patterns(CacheType.DEVICES)
     for pattern in patterns:
         invalidate_cache_pattern(pattern)
+    sync_due_snapshot(db, [device_id])
     
     return {"message": "设备创建成功", "id": device_id}
 
@@ -407,60 +417,87 @@ def update_device(
     patterns = CacheConfig.get_invalidation_patterns(CacheType.DEVICES)
     for pattern in patterns:
         invalidate_cache_pattern(pattern)
+    sync_due_snapshot(db, [device_id])
     
     return {"message": "设备更新成功"}
 
+# 级联删除时每条 IN 语句携带的最大ID数（SQLite 默认变量上限为 999）
+DELETE_CHUNK_SIZE = 500
+
+# 依赖设备的关联表，按删除顺序排列：(结果字段, 模型)
+DEVICE_DEPENDENT_TABLES = [
+    ("maintenance_records_deleted", DeviceMaintenance),
+    ("reservation_records_deleted", DeviceReservation),
+    ("experiment_records_deleted", ExperimentRecord),
+    ("borrow_records_deleted", DeviceBorrow),
+    ("usage_rollup_rows_deleted", DeviceUsageDaily),
+]
+
+def _chunked(ids: List[int], size: int = DELETE_CHUNK_SIZE):
+    """将ID列表按固定大小切块"""
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+def _cascade_delete_devices(db: Session, device_ids: List[int], dry_run: bool = False) -> Dict[str, int]:
+    """
+    按集合删除设备及其关联数据
+
+    对每个关联表执行 DELETE ... WHERE device_id IN (...)，不加载ORM对象；
+    dry_run 时只执行 COUNT 统计各表将被删除的行数。调用方负责提交或回滚。
+    """
+    counts = {key: 0 for key, _ in DEVICE_DEPENDENT_TABLES}
+    counts["devices_deleted"] = 0
+
+    for chunk in _chunked(device_ids):
+        for key, model in DEVICE_DEPENDENT_TABLES:
+            if dry_run:
+                counts[key] += db.query(func.count(model.id)).filter(
+                    model.device_id.in_(chunk)
+                ).scalar() or 0
+            else:
+                counts[key] += db.query(model).filter(
+                    model.device_id.in_(chunk)
+                ).delete(synchronize_session=False)
+
+        if dry_run:
+            counts["devices_deleted"] += db.query(func.count(Device.id)).filter(
+                Device.id.in_(chunk)
+            ).scalar() or 0
+        else:
+            counts["devices_deleted"] += db.query(Device).filter(
+                Device.id.in_(chunk)
+            ).delete(synchronize_session=False)
+
+    return counts
+
+def _invalidate_device_caches():
+    """清除设备相关缓存"""
+    patterns = CacheConfig.get_invalidation_patterns(CacheType.DEVICES)
+    for pattern in patterns:
+        invalidate_cache_pattern(pattern)
+
 @router.delete("/{device_id}", response_model=dict)
 def delete_device(
     device_id: int,
+    dry_run: bool = False,
     db: Session = Depends(get_db),
     current_user: User = Depends(require_admin)
 ):
-    """删除设备（安全删除，先删除关联数据）"""
-    db_device = db.query(Device).filter(Device.id == device_id).first()
-    if not db_device:
+    """删除设备（安全删除，先删除关联数据；dry_run=true 时仅统计不删除）"""
+    exists = db.query(Device.id).filter(Device.id == device_id).first()
+    if not exists:
         raise HTTPException(status_code=404, detail="设备不存在")
     
     try:
-        # 1. 删除设备维护记录
-        maintenance_records = db.query(DeviceMaintenance).filter(
-            DeviceMaintenance.device_id == device_id
-        ).all()
-        maintenance_count = len(maintenance_records)
-        for record in maintenance_records:
-            db.delete(record)
-        
-        # 2. 删除设备预约记录
-        reservation_records = db.query(DeviceReservation).filter(
-            DeviceReservation.device_id == device_id
-        ).all()
-        reservation_count = len(reservation_records)
-        for record in reservation_records:
-            db.delete(record)
-        
-        # 3. 删除实验记录
-        experiment_records = db.query(ExperimentRecord).filter(
-            ExperimentRecord.device_id == device_id
-        ).all()
-        experiment_count = len(experiment_records)
-        for record in experiment_records:
-            db.delete(record)
-        
-        # 4. 删除设备本身
-        db.delete(db_device)
+        counts = _cascade_delete_devices(db, [device_id], dry_run=dry_run)
+        if dry_run:
+            return {"message": "预检完成，未删除任何数据", "dry_run": True, **counts}
+
         db.commit()
+        _invalidate_device_caches()
+        sync_due_snapshot(db, [device_id])
         
-        # 清除相关缓存
-        patterns = CacheConfig.get_invalidation_patterns(CacheType.DEVICES)
-        for pattern in patterns:
-            invalidate_cache_pattern(pattern)
-        
-        return {
-            "message": "设备删除成功",
-            "maintenance_records_deleted": maintenance_count,
-            "reservation_records_deleted": reservation_count,
-            "experiment_records_deleted": experiment_count
-        }
+        return {"message": "设备删除成功", **counts}
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"删除失败: {str(e)}")
@@ -468,16 +505,22 @@ def delete_device(
 @router.post("/bulk-delete", response_model=dict)
 def bulk_delete_devices(
     device_ids: List[int],
+    dry_run: bool = False,
     db: Session = Depends(get_db),
     current_user: User = Depends(require_admin)
 ):
-    """批量删除设备（安全删除，先删除关联数据）"""
+    """批量删除设备（安全删除，先删除关联数据；dry_run=true 时仅统计不删除）"""
     if not device_ids:
         raise HTTPException(status_code=400, detail="设备ID列表不能为空")
     
-    # 查找所有要删除的设备
-    devices = db.query(Device).filter(Device.id.in_(device_ids)).all()
-    found_ids = [device.id for device in devices]
+    device_ids = list(dict.fromkeys(device_ids))
+
+    # 只查询ID确认设备存在，不加载设备对象
+    found_ids = set()
+    for chunk in _chunked(device_ids):
+        found_ids.update(
+            row[0] for row in db.query(Device.id).filter(Device.id.in_(chunk)).all()
+        )
     missing_ids = [device_id for device_id in device_ids if device_id not in found_ids]
     
     if missing_ids:
@@ -488,48 +531,24 @@ def bulk_delete_devices(
     
     # 安全删除设备（先删除关联数据）
     try:
-        # 1. 删除设备维护记录
-        maintenance_records = db.query(DeviceMaintenance).filter(
-            DeviceMaintenance.device_id.in_(device_ids)
-        ).all()
-        maintenance_count = len(maintenance_records)
-        for record in maintenance_records:
-            db.delete(record)
-        
-        # 2. 删除设备预约记录
-        reservation_records = db.query(DeviceReservation).filter(
-            DeviceReservation.device_id.in_(device_ids)
-        ).all()
-        reservation_count = len(reservation_records)
-        for record in reservation_records:
-            db.delete(record)
-        
-        # 3. 删除实验记录
-        experiment_records = db.query(ExperimentRecord).filter(
-            ExperimentRecord.device_id.in_(device_ids)
-        ).all()
-        experiment_count = len(experiment_records)
-        for record in experiment_records:
-            db.delete(record)
-        
-        # 4. 删除设备本身
-        for device in devices:
-            db.delete(device)
-        
+        counts = _cascade_delete_devices(db, device_ids, dry_run=dry_run)
+        if dry_run:
+            return {
+                "message": f"预检完成，将删除 {len(device_ids)} 个设备",
+                "dry_run": True,
+                "device_ids": device_ids,
+                **counts
+            }
+
         db.commit()
-        
-        # 清除相关缓存
-        patterns = CacheConfig.get_invalidation_patterns(CacheType.DEVICES)
-        for pattern in patterns:
-            invalidate_cache_pattern(pattern)
+        _invalidate_device_caches()
+        sync_due_snapshot(db, device_ids)
         
         return {
             "message": f"成功删除 {len(device_ids)} 个设备",
             "deleted_count": len(device_ids),
             "deleted_ids": device_ids,
-            "maintenance_records_deleted": maintenance_count,
-            "reservation_records_deleted": reservation_count,
-            "experiment_records_deleted": experiment_count
+            **counts
         }
     except Exception as e:
         db.rollback()
@@ -542,7 +561,11 @@ def get_devices_needing_maintenance(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """获取需要维护的设备列表（带缓存）"""
+    """获取需要维护的设备列表（优先读取后台任务生成的快照）"""
+    snapshot = get_due_snapshot()
+    if snapshot and days_ahead <= snapshot.get("horizon_days", 0):
+        return select_due(snapshot, days_ahead)
+
     cache_key = CacheConfig.get_cache_key(CacheType.DEVICES, f"maintenance_needed:days_ahead={days_ahead}")
     
     # 尝试从缓存获取
@@ -624,6 +647,7 @@ def create_maintenance_record(
     
     # 清除相关缓存
     invalidate_related_cache(CacheType.DEVICES)
+    sync_due_snapshot(db, [device_id])
     
     return {"message": "维护记录创建成功", "id": db_maintenance.id}
 
@@ -758,6 +782,19 @@ def get_device_borrows(
     return borrows
 
 # 设备预约相关API
+def _has_conflicting_reservation(db: Session, device_id: int, start_time: datetime, end_time: datetime,
+                                 exclude_id: Optional[int] = None) -> bool:
+    """检查设备在时间段内是否已有有效预约（调用方需持有设备锁）"""
+    query = db.query(DeviceReservation.id).filter(
+        DeviceReservation.device_id == device_id,
+        DeviceReservation.status.in_(BUSY_RESERVATION_STATUSES),
+        DeviceReservation.start_time < end_time,
+        DeviceReservation.end_time > start_time
+    )
+    if exclude_id is not None:
+        query = query.filter(DeviceReservation.id != exclude_id)
+    return query.first() is not None
+
 @router.post("/{device_id}/reservations", response_model=dict)
 def create_device_reservation(
     device_id: int,
@@ -779,31 +816,30 @@ def create_device_reservation(
     if reservation.start_time >= reservation.end_time:
         raise HTTPException(status_code=400, detail="开始时间必须早于结束时间")
     
-    # 检查是否与现有预约冲突
-    conflicting_reservation = db.query(DeviceReservation).filter(
-        DeviceReservation.device_id == device_id,
-        DeviceReservation.status.in_(["pending", "approved"]),
-        (
-            (DeviceReservation.start_time < reservation.end_time) &
-            (DeviceReservation.end_time > reservation.start_time)
-        )
-    ).first()
-    
-    if conflicting_reservation:
+    # 冲突检查和写入在同一把设备锁内完成，不同设备的预约可并行
+    try:
+        with device_locks.device_lock(device_id):
+            if _has_conflicting_reservation(db, device_id, reservation.start_time, reservation.end_time):
+                raise HTTPException(status_code=400, detail="该时间段设备已被预约")
+            
+            # 创建预约记录
+            db_reservation = DeviceReservation(
+                device_id=device_id,
+                user_id=current_user.id,
+                start_time=reservation.start_time,
+                end_time=reservation.end_time,
+                purpose=reservation.purpose,
+                notes=reservation.notes
+            )
+            
+            db.add(db_reservation)
+            db.commit()
+    except LockTimeout as e:
+        raise HTTPException(status_code=409, detail=f"{e}，请稍后重试")
+    except IntegrityError:
+        # PostgreSQL 排他约束拒绝了重叠预约
+        db.rollback()
         raise HTTPException(status_code=400, detail="该时间段设备已被预约")
-    
-    # 创建预约记录
-    db_reservation = DeviceReservation(
-        device_id=device_id,
-        user_id=current_user.id,
-        start_time=reservation.start_time,
-        end_time=reservation.end_time,
-        purpose=reservation.purpose,
-        notes=reservation.notes
-    )
-    
-    db.add(db_reservation)
-    db.commit()
     db.refresh(db_reservation)
     
     # 清除相关缓存
@@ -842,6 +878,185 @@ def get_device_reservations(
     
     return reservations
 
+# 可用性日历单次查询的最大时间跨度和设备数
+AVAILABILITY_MAX_DAYS = 31
+AVAILABILITY_MAX_DEVICES = 200
+
+@router.get("/availability/calendar", response_model=List[dict])
+@monitor_query_performance
+def get_devices_availability_calendar(
+    start: datetime,
+    end: datetime,
+    device_ids: Optional[List[int]] = Query(None),
+    location: Optional[str] = None,
+    min_slot_minutes: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """获取多台设备在时间范围内的忙碌区间和空闲时段"""
+    if not device_ids and not location:
+        raise HTTPException(status_code=400, detail="必须提供 device_ids 或 location")
+
+    # 预约时间以不带时区的形式存储
+    start = start.replace(tzinfo=None)
+    end = end.replace(tzinfo=None)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="开始时间必须早于结束时间")
+    if end - start > timedelta(days=AVAILABILITY_MAX_DAYS):
+        raise HTTPException(status_code=400, detail=f"查询范围不能超过 {AVAILABILITY_MAX_DAYS} 天")
+    if device_ids and len(device_ids) > AVAILABILITY_MAX_DEVICES:
+        raise HTTPException(status_code=400, detail=f"单次最多查询 {AVAILABILITY_MAX_DEVICES} 台设备")
+
+    return get_availability_calendar(
+        db,
+        start,
+        end,
+        device_ids=device_ids,
+        location=location,
+        min_slot_minutes=min_slot_minutes,
+    )
+
+@router.get("/{device_id}/usage-stats", response_model=dict)
+def get_device_usage_stats(
+    device_id: int,
+    days: int = Query(30, ge=1, le=366),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """获取单台设备的使用统计（基于每日使用汇总）"""
+    exists = db.query(Device.id).filter(Device.id == device_id).first()
+    if not exists:
+        raise HTTPException(status_code=404, detail="设备不存在")
+    
+    stats = OptimizedQueries(db).get_device_usage_stats(device_id, days)
+    return {"device_id": device_id, "days": days, **stats}
+
+@router.get("/utilization/leaderboard", response_model=List[dict])
+@monitor_query_performance
+def get_device_utilization_leaderboard(
+    days: int = Query(30, ge=1, le=366),
+    limit: int = Query(20, ge=1, le=200),
+    location: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """设备利用率排行"""
+    last_day = date.today()
+    first_day = last_day - timedelta(days=days - 1)
+    return get_utilization_leaderboard(db, first_day, last_day, limit=limit, location=location)
+
+@router.get("/utilization/trend", response_model=List[dict])
+@monitor_query_performance
+def get_device_utilization_trend(
+    months: int = Query(12, ge=1, le=36),
+    device_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """设备使用月度趋势（全部设备或单台设备）"""
+    return get_monthly_trend(db, months=months, device_id=device_id)
+
+@router.post("/utilization/rebuild", response_model=dict)
+def rebuild_device_utilization(
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(require_admin)
+):
+    """后台全量重建每日使用汇总"""
+    background_tasks.add_task(run_usage_rollup, True)
+    return {"message": "使用汇总重建任务已提交"}
+
+# 设备概览可选字段
+OVERVIEW_FIELDS = ("device", "maintenance", "reservations", "borrow", "usage")
+
+# 概览中包含的最近维护记录范围
+OVERVIEW_MAINTENANCE_DAYS = 365
+OVERVIEW_MAINTENANCE_LIMIT = 10
+OVERVIEW_RESERVATION_LIMIT = 20
+OVERVIEW_USAGE_DAYS = 30
+
+def _build_device_overview(db: Session, device_id: int) -> Optional[Dict[str, Any]]:
+    """一次查询加载设备及其近期维护、未结束预约和借用中记录"""
+    now = datetime.utcnow()
+    maintenance_since = now.date() - timedelta(days=OVERVIEW_MAINTENANCE_DAYS)
+
+    device = db.query(Device).options(
+        selectinload(Device.maintenance_records.and_(
+            DeviceMaintenance.maintenance_date >= maintenance_since
+        )),
+        selectinload(Device.reservations.and_(
+            DeviceReservation.end_time >= now,
+            DeviceReservation.status.in_(BUSY_RESERVATION_STATUSES)
+        )),
+        selectinload(Device.borrows.and_(
+            DeviceBorrow.status == "borrowed"
+        )),
+    ).filter(Device.id == device_id).first()
+    if not device:
+        return None
+
+    maintenance = sorted(
+        device.maintenance_records,
+        key=lambda m: (m.maintenance_date or date.min, m.id),
+        reverse=True
+    )[:OVERVIEW_MAINTENANCE_LIMIT]
+    reservations = sorted(device.reservations, key=lambda r: r.start_time)[:OVERVIEW_RESERVATION_LIMIT]
+    active_borrow = max(device.borrows, key=lambda b: b.borrow_time, default=None)
+
+    return jsonable_encoder({
+        "device": DeviceResponse.from_orm(device),
+        "maintenance": [MaintenanceResponse.from_orm(m) for m in maintenance],
+        "reservations": [ReservationResponse.from_orm(r) for r in reservations],
+        "borrow": DeviceBorrowResponse.from_orm(active_borrow) if active_borrow else None,
+        "usage": {
+            "days": OVERVIEW_USAGE_DAYS,
+            **OptimizedQueries(db).get_device_usage_stats(device_id, OVERVIEW_USAGE_DAYS)
+        },
+    })
+
+@router.get("/{device_id}/overview", response_model=dict)
+def get_device_overview(
+    device_id: int,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    设备详情概览（设备信息、近期维护、未结束预约、借用中记录、使用统计）
+
+    整体作为一个缓存单元，fields 为逗号分隔的字段列表，默认返回全部字段
+    """
+    if fields:
+        selected = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in selected if f not in OVERVIEW_FIELDS]
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"未知字段: {unknown}，可选字段: {list(OVERVIEW_FIELDS)}"
+            )
+    else:
+        selected = list(OVERVIEW_FIELDS)
+
+    cache_key = CacheConfig.get_cache_key(CacheType.DEVICES, f"overview:id={device_id}")
+    overview = redis_cache.get(cache_key)
+    if not overview:
+        overview = _build_device_overview(db, device_id)
+        if overview is None:
+            raise HTTPException(status_code=404, detail="设备不存在")
+        redis_cache.set(cache_key, overview, ttl=CacheConfig.get_ttl(CacheType.DEVICES))
+
+    return {field: overview.get(field) for field in selected}
+
+@router.get("/reservations/lock-stats", response_model=dict)
+def get_reservation_lock_stats(
+    reset: bool = False,
+    current_user: User = Depends(require_admin)
+):
+    """预约设备锁的等待时间统计"""
+    stats = device_locks.stats.snapshot()
+    if reset:
+        device_locks.stats.reset()
+    return {"stripes": device_locks.stripes, "stats": stats}
+
 @router.get("/reservations/my", response_model=List[ReservationResponse])
 def get_my_reservations(
     status: Optional[str] = None,
@@ -885,11 +1100,33 @@ def update_reservation(
     
     # 更新字段
     update_data = reservation_update.dict(exclude_unset=True)
+    reactivating = (
+        update_data.get("status") in BUSY_RESERVATION_STATUSES
+        and reservation.status not in BUSY_RESERVATION_STATUSES
+    )
     for field, value in update_data.items():
         setattr(reservation, field, value)
     
     reservation.updated_at = datetime.utcnow()
-    db.commit()
+    if reactivating:
+        # 重新启用的预约同样需要在设备锁内检查冲突
+        try:
+            with device_locks.device_lock(reservation.device_id):
+                if _has_conflicting_reservation(
+                    db, reservation.device_id, reservation.start_time, reservation.end_time,
+                    exclude_id=reservation.id
+                ):
+                    db.rollback()
+                    raise HTTPException(status_code=400, detail="该时间段设备已被预约")
+                db.commit()
+        except LockTimeout as e:
+            db.rollback()
+            raise HTTPException(status_code=409, detail=f"{e}，请稍后重试")
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(status_code=400, detail="该时间段设备已被预约")
+    else:
+        db.commit()
     
     # 清除相关缓存
     invalidate_related_cache(CacheType.DEVICES)
@@ -964,7 +1201,7 @@ def warmup_device_cache(
     get_devices_needing_maintenance(db=db, current_user=current_user)
     
     # 预热第一页设备数据
-    get_devices(db=db, current_user=current_user)
+    get_devices(db=db, auth=AuthContext.for_user(current_user, db))
     
     return {"message": "设备缓存预热完成"}
 
@@ -982,8 +1219,15 @@ def batch_import_devices(
     failed_count = 0
     errors = []
     used_serial_numbers = set()  # 跟踪当前事务中使用的序列号
+    created_devices = []
     
     try:
+        # 一次性查出数据库中已存在的序列号，避免逐行查询
+        existing_serials = find_existing_serials(
+            db,
+            (d.serial_number for d in import_data.devices if d.serial_number not in [None, '', '/', '-'])
+        )
+
         for i, device_data in enumerate(import_data.devices):
             try:
                 # 数据清理和验证
@@ -1003,9 +1247,8 @@ def batch_import_devices(
                 serial_number = device_dict.get('serial_number')
                 if serial_number:
                     # 检查数据库中是否已存在
-                    existing = db.query(Device).filter(Device.serial_number == serial_number).first()
-                    if existing:
-                        errors.append(f"第{i+1}行: 序列号 '{serial_number}' 已存在，设备名称: {existing.name}")
+                    if serial_number in existing_serials:
+                        errors.append(f"第{i+1}行: 序列号 '{serial_number}' 已存在，设备名称: {existing_serials[serial_number]}")
                         failed_count += 1
                         continue
                     
@@ -1025,19 +1268,23 @@ def batch_import_devices(
                     db_device.next_maintenance = device_dict['purchase_date'] + timedelta(days=device_dict['maintenance_interval'])
                 
                 db.add(db_device)
+                created_devices.append(db_device)
                 imported_count += 1
                 
             except Exception as e:
                 errors.append(f"第{i+1}行: {str(e)}")
                 failed_count += 1
         
-        # 提交事务
+        # 提交事务（先 flush 取得新设备ID，提交后不再逐个刷新对象）
+        db.flush()
+        new_ids = [d.id for d in created_devices]
         db.commit()
         
         # 清除相关缓存
         patterns = CacheConfig.get_invalidation_patterns(CacheType.DEVICES)
         for pattern in patterns:
             invalidate_cache_pattern(pattern)
+        sync_due_snapshot(db, new_ids)
         
         return {
             "message": "批量导入完成",
@@ -1049,4 +1296,53 @@ def batch_import_devices(
         
     except Exception as e:
         db.rollback()
-        raise HTTPException(status_code=500, detail=f"批量导入失败: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"批量导入失败: {str(e)}")
+
+# 上传文件落盘时每次读取的字节数
+UPLOAD_READ_SIZE = 1024 * 1024
+
+@router.post("/import/stream", response_model=dict)
+async def stream_import_devices(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    current_user: User = Depends(require_admin)
+):
+    """流式批量导入设备（CSV / NDJSON），后台分批写入，返回任务ID"""
+    fmt = detect_format(file.filename, file.content_type)
+    if not fmt:
+        raise HTTPException(status_code=400, detail="仅支持 .csv / .ndjson / .jsonl 文件")
+
+    # 先分块落盘，不把整个文件读入内存
+    fd, path = tempfile.mkstemp(prefix="device_import_", suffix=f".{fmt}")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                data = await file.read(UPLOAD_READ_SIZE)
+                if not data:
+                    break
+                out.write(data)
+    except Exception as e:
+        os.remove(path)
+        raise HTTPException(status_code=500, detail=f"上传文件保存失败: {str(e)}")
+    finally:
+        await file.close()
+
+    job = import_tracker.create(owner_id=current_user.id, filename=file.filename, format=fmt)
+    background_tasks.add_task(run_device_import, job["id"], path, fmt)
+
+    return {
+        "message": "导入任务已创建",
+        "job_id": job["id"],
+        "status_url": f"/api/devices/import/jobs/{job['id']}"
+    }
+
+@router.get("/import/jobs/{job_id}", response_model=dict)
+def get_import_job_status(
+    job_id: str,
+    current_user: User = Depends(require_admin)
+):
+    """查询流式导入任务进度"""
+    job = import_tracker.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="导入任务不存在")
+    return job
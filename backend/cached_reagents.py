@@ -1,6 +1,6 @@
 # backend/routers/cached_reagents.py
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime
@@ -12,6 +12,9 @@ from models import Reagent, User
 from auth import get_current_user, require_admin
 from permissions import check_permission, Permissions
 from pydantic import BaseModel
+from reagent_expiry import expiring_reagents_query, expiring_cache_identifier, get_bucket_counts, timeline_today
+from low_stock import low_stock_query
+from reagent_autocomplete import reagent_autocomplete, INDEXED_FIELDS
 from redis_cache import redis_cache, cache_result, invalidate_cache_pattern
 from redis_config import redis_config
 from cache_config import CacheType, CacheConfig, invalidate_related_cache, cache_key_for_item
@@ -357,37 +360,66 @@ def get_expiring_reagents(
     current_user: User = Depends(check_permission(Permissions.REAGENT_READ))
 ):
     """获取即将过期的试剂（带缓存）"""
-    cache_key = CacheConfig.get_cache_key(CacheType.REAGENTS, f"expiring:{days}")
+    # 缓存键按天稳定，试剂写入时随 reagents:* 一起失效
+    cache_key = CacheConfig.get_cache_key(CacheType.REAGENTS, expiring_cache_identifier(days))
     
     # 尝试从缓存获取
     cached_result = redis_cache.get(cache_key)
     if cached_result:
         return _deserialize_reagents(cached_result)
     
-    # 从数据库查询
-    from datetime import timedelta
-    
-    expiry_threshold = datetime.utcnow() + timedelta(days=days)
-    reagents = db.query(Reagent).filter(
-        Reagent.expiry_date.isnot(None),
-        Reagent.expiry_date <= expiry_threshold
-    ).all()
+    # 从过期时间线分桶查询
+    reagents = expiring_reagents_query(db, days).all()
     
     # 序列化并缓存
     serialized_reagents = _serialize_reagents(reagents)
-    ttl = CacheConfig.get_ttl(CacheType.REAGENTS) // 2  # 过期数据缓存时间较短
+    ttl = CacheConfig.get_ttl(CacheType.REAGENTS)
     redis_cache.set(cache_key, serialized_reagents, ttl)
     
     return reagents
 
+@router.get("/expiring/summary", response_model=dict)
+def get_expiring_summary(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(check_permission(Permissions.REAGENT_READ))
+):
+    """试剂过期分桶统计（已过期、7天内、30天内、90天内、更晚）"""
+    cache_key = CacheConfig.get_cache_key(CacheType.REAGENTS, f"expiring_summary:{timeline_today().isoformat()}")
+    
+    cached_result = redis_cache.get(cache_key)
+    if cached_result:
+        return cached_result
+    
+    result = get_bucket_counts(db)
+    redis_cache.set(cache_key, result, CacheConfig.get_ttl(CacheType.REAGENTS))
+    
+    return result
+
+@router.get("/autocomplete/suggest", response_model=List[dict])
+def suggest_reagents(
+    q: str = Query(..., min_length=1, max_length=100, description="名称、CAS号、货号或分子式的前缀"),
+    limit: int = Query(10, ge=1, le=50),
+    fields: Optional[str] = Query(None, description="限定匹配字段，逗号分隔：name,cas_number,product_number,molecular_formula"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(check_permission(Permissions.REAGENT_READ))
+):
+    """试剂自动补全（内存前缀索引，CAS号忽略分隔符）"""
+    selected = INDEXED_FIELDS
+    if fields:
+        selected = tuple(f.strip() for f in fields.split(",") if f.strip() in INDEXED_FIELDS)
+        if not selected:
+            raise HTTPException(status_code=400, detail=f"无效的匹配字段，可选：{', '.join(INDEXED_FIELDS)}")
+    
+    return reagent_autocomplete.suggest(db, q, limit, selected)
+
 @router.get("/low-stock/list", response_model=List[ReagentResponse])
 def get_low_stock_reagents(
-    threshold: float = 10.0,
+    threshold: Optional[float] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(check_permission(Permissions.REAGENT_READ))
 ):
-    """获取库存不足的试剂（带缓存）"""
-    cache_key = CacheConfig.get_cache_key(CacheType.REAGENTS, f"low_stock:{threshold}")
+    """获取库存不足的试剂（带缓存）；不指定 threshold 时按各试剂自身的最小库存阈值判断"""
+    cache_key = CacheConfig.get_cache_key(CacheType.REAGENTS, f"low_stock:{threshold if threshold is not None else 'own'}")
     
     # 尝试从缓存获取
     cached_result = redis_cache.get(cache_key)
@@ -395,9 +427,12 @@ def get_low_stock_reagents(
         return _deserialize_reagents(cached_result)
     
     # 从数据库查询
-    reagents = db.query(Reagent).filter(
-        Reagent.quantity <= threshold
-    ).all()
+    if threshold is None:
+        reagents = low_stock_query(db, Reagent).all()
+    else:
+        reagents = db.query(Reagent).filter(
+            Reagent.quantity <= threshold
+        ).order_by(Reagent.quantity).all()
     
     # 序列化并缓存
     serialized_reagents = _serialize_reagents(reagents)
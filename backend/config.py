@@ -2,6 +2,7 @@
 Configuration module to avoid circular imports
 """
 import os
+import tempfile
 from datetime import timedelta
 
 # JWT Configuration
@@ -29,4 +30,26 @@ CORS_ORIGINS = [
     "http://localhost:8002",
     "http://127.0.0.1:8002",
     "http://172.30.81.103:8002",
-]
\ No newline at end of file
+]
+
+# Background Scheduler Configuration
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+MAINTENANCE_SCHEDULE_INTERVAL = int(os.getenv("MAINTENANCE_SCHEDULE_INTERVAL", "900"))  # 秒
+DEVICE_USAGE_ROLLUP_INTERVAL = int(os.getenv("DEVICE_USAGE_ROLLUP_INTERVAL", "600"))  # 秒
+REAGENT_EXPIRY_ROLLOVER_INTERVAL = int(os.getenv("REAGENT_EXPIRY_ROLLOVER_INTERVAL", "3600"))  # 秒，跨天后的首次运行完成滚动
+LOW_STOCK_CHECK_INTERVAL = int(os.getenv("LOW_STOCK_CHECK_INTERVAL", "300"))  # 秒
+INVENTORY_SNAPSHOT_INTERVAL = int(os.getenv("INVENTORY_SNAPSHOT_INTERVAL", "3600"))  # 秒，快照间隔决定时点查询需要扫描的流水量
+STOCK_FORECAST_INTERVAL = int(os.getenv("STOCK_FORECAST_INTERVAL", "21600"))  # 秒，预测按天统计，无需频繁重算
+USAGE_ROLLUP_INTERVAL = int(os.getenv("USAGE_ROLLUP_INTERVAL", "600"))  # 秒
+ANALYTICS_EXPORT_CLEANUP_INTERVAL = int(os.getenv("ANALYTICS_EXPORT_CLEANUP_INTERVAL", "3600"))  # 秒
+
+# Analytics Export Configuration
+ANALYTICS_EXPORT_DIR = os.getenv("ANALYTICS_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "lab_analytics_exports"))
+
+# Archive Configuration
+ARCHIVE_HORIZON_DAYS = int(os.getenv("ARCHIVE_HORIZON_DAYS", "365"))  # 早于该天数的记录移入按月归档表
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", "86400"))  # 秒
+
+# WebSocket Push Configuration
+NOTIFICATION_BACKPLANE = os.getenv("NOTIFICATION_BACKPLANE", "auto")  # auto（Redis 可用时跨 worker 分发）/ redis / local
+HEARTBEAT_FLUSH_INTERVAL = int(os.getenv("HEARTBEAT_FLUSH_INTERVAL", "15"))  # 秒，连接心跳批量写回间隔
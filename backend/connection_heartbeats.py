@@ -0,0 +1,99 @@
+# backend/connection_heartbeats.py
+
+"""
+WebSocket 连接心跳的批量写入
+
+客户端 ping 和通知送达都会刷新连接的 last_ping。这些时间先记在进程内
+（同一连接只保留最新一次），由每个 worker 的周期任务（不受
+SCHEDULER_ENABLED 影响）每隔 HEARTBEAT_FLUSH_INTERVAL 秒用一条 executemany
+UPDATE 写回 websocket_connections，不再每条消息查询并提交一次。
+
+清理非活跃连接前先写回本进程的心跳；其他 worker 尚未写回的心跳最多
+滞后一个写回周期，远小于清理超时。
+"""
+
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import WebSocketConnection
+
+logger = logging.getLogger(__name__)
+
+# 单条 executemany 携带的连接数
+FLUSH_CHUNK_SIZE = 500
+
+
+class HeartbeatTracker:
+    """进程内的待写回心跳 {connection_id: last_ping}"""
+
+    def __init__(self):
+        self._pending: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, connection_id: str, at: Optional[datetime] = None):
+        self.touch_many([connection_id], at)
+
+    def touch_many(self, connection_ids: Iterable[str], at: Optional[datetime] = None):
+        at = at or datetime.utcnow()
+        with self._lock:
+            for connection_id in connection_ids:
+                self._pending[connection_id] = at
+
+    def discard(self, connection_id: str):
+        with self._lock:
+            self._pending.pop(connection_id, None)
+
+    def drain(self) -> Dict[str, datetime]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def _restore(self, pending: Dict[str, datetime]):
+        """写回失败时放回（保留更新的心跳）"""
+        with self._lock:
+            for connection_id, at in pending.items():
+                current = self._pending.get(connection_id)
+                if current is None or current < at:
+                    self._pending[connection_id] = at
+
+    def flush(self, db: Session) -> int:
+        """把待写回的心跳批量写入数据库并提交，返回写回的连接数"""
+        pending = self.drain()
+        if not pending:
+            return 0
+
+        table = WebSocketConnection.__table__
+        statement = update(table).where(
+            table.c.connection_id == bindparam("b_connection_id")
+        ).values(last_ping=bindparam("b_last_ping"))
+        rows = [{"b_connection_id": cid, "b_last_ping": at} for cid, at in pending.items()]
+        try:
+            for i in range(0, len(rows), FLUSH_CHUNK_SIZE):
+                db.execute(statement, rows[i:i + FLUSH_CHUNK_SIZE])
+            db.commit()
+        except Exception:
+            db.rollback()
+            self._restore(pending)
+            raise
+        return len(rows)
+
+
+heartbeat_tracker = HeartbeatTracker()
+
+
+def run_heartbeat_flush() -> dict:
+    """调度器入口（每个 worker 都要运行，写回本进程记录的心跳）"""
+    db = SessionLocal()
+    try:
+        return {"flushed": heartbeat_tracker.flush(db)}
+    finally:
+        db.close()
@@ -0,0 +1,171 @@
+# backend/consumable_movements.py
+
+"""
+耗材批量出入库（扫码入库 / 批量领用）
+
+一次请求提交多行 (耗材ID或条码, 数量变化, 备注)：所有耗材在一条 IN
+查询中读取（PostgreSQL 下加行锁），各行按提交顺序在内存中依次应用，
+同一耗材出现多次时后一行基于前一行的结果。通过校验的耗材按净变化量
+用一条 executemany 相对 UPDATE（quantity = quantity + 变化量，且结果
+不小于 0）写回：其他数据库不加行锁，读取之后的并发写入不会被覆盖，
+并发出库导致库存不足时整批回滚（StockConflict）。每行记一条
+receive/use 库存流水（行备注保存在流水的 note 列），最后同步低库存
+标记——整批只有一个事务、一次提交。
+
+批量 UPDATE 绕过 ORM 事件，流水和低库存标记在这里显式维护。
+"""
+
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.orm import Session
+
+from models import Consumable
+from low_stock import refresh_low_stock
+from inventory_ledger import ITEM_CONSUMABLE, REASON_RECEIVE, REASON_USE, movement_row, record_movements
+
+# 单次请求最多的行数
+MAX_LINES = 500
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+STATUS_SKIPPED = "skipped"  # atomic 模式下因其他行失败而未写入
+
+
+class StockConflict(Exception):
+    """写回时库存已被并发修改，按净变化量扣减会变为负数"""
+
+
+@dataclass
+class MovementLine:
+    """一行出入库：delta 为正表示入库，为负表示出库"""
+    delta: int
+    consumable_id: Optional[int] = None
+    barcode: Optional[str] = None
+    note: Optional[str] = None
+
+
+def parse_barcode(code: Optional[str]) -> Optional[int]:
+    """
+    从扫码内容中解析耗材ID
+
+    支持 mobile_scan 页面生成的二维码 JSON（{"type": "consumable", "id": 12}）、
+    "consumable:12" 和纯数字ID；其他格式返回 None。
+    """
+    if not code:
+        return None
+    code = code.strip()
+    if code.startswith("{"):
+        try:
+            payload = json.loads(code)
+        except ValueError:
+            return None
+        if not isinstance(payload, dict) or payload.get("type", "consumable") != "consumable":
+            return None
+        code = str(payload.get("id", ""))
+    elif ":" in code:
+        prefix, _, code = code.partition(":")
+        if prefix.strip().lower() != "consumable":
+            return None
+    code = code.strip()
+    return int(code) if code.isdigit() else None
+
+
+def _resolve_id(line: MovementLine) -> Optional[int]:
+    if line.consumable_id is not None:
+        return line.consumable_id
+    return parse_barcode(line.barcode)
+
+
+def _result(index: int, line: MovementLine, consumable_id: Optional[int], status: str,
+            quantity_after: Optional[int] = None, error: Optional[str] = None) -> dict:
+    return {
+        "line": index,
+        "consumable_id": consumable_id,
+        "barcode": line.barcode,
+        "delta": line.delta,
+        "note": line.note,
+        "status": status,
+        "quantity_after": quantity_after,
+        "error": error,
+    }
+
+
+def apply_movements(db: Session, lines: Sequence[MovementLine], user_id: Optional[int] = None,
+                    atomic: bool = False) -> List[dict]:
+    """
+    在调用方的事务内应用一批出入库（不提交）
+
+    Args:
+        lines: 按提交顺序应用的出入库行
+        user_id: 记入库存流水的操作人ID
+        atomic: 为 True 时任一行失败则整批不写入
+
+    Returns:
+        与 lines 一一对应的处理结果；atomic 且有失败行时其余行为 skipped
+    """
+    ids = {item_id for item_id in (_resolve_id(line) for line in lines) if item_id is not None}
+
+    query = db.query(Consumable.id, Consumable.quantity).filter(Consumable.id.in_(ids))
+    if db.get_bind().dialect.name == "postgresql":
+        query = query.with_for_update()
+    quantities: Dict[int, int] = {row.id: row.quantity or 0 for row in query.all()} if ids else {}
+
+    now = datetime.utcnow()
+    results = []
+    movements = []
+    for index, line in enumerate(lines):
+        item_id = _resolve_id(line)
+        if item_id is None:
+            results.append(_result(index, line, None, STATUS_ERROR, error="缺少耗材ID或无法识别的条码"))
+            continue
+        if item_id not in quantities:
+            results.append(_result(index, line, item_id, STATUS_ERROR, error="耗材不存在"))
+            continue
+        if line.delta == 0:
+            results.append(_result(index, line, item_id, STATUS_ERROR, error="数量变化不能为 0"))
+            continue
+
+        quantity_after = quantities[item_id] + line.delta
+        if quantity_after < 0:
+            results.append(_result(
+                index, line, item_id, STATUS_ERROR, quantities[item_id],
+                error=f"库存不足。当前库存：{quantities[item_id]}，出库数量：{-line.delta}"
+            ))
+            continue
+
+        quantities[item_id] = quantity_after
+        reason = REASON_RECEIVE if line.delta > 0 else REASON_USE
+        movements.append(movement_row(ITEM_CONSUMABLE, item_id, line.delta, quantity_after, reason,
+                                      user_id=user_id, created_at=now, note=line.note))
+        results.append(_result(index, line, item_id, STATUS_OK, quantity_after))
+
+    if atomic and len(movements) < len(results):
+        for result in results:
+            if result["status"] == STATUS_OK:
+                result.update(status=STATUS_SKIPPED, quantity_after=None, error="同批其他行失败，未写入")
+        return results
+    if not movements:
+        return results
+
+    deltas: Dict[int, int] = {}
+    for row in movements:
+        deltas[row["item_id"]] = deltas.get(row["item_id"], 0) + row["delta"]
+    touched = set(deltas)
+
+    table = Consumable.__table__
+    new_quantity = func.coalesce(table.c.quantity, 0) + bindparam("b_delta")
+    result = db.execute(
+        update(table)
+        .where(table.c.id == bindparam("b_id"), new_quantity >= 0)
+        .values(quantity=new_quantity, updated_at=now),
+        [{"b_id": item_id, "b_delta": delta} for item_id, delta in deltas.items()]
+    )
+    if db.get_bind().dialect.supports_sane_multi_rowcount and result.rowcount != len(deltas):
+        raise StockConflict("库存已被并发修改，请刷新后重试")
+    record_movements(db, movements)
+    refresh_low_stock(db, Consumable, touched)
+    return results
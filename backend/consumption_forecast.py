@@ -0,0 +1,240 @@
+# backend/consumption_forecast.py
+
+"""
+库存消耗预测
+
+一次查询取出回看窗口内全部物品的消耗流水（直接出库 use 和审批扣减
+approval；审批按 FEFO 在实际扣减的批次上记流水，而不是申请所选的批次），
+用 NumPy 按 (物品, 天) 汇总成一个二维矩阵，对所有物品同时计算：
+
+- 滑动平均：最近 MA_WINDOW_DAYS 天的日均消耗
+- 指数平滑：按天递推的 EWMA，对最近的变化更敏感
+
+预测采用两者中较大的日消耗（偏保守），据此计算预计耗尽天数、再订货点
+（交货期加安全天数内的消耗）和建议补货量。结果整表写入 stock_forecasts，
+仪表盘接口直接读取。
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import InventoryMovement, StockForecast
+from inventory_ledger import CONSUMPTION_REASONS, ITEM_MODELS
+
+logger = logging.getLogger(__name__)
+
+# 回看天数
+HISTORY_DAYS = 90
+
+# 滑动平均窗口（天）
+MA_WINDOW_DAYS = 28
+
+# 指数平滑系数
+EWMA_ALPHA = 0.2
+
+# 补货交货期（天）
+LEAD_TIME_DAYS = 14
+
+# 安全库存覆盖天数
+SAFETY_DAYS = 7
+
+# 每次补货覆盖的消耗天数
+REORDER_COVER_DAYS = 30
+
+INSERT_CHUNK_SIZE = 1000
+
+# 超过该天数的耗尽日期不再给出（消耗极慢的物品）
+MAX_PROJECTION_DAYS = 3650
+
+# 浮点数量比较的容差
+EPSILON = 1e-9
+
+
+def daily_matrix(keys: np.ndarray, days: np.ndarray, quantities: np.ndarray,
+                 item_count: int, day_count: int) -> np.ndarray:
+    """按 (物品序号, 天序号) 汇总消耗量，返回 item_count × day_count 矩阵"""
+    flat = np.bincount(keys * day_count + days, weights=quantities, minlength=item_count * day_count)
+    return flat.reshape(item_count, day_count)
+
+
+def moving_average(matrix: np.ndarray, window: int = MA_WINDOW_DAYS) -> np.ndarray:
+    """最近 window 天的日均消耗"""
+    window = min(window, matrix.shape[1])
+    if window <= 0:
+        return np.zeros(matrix.shape[0])
+    return matrix[:, -window:].mean(axis=1)
+
+
+def exponential_smoothing(matrix: np.ndarray, alpha: float = EWMA_ALPHA) -> np.ndarray:
+    """按天递推的指数平滑（每一步是对全部物品的一次向量运算）"""
+    level = np.zeros(matrix.shape[0])
+    if matrix.shape[1] == 0:
+        return level
+    level = matrix[:, 0].astype(float)
+    for column in range(1, matrix.shape[1]):
+        level = alpha * matrix[:, column] + (1 - alpha) * level
+    return level
+
+
+def project(quantities: np.ndarray, burn_rate: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    根据库存和日消耗计算耗尽天数、再订货点和建议补货量
+
+    没有消耗的物品耗尽天数为 NaN；库存低于再订货点时建议补到覆盖
+    交货期、安全天数和一个补货周期的消耗。
+    """
+    quantities = np.maximum(quantities, 0.0)
+    consuming = burn_rate > EPSILON
+    days_to_stockout = np.full(len(quantities), np.nan)
+    np.divide(quantities, burn_rate, out=days_to_stockout, where=consuming)
+
+    reorder_point = burn_rate * (LEAD_TIME_DAYS + SAFETY_DAYS)
+    target = burn_rate * (LEAD_TIME_DAYS + SAFETY_DAYS + REORDER_COVER_DAYS)
+    suggested = np.where(consuming & (quantities <= reorder_point), np.ceil(target - quantities), 0.0)
+    return {
+        "days_to_stockout": days_to_stockout,
+        "reorder_point": reorder_point,
+        "suggested_reorder": np.maximum(suggested, 0.0),
+    }
+
+
+# ---------- 读取 ----------
+
+def _load_items(db: Session) -> Tuple[List[Tuple[str, int]], List[str], List[Optional[str]], np.ndarray]:
+    keys, names, units, quantities = [], [], [], []
+    for item_type, model in ITEM_MODELS.items():
+        for item_id, name, unit, quantity in db.query(model.id, model.name, model.unit, model.quantity).all():
+            keys.append((item_type, item_id))
+            names.append(name)
+            units.append(unit)
+            quantities.append(quantity or 0.0)
+    return keys, names, units, np.asarray(quantities, dtype=float)
+
+
+def _load_consumption(db: Session, since: datetime) -> List[Tuple[str, int, datetime, float]]:
+    """回看窗口内按实际批次记录的消耗流水（出库和审批扣减）"""
+    M = InventoryMovement
+    return [
+        (item_type, item_id, created_at, -delta)
+        for item_type, item_id, created_at, delta in db.query(
+            M.item_type, M.item_id, M.created_at, M.delta
+        ).filter(M.reason.in_(CONSUMPTION_REASONS), M.created_at >= since).all()
+    ]
+
+
+# ---------- 计算与写入 ----------
+
+def compute_forecasts(db: Session, now: Optional[datetime] = None) -> List[dict]:
+    """为全部试剂和耗材计算预测，返回待写入 stock_forecasts 的行"""
+    now = now or datetime.utcnow()
+    today = now.date()
+    start = datetime.combine(today - timedelta(days=HISTORY_DAYS - 1), datetime.min.time())
+
+    item_keys, names, units, quantities = _load_items(db)
+    if not item_keys:
+        return []
+    position = {key: i for i, key in enumerate(item_keys)}
+
+    records = [row for row in _load_consumption(db, start) if (row[0], row[1]) in position and row[2] is not None]
+    if records:
+        index = np.fromiter((position[(r[0], r[1])] for r in records), dtype=np.int64, count=len(records))
+        used_at = np.array([r[2] for r in records], dtype="datetime64[s]")
+        days = ((used_at - np.datetime64(start, "s")) // np.timedelta64(1, "D")).astype(np.int64)
+        days = np.clip(days, 0, HISTORY_DAYS - 1)
+        amounts = np.fromiter((r[3] or 0.0 for r in records), dtype=float, count=len(records))
+        matrix = daily_matrix(index, days, amounts, len(item_keys), HISTORY_DAYS)
+    else:
+        matrix = np.zeros((len(item_keys), HISTORY_DAYS))
+
+    rate_ma = moving_average(matrix)
+    rate_ewma = exponential_smoothing(matrix)
+    burn_rate = np.maximum(rate_ma, rate_ewma)
+    projection = project(quantities, burn_rate)
+
+    rows = []
+    for i, (item_type, item_id) in enumerate(item_keys):
+        days_left = projection["days_to_stockout"][i]
+        has_days = not np.isnan(days_left)
+        has_date = has_days and days_left <= MAX_PROJECTION_DAYS
+        rows.append({
+            "item_type": item_type,
+            "item_id": item_id,
+            "item_name": names[i],
+            "unit": units[i],
+            "quantity": float(quantities[i]),
+            "burn_rate_ma": float(rate_ma[i]),
+            "burn_rate_ewma": float(rate_ewma[i]),
+            "burn_rate": float(burn_rate[i]),
+            "days_to_stockout": float(days_left) if has_days else None,
+            "stockout_date": today + timedelta(days=int(days_left)) if has_date else None,
+            "reorder_point": float(projection["reorder_point"][i]),
+            "suggested_reorder": float(projection["suggested_reorder"][i]),
+            "computed_at": now,
+        })
+    return rows
+
+
+def refresh_forecasts(db: Session, now: Optional[datetime] = None) -> dict:
+    """重算并整表替换预测结果（同一事务内删除旧行、批量插入新行）"""
+    rows = compute_forecasts(db, now)
+    db.execute(delete(StockForecast))
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        db.execute(insert(StockForecast.__table__), rows[i:i + INSERT_CHUNK_SIZE])
+    db.commit()
+    return {
+        "items": len(rows),
+        "consuming": sum(1 for row in rows if row["burn_rate"] > EPSILON),
+        "reorder_suggested": sum(1 for row in rows if row["suggested_reorder"] > 0),
+    }
+
+
+def _run_forecast() -> dict:
+    db = SessionLocal()
+    try:
+        return refresh_forecasts(db)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def run_forecast_job() -> dict:
+    """调度器入口"""
+    summary = await asyncio.to_thread(_run_forecast)
+    logger.info(f"库存消耗预测完成: {summary}")
+    return summary
+
+
+# ---------- 查询 ----------
+
+def upcoming_stockouts(db: Session, item_type: Optional[str] = None, within_days: Optional[float] = None,
+                       reorder_only: bool = False, limit: int = 50) -> List[StockForecast]:
+    """按预计耗尽时间排序的预测结果（无消耗的物品不返回）"""
+    F = StockForecast
+    query = db.query(F).filter(F.days_to_stockout.isnot(None))
+    if item_type:
+        query = query.filter(F.item_type == item_type)
+    if within_days is not None:
+        query = query.filter(F.days_to_stockout <= within_days)
+    if reorder_only:
+        query = query.filter(F.suggested_reorder > 0)
+    return query.order_by(F.days_to_stockout, F.item_type, F.item_id).limit(limit).all()
+
+
+def forecast_for(db: Session, item_type: str, item_id: int) -> Optional[StockForecast]:
+    return db.query(StockForecast).filter(
+        StockForecast.item_type == item_type, StockForecast.item_id == item_id
+    ).first()
+
+
+def forecast_as_of(db: Session) -> Optional[datetime]:
+    row = db.query(StockForecast.computed_at).first()
+    return row[0] if row else None
@@ -0,0 +1,289 @@
+# backend/data_archive.py
+
+"""
+按月归档：使用记录、通知和设备预约
+
+早于归档期限（ARCHIVE_HORIZON_DAYS，按自然日对齐）的行按时间列所在月份
+移入 <源表>_archive_<YYYYMM> 归档表，热表只保留近期数据。归档表按需创建，
+列与源表一致但不带外键，另在时间列上建索引；archive_partitions 记录每个
+分区的月份、行数和时间范围。
+
+归档任务每批按主键取 ARCHIVE_CHUNK_SIZE 行，在同一个短事务中
+INSERT ... SELECT 到各月分区并从热表删除，批次之间提交并短暂让出，
+不长时间持有写锁；中途失败只回滚当前批次，下次运行继续。
+
+使用记录和设备预约分别参与领用每日汇总和设备使用汇总：汇总从未运行时
+不归档；否则归档期限收紧到最早一条汇总尚未处理的行所在日期，边界之前
+的日期在热表中的行都已计入汇总。汇总（全量重建和增量刷新）保留归档
+边界之前的汇总结果。
+
+历史查询通过 history_query 把热表和与日期范围重叠的分区 UNION ALL
+成一个子查询，调用方按普通表过滤和排序。
+"""
+
+import logging
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import Column, Index, MetaData, Table, delete, func, insert, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from config import ARCHIVE_HORIZON_DAYS
+from database import SessionLocal
+from models import ArchivePartition, DeviceReservation, Notification, RollupState, UsageRecord
+import device_usage_rollup
+import usage_rollup
+
+logger = logging.getLogger(__name__)
+
+# 每批归档的行数
+ARCHIVE_CHUNK_SIZE = 1000
+
+# 单次运行每个源表最多处理的批数，剩余的留给下一次运行
+MAX_CHUNKS_PER_RUN = 500
+
+# 批次之间的停顿（秒），让出写锁
+CHUNK_PAUSE_SECONDS = 0.05
+
+# 归档期限下限：消耗预测回看 90 天，近期记录必须留在热表
+MIN_HORIZON_DAYS = 120
+
+# 归档边界（已归档的时间上界）记在 rollup_state 中
+BOUNDARY_STATE_PREFIX = "archive:"
+
+archive_metadata = MetaData()
+
+
+@dataclass
+class ArchiveSource:
+    """可归档的源表"""
+    table: Table
+    time_column: str  # 决定归档月份和期限的时间列
+    rollup_name: Optional[str] = None  # 依赖该表的汇总任务水位
+    rollup_column: Optional[str] = None  # 与汇总水位比较的列
+    rollup_overlap: timedelta = timedelta(0)
+    rollup_day_column: Optional[str] = None  # 该行在汇总中最早涉及的日期所在列（默认为时间列）
+
+
+SOURCES: Dict[str, ArchiveSource] = {
+    "usage_records": ArchiveSource(
+        table=UsageRecord.__table__,
+        time_column="used_at",
+        rollup_name=usage_rollup.ROLLUP_NAME,
+        rollup_column="created_at",
+        rollup_overlap=usage_rollup.WATERMARK_OVERLAP,
+    ),
+    "notifications": ArchiveSource(
+        table=Notification.__table__,
+        time_column="created_at",
+    ),
+    "device_reservations": ArchiveSource(
+        table=DeviceReservation.__table__,
+        time_column="end_time",
+        rollup_name=device_usage_rollup.ROLLUP_NAME,
+        rollup_column="updated_at",
+        rollup_overlap=device_usage_rollup.WATERMARK_OVERLAP,
+        rollup_day_column="start_time",
+    ),
+}
+
+
+def month_start(value: datetime) -> date:
+    return date(value.year, value.month, 1)
+
+
+def partition_name(source: str, month: date) -> str:
+    return f"{source}_archive_{month:%Y%m}"
+
+
+def partition_table(source: str, name: str) -> Table:
+    """归档表定义：复制源表的列（不含外键和默认值）"""
+    if name in archive_metadata.tables:
+        return archive_metadata.tables[name]
+    spec = SOURCES[source]
+    columns = [Column(c.name, c.type, primary_key=c.primary_key) for c in spec.table.columns]
+    table = Table(name, archive_metadata, *columns)
+    Index(f"ix_{name}_{spec.time_column}", table.c[spec.time_column])
+    return table
+
+
+def archive_boundary(db: Session, source: str) -> Optional[date]:
+    """早于该日期的行可能已归档；从未归档时返回 None"""
+    state = db.get(RollupState, BOUNDARY_STATE_PREFIX + source)
+    return state.watermark.date() if state and state.watermark else None
+
+
+def _set_boundary(db: Session, source: str, cutoff: datetime):
+    key = BOUNDARY_STATE_PREFIX + source
+    state = db.get(RollupState, key)
+    if state is None:
+        db.add(RollupState(name=key, watermark=cutoff))
+    elif state.watermark is None or state.watermark < cutoff:
+        state.watermark = cutoff
+    db.commit()
+
+
+def _ensure_partition(db: Session, source: str, month: date) -> Table:
+    name = partition_name(source, month)
+    table = partition_table(source, name)
+    if db.get(ArchivePartition, name) is None:
+        table.create(bind=db.connection(), checkfirst=True)
+        db.add(ArchivePartition(table_name=name, source_table=source, month=month, row_count=0))
+        db.flush()
+    return table
+
+
+def _rollup_limit(db: Session, spec: ArchiveSource) -> Optional[datetime]:
+    state = db.get(RollupState, spec.rollup_name)
+    if state is None or state.watermark is None:
+        return None
+    return state.watermark - spec.rollup_overlap
+
+
+def rolled_up_cutoff(db: Session, source: str, cutoff: datetime) -> Optional[datetime]:
+    """
+    汇总已完整覆盖的归档期限
+
+    汇总尚未处理的行（汇总水位之后创建或修改）涉及的日期及之后都不能
+    归档，期限收紧到其中最早日期的零点。汇总从未运行时返回 None，该表
+    本次不归档。
+    """
+    spec = SOURCES[source]
+    if not spec.rollup_name:
+        return cutoff
+    limit = _rollup_limit(db, spec)
+    if limit is None:
+        return None
+    table = spec.table
+    day_column = table.c[spec.rollup_day_column or spec.time_column]
+    rollup_column = table.c[spec.rollup_column]
+    pending = db.execute(
+        select(func.min(day_column)).where(
+            day_column < cutoff, or_(rollup_column >= limit, rollup_column.is_(None))
+        )
+    ).scalar()
+    if pending is None:
+        return cutoff
+    return min(cutoff, datetime.combine(pending.date(), datetime.min.time()))
+
+
+def archive_chunk(db: Session, source: str, cutoff: datetime) -> int:
+    """归档一批早于 cutoff 的行并提交，返回归档的行数（0 表示已无可归档的行）"""
+    spec = SOURCES[source]
+    table = spec.table
+    time_column = table.c[spec.time_column]
+
+    query = select(table.c.id, time_column).where(time_column < cutoff)
+    if spec.rollup_name:
+        limit = _rollup_limit(db, spec)
+        if limit is None:
+            return 0
+        # 汇总任务尚未处理的行留在热表
+        query = query.where(table.c[spec.rollup_column] < limit)
+    query = query.order_by(table.c.id).limit(ARCHIVE_CHUNK_SIZE)
+    if db.get_bind().dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+    rows = db.execute(query).all()
+    if not rows:
+        return 0
+
+    by_month: Dict[date, List[tuple]] = {}
+    for row_id, moment in rows:
+        by_month.setdefault(month_start(moment), []).append((row_id, moment))
+
+    names = [c.name for c in table.columns]
+    for month, items in by_month.items():
+        partition = _ensure_partition(db, source, month)
+        ids = [row_id for row_id, _ in items]
+        db.execute(insert(partition).from_select(names, select(*table.c).where(table.c.id.in_(ids))))
+        entry = db.get(ArchivePartition, partition.name)
+        times = [moment for _, moment in items]
+        entry.row_count += len(ids)
+        entry.min_time = min([t for t in (entry.min_time, min(times)) if t is not None])
+        entry.max_time = max([t for t in (entry.max_time, max(times)) if t is not None])
+
+    db.execute(delete(table).where(table.c.id.in_([row_id for row_id, _ in rows])))
+    db.commit()
+    return len(rows)
+
+
+def archive_cutoff(now: Optional[datetime] = None, horizon_days: int = ARCHIVE_HORIZON_DAYS) -> datetime:
+    """归档期限，对齐到当天零点，保证边界之前的日期整天都在归档表中"""
+    now = now or datetime.utcnow()
+    days = max(horizon_days, MIN_HORIZON_DAYS)
+    return datetime.combine(now.date() - timedelta(days=days), datetime.min.time())
+
+
+def archive_source(db: Session, source: str, cutoff: datetime) -> dict:
+    archived = 0
+    chunks = 0
+    cutoff = rolled_up_cutoff(db, source, cutoff)
+    if cutoff is None:
+        return {"archived": 0, "chunks": 0, "complete": False, "skipped": "汇总尚未运行"}
+    # 边界之前的日期已全部计入汇总；先记录边界再移动数据，汇总刷新
+    # 随时都不会从部分归档的热表重算这些日期
+    _set_boundary(db, source, cutoff)
+    while chunks < MAX_CHUNKS_PER_RUN:
+        moved = archive_chunk(db, source, cutoff)
+        if not moved:
+            break
+        archived += moved
+        chunks += 1
+        time.sleep(CHUNK_PAUSE_SECONDS)
+    return {"archived": archived, "chunks": chunks, "complete": chunks < MAX_CHUNKS_PER_RUN,
+            "cutoff": cutoff.isoformat()}
+
+
+def run_archive_job(now: Optional[datetime] = None) -> dict:
+    """调度器入口：依次归档各源表"""
+    cutoff = archive_cutoff(now)
+    summary = {"cutoff": cutoff.isoformat()}
+    db = SessionLocal()
+    try:
+        for source in SOURCES:
+            try:
+                summary[source] = archive_source(db, source, cutoff)
+            except Exception as e:
+                db.rollback()
+                logger.error(f"归档 {source} 失败: {e}")
+                summary[source] = {"error": str(e)}
+        logger.info(f"数据归档完成: {summary}")
+        return summary
+    finally:
+        db.close()
+
+
+# ---------- 查询 ----------
+
+def list_partitions(db: Session, source: Optional[str] = None) -> List[ArchivePartition]:
+    query = db.query(ArchivePartition)
+    if source:
+        query = query.filter(ArchivePartition.source_table == source)
+    return query.order_by(ArchivePartition.source_table, ArchivePartition.month).all()
+
+
+def history_query(db: Session, source: str, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """
+    热表与归档分区的 UNION ALL 子查询（只合并与 [start, end) 重叠的分区）
+
+    各部分都先按时间列过滤，再合并。
+    """
+    spec = SOURCES[source]
+    partitions = db.query(ArchivePartition.table_name).filter(ArchivePartition.source_table == source)
+    if start:
+        partitions = partitions.filter(ArchivePartition.max_time >= start)
+    if end:
+        partitions = partitions.filter(ArchivePartition.min_time < end)
+    tables = [spec.table] + [partition_table(source, name) for (name,) in partitions.all()]
+
+    parts = []
+    for table in tables:
+        stmt = select(*table.c)
+        if start:
+            stmt = stmt.where(table.c[spec.time_column] >= start)
+        if end:
+            stmt = stmt.where(table.c[spec.time_column] < end)
+        parts.append(stmt)
+    return (union_all(*parts) if len(parts) > 1 else parts[0]).subquery(f"{source}_history")
@@ -0,0 +1,190 @@
+# backend/device_availability.py
+
+"""
+多设备可用性日历
+
+一次范围查询取出窗口内所有有效预约，用 NumPy 对各设备的
+[开始, 结束) 区间做向量化合并，再求补集得到空闲时段。
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from models import Device, DeviceReservation
+
+# 占用设备时间的预约状态（与创建预约时的冲突检查一致）
+BUSY_RESERVATION_STATUSES = ["pending", "approved"]
+
+# 可预约的设备状态
+BOOKABLE_DEVICE_STATUSES = ["available", "有效"]
+
+
+def merge_intervals(
+    ranks: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    span: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    按设备分组合并重叠区间
+
+    Args:
+        ranks: 每个区间所属设备的序号（0..n-1）
+        starts, ends: 相对窗口起点的秒数，已裁剪到 [0, span]
+        span: 窗口长度（秒）
+
+    Returns:
+        (设备序号, 合并后开始, 合并后结束)，按设备、开始时间排序
+    """
+    if len(starts) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+
+    # 给每个设备加上互不重叠的偏移量，使一次累计最大值即可跨组计算
+    offset = ranks.astype(np.int64) * (span + 1)
+    start_keys = starts + offset
+    end_keys = ends + offset
+
+    order = np.argsort(start_keys, kind="stable")
+    start_keys = start_keys[order]
+    end_keys = end_keys[order]
+
+    running_end = np.maximum.accumulate(end_keys)
+    # 开始时间晚于此前所有区间的最大结束时间即为新区间（相邻区间视为连续）
+    is_new = np.empty(len(start_keys), dtype=bool)
+    is_new[0] = True
+    is_new[1:] = start_keys[1:] > running_end[:-1]
+
+    heads = np.flatnonzero(is_new)
+    merged_start = start_keys[heads]
+    merged_end = np.maximum.reduceat(end_keys, heads)
+
+    merged_rank = merged_start // (span + 1)
+    base = merged_rank * (span + 1)
+    return merged_rank, merged_start - base, merged_end - base
+
+
+def free_gaps(
+    device_count: int,
+    merged_rank: np.ndarray,
+    merged_start: np.ndarray,
+    merged_end: np.ndarray,
+    span: int,
+    min_slot: int = 0,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """求各设备忙碌区间在窗口内的补集，过滤短于 min_slot 秒的空隙"""
+    if len(merged_rank):
+        first_of_group = np.empty(len(merged_rank), dtype=bool)
+        first_of_group[0] = True
+        first_of_group[1:] = merged_rank[1:] != merged_rank[:-1]
+        last_of_group = np.empty(len(merged_rank), dtype=bool)
+        last_of_group[-1] = True
+        last_of_group[:-1] = first_of_group[1:]
+
+        # 每个忙碌区间之前的空隙
+        prev_end = np.concatenate(([0], merged_end[:-1]))
+        prev_end[first_of_group] = 0
+        gap_rank = [merged_rank, merged_rank[last_of_group]]
+        gap_start = [prev_end, merged_end[last_of_group]]
+        gap_end = [merged_start, np.full(int(last_of_group.sum()), span, dtype=np.int64)]
+    else:
+        gap_rank, gap_start, gap_end = [], [], []
+
+    # 没有任何预约的设备整个窗口空闲
+    idle = np.setdiff1d(np.arange(device_count, dtype=np.int64), merged_rank)
+    gap_rank.append(idle)
+    gap_start.append(np.zeros(len(idle), dtype=np.int64))
+    gap_end.append(np.full(len(idle), span, dtype=np.int64))
+
+    rank = np.concatenate(gap_rank).astype(np.int64)
+    start = np.concatenate(gap_start).astype(np.int64)
+    end = np.concatenate(gap_end).astype(np.int64)
+
+    keep = (end - start) >= max(min_slot, 1)
+    rank, start, end = rank[keep], start[keep], end[keep]
+    order = np.lexsort((start, rank))
+    return rank[order], start[order], end[order]
+
+
+def _to_offsets(values: Sequence[datetime], window_start: datetime, span: int) -> np.ndarray:
+    """datetime 序列转换为相对窗口起点的秒数并裁剪到窗口内"""
+    arr = np.array(values, dtype="datetime64[s]")
+    seconds = (arr - np.datetime64(window_start, "s")).astype(np.int64)
+    return np.clip(seconds, 0, span)
+
+
+def _group(rank: np.ndarray, start: np.ndarray, end: np.ndarray, window_start: datetime) -> Dict[int, List[dict]]:
+    grouped: Dict[int, List[dict]] = {}
+    for r, s, e in zip(rank.tolist(), start.tolist(), end.tolist()):
+        grouped.setdefault(r, []).append({
+            "start": window_start + timedelta(seconds=s),
+            "end": window_start + timedelta(seconds=e),
+            "minutes": (e - s) // 60,
+        })
+    return grouped
+
+
+def get_availability_calendar(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    device_ids: Optional[List[int]] = None,
+    location: Optional[str] = None,
+    min_slot_minutes: int = 0,
+) -> List[dict]:
+    """计算一组设备在 [start, end) 内的忙碌区间和空闲时段"""
+    device_query = db.query(Device.id, Device.name, Device.location, Device.status)
+    if device_ids:
+        device_query = device_query.filter(Device.id.in_(device_ids))
+    if location:
+        device_query = device_query.filter(Device.location == location)
+    devices = device_query.order_by(Device.id).all()
+    if not devices:
+        return []
+
+    rank_of = {row.id: i for i, row in enumerate(devices)}
+    span = int((end - start).total_seconds())
+
+    # 一次范围查询取出窗口内所有有效预约
+    reservations = db.query(
+        DeviceReservation.device_id,
+        DeviceReservation.start_time,
+        DeviceReservation.end_time,
+    ).filter(
+        DeviceReservation.device_id.in_(list(rank_of)),
+        DeviceReservation.status.in_(BUSY_RESERVATION_STATUSES),
+        DeviceReservation.start_time < end,
+        DeviceReservation.end_time > start,
+    ).all()
+
+    if reservations:
+        ranks = np.fromiter((rank_of[r.device_id] for r in reservations), dtype=np.int64, count=len(reservations))
+        starts = _to_offsets([r.start_time for r in reservations], start, span)
+        ends = _to_offsets([r.end_time for r in reservations], start, span)
+    else:
+        ranks = starts = ends = np.empty(0, dtype=np.int64)
+
+    busy_rank, busy_start, busy_end = merge_intervals(ranks, starts, ends, span)
+    free_rank, free_start, free_end = free_gaps(
+        len(devices), busy_rank, busy_start, busy_end, span, min_slot_minutes * 60
+    )
+
+    busy = _group(busy_rank, busy_start, busy_end, start)
+    free = _group(free_rank, free_start, free_end, start)
+
+    result = []
+    for i, device in enumerate(devices):
+        bookable = device.status in BOOKABLE_DEVICE_STATUSES
+        result.append({
+            "device_id": device.id,
+            "name": device.name,
+            "location": device.location,
+            "status": device.status,
+            "bookable": bookable,
+            "busy": busy.get(i, []),
+            "free_slots": free.get(i, []) if bookable else [],
+        })
+    return result
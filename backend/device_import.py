@@ -0,0 +1,289 @@
+# backend/device_import.py
+
+"""
+设备流式批量导入
+
+上传文件先落盘到临时文件，再由后台任务按批次解析 CSV / NDJSON：
+每批只用一条 IN 查询检查序列号唯一性，批量 INSERT 后立即提交，
+避免长时间持有写锁，并通过 JobTracker 汇报进度。
+"""
+
+import csv
+import json
+import os
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Device
+from job_tracker import JobTracker
+from cache_config import CacheConfig, CacheType
+from redis_cache import invalidate_cache_pattern
+from maintenance_scheduler import sync_due_snapshot
+
+logger = logging.getLogger(__name__)
+
+# 每批处理的行数
+IMPORT_CHUNK_SIZE = 900
+
+# 单条 IN 查询携带的序列号上限
+SERIAL_QUERY_CHUNK = 900
+
+# 视为空序列号的占位值
+EMPTY_SERIALS = {None, '', '/', '-'}
+
+# 表头映射：兼容导出模板中的中文列名和英文字段名
+HEADER_MAP = {
+    '名称': 'name',
+    '设备名称': 'name',
+    '描述': 'description',
+    '型号': 'model',
+    '序列号': 'serial_number',
+    '位置': 'location',
+    '状态': 'status',
+    '负责人': 'responsible_person',
+    '购买日期': 'purchase_date',
+    '保修期至': 'warranty_expiry',
+    '上次维护': 'last_maintenance',
+    '下次维护': 'next_maintenance',
+    '维护间隔(天)': 'maintenance_interval',
+    '维护间隔': 'maintenance_interval',
+}
+
+DEVICE_FIELDS = {
+    'name', 'description', 'status', 'location', 'model', 'serial_number',
+    'purchase_date', 'warranty_expiry', 'last_maintenance', 'next_maintenance',
+    'maintenance_interval', 'responsible_person',
+}
+
+DATE_FIELDS = ('purchase_date', 'warranty_expiry', 'last_maintenance', 'next_maintenance')
+
+# 全局导入任务跟踪器
+import_tracker = JobTracker("device_import")
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str] = None) -> Optional[str]:
+    """根据文件名或Content-Type判断导入格式"""
+    name = (filename or '').lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if content_type in ('text/csv', 'application/vnd.ms-excel'):
+        return 'csv'
+    if content_type in ('application/x-ndjson', 'application/jsonl'):
+        return 'ndjson'
+    return None
+
+
+def _parse_date(value) -> Optional[date]:
+    if value in (None, ''):
+        return None
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    for fmt in ('%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d'):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"日期格式无效: {text}")
+
+
+def normalize_row(raw: Dict) -> Dict:
+    """
+    将一行原始数据转换为设备字段字典
+
+    Raises:
+        ValueError: 数据不合法
+    """
+    row = dict.fromkeys(DEVICE_FIELDS)
+    for key, value in raw.items():
+        if key is None:
+            continue
+        field = HEADER_MAP.get(key.strip(), key.strip())
+        if field not in DEVICE_FIELDS:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+        row[field] = value if value != '' else None
+
+    if not row.get('name'):
+        raise ValueError("设备名称不能为空")
+
+    if row.get('serial_number') in EMPTY_SERIALS:
+        row['serial_number'] = None
+    elif row.get('serial_number') is not None:
+        row['serial_number'] = str(row['serial_number'])
+
+    for field in DATE_FIELDS:
+        row[field] = _parse_date(row.get(field))
+
+    interval = row.get('maintenance_interval')
+    if interval is not None:
+        try:
+            row['maintenance_interval'] = int(interval)
+        except (TypeError, ValueError):
+            raise ValueError(f"维护间隔无效: {interval}")
+    else:
+        row['maintenance_interval'] = 90
+
+    row['status'] = row.get('status') or 'available'
+
+    # 未提供下次维护日期时按购买日期推算，与 batch-import 保持一致
+    if not row.get('next_maintenance') and row.get('purchase_date') and row['maintenance_interval']:
+        row['next_maintenance'] = row['purchase_date'] + timedelta(days=row['maintenance_interval'])
+
+    return row
+
+
+def iter_rows(path: str, fmt: str) -> Iterator[Tuple[int, Dict]]:
+    """逐行读取导入文件，产出 (行号, 原始数据)"""
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                # 表头占第1行
+                yield reader.line_num, row
+        else:
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_no, {'__error__': f"JSON解析失败: {e.msg}"}
+                    continue
+                if not isinstance(data, dict):
+                    yield line_no, {'__error__': "每行必须是一个JSON对象"}
+                    continue
+                yield line_no, data
+
+
+def iter_chunks(rows: Iterable, size: int = IMPORT_CHUNK_SIZE) -> Iterator[List]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def find_existing_serials(db: Session, serial_numbers: Iterable[str]) -> Dict[str, str]:
+    """一次 IN 查询返回已存在的序列号及对应设备名称"""
+    serials = list({s for s in serial_numbers if s})
+    existing = {}
+    # 超过 SQLite 绑定参数上限时拆分为多条 IN 查询
+    for i in range(0, len(serials), SERIAL_QUERY_CHUNK):
+        rows = db.query(Device.serial_number, Device.name).filter(
+            Device.serial_number.in_(serials[i:i + SERIAL_QUERY_CHUNK])
+        ).all()
+        existing.update({serial: name for serial, name in rows})
+    return existing
+
+
+def import_chunk(db: Session, chunk: List[Tuple[int, Dict]], seen_serials: Set[str]) -> Tuple[int, List[str]]:
+    """
+    校验并批量插入一批设备，成功后提交
+
+    Returns:
+        (成功条数, 错误信息列表)
+    """
+    parse_errors = []
+    valid = []
+    for line_no, raw in chunk:
+        if '__error__' in raw:
+            parse_errors.append(f"第{line_no}行: {raw['__error__']}")
+            continue
+        try:
+            valid.append((line_no, normalize_row(raw)))
+        except ValueError as e:
+            parse_errors.append(f"第{line_no}行: {e}")
+
+    for attempt in range(2):
+        serial_errors = []
+        existing = find_existing_serials(db, (row['serial_number'] for _, row in valid))
+        to_insert = []
+        batch_serials = set()
+        for line_no, row in valid:
+            serial = row['serial_number']
+            if serial:
+                if serial in existing:
+                    serial_errors.append(f"第{line_no}行: 序列号 '{serial}' 已存在，设备名称: {existing[serial]}")
+                    continue
+                if serial in seen_serials or serial in batch_serials:
+                    serial_errors.append(f"第{line_no}行: 序列号 '{serial}' 在导入数据中重复")
+                    continue
+                batch_serials.add(serial)
+            to_insert.append(row)
+
+        if not to_insert:
+            return 0, parse_errors + serial_errors
+
+        try:
+            new_ids = db.scalars(insert(Device).returning(Device.id), to_insert).all()
+            db.commit()
+            seen_serials.update(batch_serials)
+            # 已到维护期的新设备立即进入待维护快照，不等下一次定时扫描
+            if any(row.get('next_maintenance') for row in to_insert):
+                sync_due_snapshot(db, new_ids)
+            return len(to_insert), parse_errors + serial_errors
+        except IntegrityError:
+            # 检查与插入之间有其他写入者占用了序列号，重新检查一次
+            db.rollback()
+            if attempt == 1:
+                raise
+
+    return 0, parse_errors
+
+
+def run_device_import(job_id: str, path: str, fmt: str):
+    """后台执行导入任务（在线程池中运行）"""
+    db = SessionLocal()
+    seen_serials: Set[str] = set()
+    try:
+        import_tracker.start(job_id)
+        for chunk in iter_chunks(iter_rows(path, fmt)):
+            try:
+                succeeded, errors = import_chunk(db, chunk, seen_serials)
+            except Exception as e:
+                db.rollback()
+                first_line = chunk[0][0]
+                last_line = chunk[-1][0]
+                succeeded, errors = 0, [f"第{first_line}-{last_line}行: 批次写入失败: {e}"]
+            import_tracker.advance(
+                job_id,
+                processed=len(chunk),
+                succeeded=succeeded,
+                failed=len(chunk) - succeeded,
+                errors=errors,
+            )
+
+        job = import_tracker.get(job_id) or {}
+        import_tracker.complete(
+            job_id,
+            result={
+                "imported_count": job.get("succeeded", 0),
+                "failed_count": job.get("failed", 0),
+            },
+            message="批量导入完成",
+        )
+    except Exception as e:
+        db.rollback()
+        import_tracker.fail(job_id, f"批量导入失败: {e}")
+    finally:
+        db.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        for pattern in CacheConfig.get_invalidation_patterns(CacheType.DEVICES):
+            invalidate_cache_pattern(pattern)
@@ -0,0 +1,378 @@
+# backend/device_usage_rollup.py
+
+"""
+设备每日使用汇总
+
+后台任务按水位增量扫描预约、借用和维护记录中发生变化的行，
+只重算受影响的 (设备, 日期范围)，写入 device_usage_daily。
+使用统计、全局利用率排行和月度趋势都基于该表做范围扫描。
+"""
+
+import logging
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, delete, func, insert, or_
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import (
+    Device, DeviceBorrow, DeviceMaintenance, DeviceReservation,
+    DeviceUsageDaily, RollupState,
+)
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_NAME = "device_usage_daily"
+
+# 水位回退量，容忍提交时间晚于 updated_at 的写入（重算是幂等的）
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+# 计入预约时长的状态（被拒绝或取消的预约不占用设备）
+COUNTED_RESERVATION_STATUSES = ["pending", "approved", "completed"]
+
+# 每批重算的设备数
+DEVICE_CHUNK_SIZE = 200
+
+METRIC_FIELDS = (
+    "reserved_hours", "completed_hours", "borrow_hours",
+    "reservation_count", "completed_count", "maintenance_count",
+)
+
+DayRanges = Dict[int, Tuple[date, date]]
+
+
+def split_by_day(start: datetime, end: datetime) -> Iterator[Tuple[date, float]]:
+    """将时间区间按自然日切分，产出 (日期, 小时数)"""
+    cursor = start
+    while cursor < end:
+        next_midnight = datetime.combine(cursor.date() + timedelta(days=1), time.min)
+        segment_end = min(next_midnight, end)
+        yield cursor.date(), (segment_end - cursor).total_seconds() / 3600
+        cursor = segment_end
+
+
+def _extend(ranges: DayRanges, device_id: Optional[int], first: date, last: date):
+    if device_id is None:
+        return
+    if last < first:
+        first, last = last, first
+    if device_id in ranges:
+        lo, hi = ranges[device_id]
+        ranges[device_id] = (min(lo, first), max(hi, last))
+    else:
+        ranges[device_id] = (first, last)
+
+
+def compute_usage(db: Session, ranges: DayRanges, now: Optional[datetime] = None) -> List[dict]:
+    """按设备和日期范围从源表重新计算汇总行（只返回有数据的行）"""
+    if not ranges:
+        return []
+    now = now or datetime.utcnow()
+    device_ids = list(ranges)
+    lo = min(r[0] for r in ranges.values())
+    hi = max(r[1] for r in ranges.values())
+    lo_dt = datetime.combine(lo, time.min)
+    hi_dt = datetime.combine(hi + timedelta(days=1), time.min)
+
+    buckets = defaultdict(lambda: dict.fromkeys(METRIC_FIELDS, 0))
+
+    reservations = db.query(
+        DeviceReservation.device_id,
+        DeviceReservation.start_time,
+        DeviceReservation.end_time,
+        DeviceReservation.status,
+    ).filter(
+        DeviceReservation.device_id.in_(device_ids),
+        DeviceReservation.status.in_(COUNTED_RESERVATION_STATUSES),
+        DeviceReservation.start_time < hi_dt,
+        DeviceReservation.end_time > lo_dt,
+    ).all()
+    for r in reservations:
+        completed = r.status == "completed"
+        for day, hours in split_by_day(max(r.start_time, lo_dt), min(r.end_time, hi_dt)):
+            bucket = buckets[(r.device_id, day)]
+            bucket["reserved_hours"] += hours
+            if completed:
+                bucket["completed_hours"] += hours
+        # 预约次数计在开始日期上，避免跨天预约重复计数
+        start_day = r.start_time.date()
+        if lo <= start_day <= hi:
+            bucket = buckets[(r.device_id, start_day)]
+            bucket["reservation_count"] += 1
+            if completed:
+                bucket["completed_count"] += 1
+
+    borrows = db.query(
+        DeviceBorrow.device_id,
+        DeviceBorrow.borrow_time,
+        DeviceBorrow.return_time,
+    ).filter(
+        DeviceBorrow.device_id.in_(device_ids),
+        DeviceBorrow.borrow_time < hi_dt,
+        or_(
+            DeviceBorrow.return_time > lo_dt,
+            and_(DeviceBorrow.return_time.is_(None), DeviceBorrow.status == "borrowed"),
+        ),
+    ).all()
+    for b in borrows:
+        end = b.return_time or now
+        for day, hours in split_by_day(max(b.borrow_time, lo_dt), min(end, hi_dt)):
+            buckets[(b.device_id, day)]["borrow_hours"] += hours
+
+    maintenance = db.query(
+        DeviceMaintenance.device_id,
+        DeviceMaintenance.maintenance_date,
+        func.count(DeviceMaintenance.id),
+    ).filter(
+        DeviceMaintenance.device_id.in_(device_ids),
+        DeviceMaintenance.maintenance_date >= lo,
+        DeviceMaintenance.maintenance_date <= hi,
+    ).group_by(DeviceMaintenance.device_id, DeviceMaintenance.maintenance_date).all()
+    for device_id, day, count in maintenance:
+        buckets[(device_id, day)]["maintenance_count"] += count
+
+    rows = []
+    for (device_id, day), metrics in buckets.items():
+        first, last = ranges[device_id]
+        if first <= day <= last and any(metrics.values()):
+            rows.append({
+                "device_id": device_id,
+                "day": day,
+                "updated_at": now,
+                **{k: round(v, 4) if isinstance(v, float) else v for k, v in metrics.items()},
+            })
+    return rows
+
+
+def write_usage(db: Session, ranges: DayRanges, rows: List[dict]):
+    """删除各设备范围内的旧汇总行并批量写入新行（同一事务）"""
+    if ranges:
+        table = DeviceUsageDaily.__table__
+        db.execute(
+            delete(table).where(
+                table.c.device_id == bindparam("b_device_id"),
+                table.c.day >= bindparam("b_first"),
+                table.c.day <= bindparam("b_last"),
+            ),
+            [
+                {"b_device_id": device_id, "b_first": first, "b_last": last}
+                for device_id, (first, last) in ranges.items()
+            ],
+        )
+    if rows:
+        db.execute(insert(DeviceUsageDaily), rows)
+
+
+def _process(db: Session, ranges: DayRanges, now: datetime) -> int:
+    """按设备分批重算并提交，返回写入的汇总行数"""
+    written = 0
+    device_ids = sorted(ranges)
+    for i in range(0, len(device_ids), DEVICE_CHUNK_SIZE):
+        chunk = {d: ranges[d] for d in device_ids[i:i + DEVICE_CHUNK_SIZE]}
+        rows = compute_usage(db, chunk, now)
+        write_usage(db, chunk, rows)
+        db.commit()
+        written += len(rows)
+    return written
+
+
+def _set_watermark(db: Session, watermark: datetime):
+    state = db.get(RollupState, ROLLUP_NAME)
+    if state is None:
+        db.add(RollupState(name=ROLLUP_NAME, watermark=watermark))
+    else:
+        state.watermark = watermark
+    db.commit()
+
+
+def _archive_boundary(db: Session) -> Optional[date]:
+    from data_archive import archive_boundary  # 避免循环导入
+
+    return archive_boundary(db, DeviceReservation.__tablename__)
+
+
+def _clip_ranges(ranges: DayRanges, boundary: Optional[date]) -> DayRanges:
+    """去掉归档边界之前的日期（这些日期的预约已移入归档表，不能从热表重算）"""
+    if boundary is None:
+        return ranges
+    return {
+        device_id: (max(first, boundary), last)
+        for device_id, (first, last) in ranges.items() if last >= boundary
+    }
+
+
+def rebuild_all(db: Session) -> dict:
+    """全量重建汇总表（归档边界之前的日期保留原汇总行）"""
+    now = datetime.utcnow()
+    today = now.date()
+    boundary = _archive_boundary(db)
+
+    earliest = [
+        db.query(func.min(DeviceReservation.start_time)).scalar(),
+        db.query(func.min(DeviceBorrow.borrow_time)).scalar(),
+        db.query(func.min(DeviceMaintenance.maintenance_date)).scalar(),
+    ]
+    latest = [today, db.query(func.max(DeviceReservation.end_time)).scalar()]
+    earliest = [d.date() if isinstance(d, datetime) else d for d in earliest if d]
+    latest = [d.date() if isinstance(d, datetime) else d for d in latest if d]
+    first = min(earliest) if earliest else today
+    last = max(latest)
+
+    stale = delete(DeviceUsageDaily)
+    if boundary is not None:
+        stale = stale.where(DeviceUsageDaily.day >= boundary)
+    db.execute(stale)
+    db.commit()
+
+    ranges = _clip_ranges({device_id: (first, last) for (device_id,) in db.query(Device.id).all()}, boundary)
+    written = _process(db, ranges, now)
+    _set_watermark(db, now)
+    return {"mode": "rebuild", "devices": len(ranges), "rows_written": written}
+
+
+def refresh_incremental(db: Session) -> dict:
+    """根据水位增量刷新受影响的 (设备, 日期范围)；首次运行时全量重建"""
+    state = db.get(RollupState, ROLLUP_NAME)
+    if state is None or state.watermark is None:
+        return rebuild_all(db)
+
+    now = datetime.utcnow()
+    today = now.date()
+    since = state.watermark - WATERMARK_OVERLAP
+    ranges: DayRanges = {}
+
+    for device_id, start, end in db.query(
+        DeviceReservation.device_id, DeviceReservation.start_time, DeviceReservation.end_time
+    ).filter(DeviceReservation.updated_at > since).all():
+        if start and end:
+            _extend(ranges, device_id, start.date(), end.date())
+
+    for device_id, borrowed, returned in db.query(
+        DeviceBorrow.device_id, DeviceBorrow.borrow_time, DeviceBorrow.return_time
+    ).filter(DeviceBorrow.updated_at > since).all():
+        if borrowed:
+            _extend(ranges, device_id, borrowed.date(), (returned or now).date())
+
+    # 未归还的借用每天都会增加借用时长
+    for device_id, borrowed in db.query(
+        DeviceBorrow.device_id, DeviceBorrow.borrow_time
+    ).filter(DeviceBorrow.status == "borrowed", DeviceBorrow.return_time.is_(None)).all():
+        if borrowed:
+            _extend(ranges, device_id, max(borrowed.date(), since.date()), today)
+
+    for device_id, day in db.query(
+        DeviceMaintenance.device_id, DeviceMaintenance.maintenance_date
+    ).filter(DeviceMaintenance.created_at > since).all():
+        if day:
+            _extend(ranges, device_id, day, day)
+
+    ranges = _clip_ranges(ranges, _archive_boundary(db))
+    written = _process(db, ranges, now)
+    _set_watermark(db, now)
+    return {"mode": "incremental", "devices": len(ranges), "rows_written": written}
+
+
+def run_usage_rollup(rebuild: bool = False) -> dict:
+    """调度器/后台任务入口"""
+    db = SessionLocal()
+    try:
+        result = rebuild_all(db) if rebuild else refresh_incremental(db)
+        logger.info(f"设备使用汇总完成: {result}")
+        return result
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+# ---------- 查询 ----------
+
+def _sum_columns():
+    return [
+        func.coalesce(func.sum(DeviceUsageDaily.reserved_hours), 0.0).label("reserved_hours"),
+        func.coalesce(func.sum(DeviceUsageDaily.completed_hours), 0.0).label("completed_hours"),
+        func.coalesce(func.sum(DeviceUsageDaily.borrow_hours), 0.0).label("borrow_hours"),
+        func.coalesce(func.sum(DeviceUsageDaily.reservation_count), 0).label("reservation_count"),
+        func.coalesce(func.sum(DeviceUsageDaily.completed_count), 0).label("completed_count"),
+        func.coalesce(func.sum(DeviceUsageDaily.maintenance_count), 0).label("maintenance_count"),
+    ]
+
+
+def utilization(used_hours: float, days: int) -> float:
+    """实际使用时长占时间窗口的比例"""
+    return round(min(used_hours / (max(days, 1) * 24), 1.0), 4)
+
+
+def get_usage_totals(db: Session, device_id: int, first: date, last: date) -> dict:
+    """单台设备在日期范围内的汇总"""
+    row = db.query(*_sum_columns()).filter(
+        DeviceUsageDaily.device_id == device_id,
+        DeviceUsageDaily.day >= first,
+        DeviceUsageDaily.day <= last,
+    ).one()
+    return dict(row._mapping)
+
+
+def get_utilization_leaderboard(db: Session, first: date, last: date, limit: int = 20,
+                                location: Optional[str] = None) -> List[dict]:
+    """全局设备利用率排行（按实际使用时长降序）"""
+    used = (func.sum(DeviceUsageDaily.completed_hours) + func.sum(DeviceUsageDaily.borrow_hours)).label("used_hours")
+    query = db.query(
+        DeviceUsageDaily.device_id, Device.name, Device.location, *_sum_columns(), used
+    ).join(Device, Device.id == DeviceUsageDaily.device_id).filter(
+        DeviceUsageDaily.day >= first,
+        DeviceUsageDaily.day <= last,
+    )
+    if location:
+        query = query.filter(Device.location == location)
+
+    rows = query.group_by(
+        DeviceUsageDaily.device_id, Device.name, Device.location
+    ).order_by(used.desc()).limit(limit).all()
+
+    days = (last - first).days + 1
+    result = []
+    for row in rows:
+        item = dict(row._mapping)
+        item["utilization_rate"] = utilization(item["used_hours"] or 0.0, days)
+        result.append(item)
+    return result
+
+
+def get_monthly_trend(db: Session, months: int = 12, device_id: Optional[int] = None,
+                      today: Optional[date] = None) -> List[dict]:
+    """最近 N 个月的月度趋势（按日聚合后在内存中归并到月份，与数据库方言无关）"""
+    today = today or date.today()
+    year, month = today.year, today.month - (months - 1)
+    while month <= 0:
+        year, month = year - 1, month + 12
+    first = date(year, month, 1)
+
+    query = db.query(DeviceUsageDaily.day, *_sum_columns()).filter(
+        DeviceUsageDaily.day >= first,
+        DeviceUsageDaily.day <= today,
+    )
+    if device_id is not None:
+        query = query.filter(DeviceUsageDaily.device_id == device_id)
+    daily = query.group_by(DeviceUsageDaily.day).all()
+
+    trend = {}
+    y, m = first.year, first.month
+    for _ in range(months):
+        trend[f"{y:04d}-{m:02d}"] = dict.fromkeys(METRIC_FIELDS, 0)
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+
+    for row in daily:
+        bucket = trend.get(row.day.strftime("%Y-%m"))
+        if bucket is None:
+            continue
+        for field in METRIC_FIELDS:
+            bucket[field] += getattr(row, field) or 0
+
+    return [
+        {"month": key, **{k: round(v, 2) if isinstance(v, float) else v for k, v in values.items()}}
+        for key, values in trend.items()
+    ]
@@ -0,0 +1,310 @@
+# backend/inventory_ledger.py
+
+"""
+库存流水与快照
+
+每次试剂/耗材库存变化都向 inventory_movements 追加一条流水：ORM 写入
+由 mapper 事件收集差额，在 flush 结束时一次性批量插入；绕过 ORM 的
+批量写入（批量更新/删除、批次分配）显式调用 record_movements。
+流水原因默认为 edit，入库、出库等接口用 set_movement_context 指定。
+
+定期任务按物品写入快照（库存余额和累计消耗，以及已包含的最后一条
+流水ID），并把实际库存与流水余额对账，差额记为 reconcile 流水（首次
+运行时为 opening 期初流水）。查询某一时刻的库存只需按索引找到该时刻
+之前和之后最近的快照，再扫描两者之间的少量流水。
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, event, func, inspect, insert
+from sqlalchemy.orm import Session, object_session
+
+from database import SessionLocal
+from models import Consumable, InventoryMovement, InventorySnapshot, Reagent
+
+logger = logging.getLogger(__name__)
+
+ITEM_REAGENT = "reagent"
+ITEM_CONSUMABLE = "consumable"
+ITEM_MODELS = {ITEM_REAGENT: Reagent, ITEM_CONSUMABLE: Consumable}
+
+REASON_CREATE = "create"
+REASON_EDIT = "edit"
+REASON_RECEIVE = "receive"
+REASON_USE = "use"
+REASON_APPROVAL = "approval"
+REASON_BATCH_UPDATE = "batch_update"
+REASON_DELETE = "delete"
+REASON_RECONCILE = "reconcile"
+REASON_OPENING = "opening"
+
+# 计入消耗量的流水原因
+CONSUMPTION_REASONS = (REASON_USE, REASON_APPROVAL)
+
+# Session.info 中的键
+SESSION_PENDING_KEY = "inventory_movements"
+SESSION_CONTEXT_KEY = "inventory_movement_context"
+
+INSERT_CHUNK_SIZE = 1000
+
+# 浮点数量比较的容差
+EPSILON = 1e-9
+
+# 快照只覆盖创建时间早于该秒数之前的流水，等待进行中的事务提交
+SNAPSHOT_SETTLE_SECONDS = 60
+
+
+def item_type_of(model) -> str:
+    return ITEM_REAGENT if model is Reagent else ITEM_CONSUMABLE
+
+
+def movement_row(item_type: str, item_id: int, delta: float, quantity_after: Optional[float], reason: str,
+                 reference_id: Optional[int] = None, user_id: Optional[int] = None,
+                 created_at: Optional[datetime] = None, note: Optional[str] = None) -> dict:
+    return {
+        "item_type": item_type,
+        "item_id": item_id,
+        "delta": delta,
+        "quantity_after": quantity_after,
+        "reason": reason,
+        "reference_id": reference_id,
+        "user_id": user_id,
+        "note": note,
+        "created_at": created_at or datetime.utcnow(),
+    }
+
+
+def record_movements(connection, rows: Iterable[dict]):
+    """批量追加流水（Session 或 Connection，调用方提交）"""
+    rows = list(rows)
+    table = InventoryMovement.__table__
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        connection.execute(insert(table), rows[i:i + INSERT_CHUNK_SIZE])
+
+
+def set_movement_context(db: Session, reason: str, reference_id: Optional[int] = None,
+                         user_id: Optional[int] = None):
+    """指定本事务内经 ORM 修改库存时记录的流水原因、关联单据和操作人"""
+    db.info[SESSION_CONTEXT_KEY] = {"reason": reason, "reference_id": reference_id, "user_id": user_id}
+
+
+def _consumed_expr():
+    M = InventoryMovement
+    return func.coalesce(func.sum(case((M.reason.in_(CONSUMPTION_REASONS), -M.delta), else_=0.0)), 0.0)
+
+
+# ---------- ORM 事件：单条写入时收集差额 ----------
+
+def _queue_movement(target, delta: float, quantity_after: float, reason: Optional[str] = None):
+    """暂存到 Session.info，reason 为空时使用 set_movement_context 指定的原因"""
+    session = object_session(target)
+    if session is None or abs(delta) <= EPSILON:
+        return
+    context = session.info.get(SESSION_CONTEXT_KEY) or {}
+    session.info.setdefault(SESSION_PENDING_KEY, []).append(movement_row(
+        item_type_of(type(target)),
+        target.id,
+        delta,
+        quantity_after,
+        reason or context.get("reason", REASON_EDIT),
+        context.get("reference_id"),
+        context.get("user_id"),
+    ))
+
+
+def _after_insert(mapper, connection, target):
+    _queue_movement(target, target.quantity or 0.0, target.quantity or 0.0, REASON_CREATE)
+
+
+def _after_update(mapper, connection, target):
+    history = inspect(target).attrs.quantity.history
+    # 旧值未加载时无法得到差额，由对账任务补记
+    if history.has_changes() and history.deleted:
+        quantity = target.quantity or 0.0
+        _queue_movement(target, quantity - (history.deleted[0] or 0.0), quantity)
+
+
+def _after_delete(mapper, connection, target):
+    _queue_movement(target, -(target.quantity or 0.0), 0.0, REASON_DELETE)
+
+
+for _model in (Reagent, Consumable):
+    event.listen(_model, "after_insert", _after_insert)
+    event.listen(_model, "after_update", _after_update)
+    event.listen(_model, "after_delete", _after_delete)
+
+
+@event.listens_for(Session, "after_flush")
+def _write_pending_movements(session, flush_context):
+    rows = session.info.pop(SESSION_PENDING_KEY, None)
+    if rows:
+        record_movements(session.connection(), rows)
+
+
+@event.listens_for(Session, "after_commit")
+def _clear_context_after_commit(session):
+    session.info.pop(SESSION_CONTEXT_KEY, None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _clear_context_after_rollback(session):
+    session.info.pop(SESSION_PENDING_KEY, None)
+    session.info.pop(SESSION_CONTEXT_KEY, None)
+
+
+# ---------- 快照与对账 ----------
+
+def _latest_balances(db: Session) -> Dict[Tuple[str, int], List[float]]:
+    """各物品最近一次快照的 [余额, 累计消耗]"""
+    S = InventorySnapshot
+    latest = db.query(func.max(S.id).label("id")).group_by(S.item_type, S.item_id).subquery()
+    rows = db.query(S.item_type, S.item_id, S.quantity, S.consumed_total).join(latest, latest.c.id == S.id).all()
+    return {(row.item_type, row.item_id): [row.quantity, row.consumed_total] for row in rows}
+
+
+def _current_quantities(db: Session) -> Dict[Tuple[str, int], float]:
+    current = {}
+    for item_type, model in ITEM_MODELS.items():
+        for item_id, quantity in db.query(model.id, model.quantity).all():
+            current[(item_type, item_id)] = quantity or 0.0
+    return current
+
+
+def take_inventory_snapshots(db: Session, now: Optional[datetime] = None) -> dict:
+    """
+    为上次快照以来有流水的物品写入快照，并对账实际库存
+
+    流水 ID 在插入时分配、在事务提交时才可见，ID 较小的流水可能晚于
+    ID 较大的流水提交。因此快照只覆盖创建时间早于 now - SNAPSHOT_SETTLE_SECONDS
+    的流水（读取上限取其中最大的 ID），快照时间记为该截止时间；更新的
+    流水留给下一次快照。对账时实际库存已包含这些较新的流水，比较前把
+    它们计入流水余额。对账产生的流水 ID 更大，同样计入下一次快照。
+    读取在同一事务内完成，PostgreSQL 下使用可重复读，保证库存与流水一致。
+    """
+    now = now or datetime.utcnow()
+    settled_before = now - timedelta(seconds=SNAPSHOT_SETTLE_SECONDS)
+    S, M = InventorySnapshot, InventoryMovement
+    if db.get_bind().dialect.name == "postgresql":
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+    watermark = db.query(func.max(S.last_movement_id)).scalar() or 0
+    upto = db.query(func.max(M.id)).filter(M.created_at < settled_before).scalar() or 0
+    upto = max(upto, watermark)
+    balances = _latest_balances(db)
+
+    changed = set()
+    if upto > watermark:
+        rows = db.query(M.item_type, M.item_id, func.sum(M.delta), _consumed_expr()).filter(
+            M.id > watermark, M.id <= upto
+        ).group_by(M.item_type, M.item_id).all()
+        for item_type, item_id, delta, consumed in rows:
+            balance = balances.setdefault((item_type, item_id), [0.0, 0.0])
+            balance[0] += delta or 0.0
+            balance[1] += consumed or 0.0
+            changed.add((item_type, item_id))
+
+    # 尚未纳入快照的较新流水
+    pending = {
+        (item_type, item_id): delta or 0.0
+        for item_type, item_id, delta in db.query(M.item_type, M.item_id, func.sum(M.delta)).filter(
+            M.id > upto
+        ).group_by(M.item_type, M.item_id).all()
+    }
+
+    # 对账：实际库存与流水余额不一致的物品补记差额（已删除的物品实际库存视为 0）
+    current = _current_quantities(db)
+    adjustments = []
+    for key in current.keys() | balances.keys() | pending.keys():
+        actual = current.get(key, 0.0)
+        ledger = balances.get(key, [0.0, 0.0])[0] + pending.get(key, 0.0)
+        if abs(actual - ledger) > EPSILON:
+            reason = REASON_RECONCILE if key in balances or key in pending else REASON_OPENING
+            adjustments.append(movement_row(key[0], key[1], actual - ledger, actual, reason, created_at=now))
+    record_movements(db, adjustments)
+
+    snapshots = [
+        {
+            "item_type": item_type,
+            "item_id": item_id,
+            "taken_at": settled_before,
+            "last_movement_id": upto,
+            "quantity": balances[(item_type, item_id)][0],
+            "consumed_total": balances[(item_type, item_id)][1],
+        }
+        for item_type, item_id in changed
+    ]
+    for i in range(0, len(snapshots), INSERT_CHUNK_SIZE):
+        db.execute(insert(S.__table__), snapshots[i:i + INSERT_CHUNK_SIZE])
+    db.commit()
+
+    return {
+        "movements_covered": upto - watermark,
+        "snapshots": len(snapshots),
+        "adjustments": len(adjustments),
+    }
+
+
+def _run_snapshots() -> dict:
+    db = SessionLocal()
+    try:
+        return take_inventory_snapshots(db)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def run_inventory_snapshot() -> dict:
+    """调度器入口"""
+    summary = await asyncio.to_thread(_run_snapshots)
+    logger.info(f"库存快照完成: {summary}")
+    return summary
+
+
+# ---------- 查询 ----------
+
+def ledger_position(db: Session, item_type: str, item_id: int, at: datetime) -> Tuple[float, float]:
+    """
+    某一时刻的 (库存余额, 累计消耗)
+
+    按 (物品, 时间) 索引找到 at 之前最近的快照作为起点、之后最近的快照
+    作为流水ID上界，只扫描两者之间的流水。
+    """
+    S, M = InventorySnapshot, InventoryMovement
+    base = db.query(S.last_movement_id, S.quantity, S.consumed_total).filter(
+        S.item_type == item_type, S.item_id == item_id, S.taken_at <= at
+    ).order_by(S.taken_at.desc(), S.id.desc()).first()
+    bound = db.query(S.last_movement_id).filter(
+        S.item_type == item_type, S.item_id == item_id, S.taken_at > at
+    ).order_by(S.taken_at, S.id).first()
+
+    after_id, quantity, consumed = (base.last_movement_id, base.quantity, base.consumed_total) if base else (0, 0.0, 0.0)
+
+    query = db.query(func.coalesce(func.sum(M.delta), 0.0), _consumed_expr()).filter(
+        M.item_type == item_type,
+        M.item_id == item_id,
+        M.id > after_id,
+        M.created_at <= at,
+    )
+    if bound is not None:
+        query = query.filter(M.id <= bound.last_movement_id)
+    delta, delta_consumed = query.one()
+    return quantity + (delta or 0.0), consumed + (delta_consumed or 0.0)
+
+
+def stock_at(db: Session, item_type: str, item_id: int, at: datetime) -> float:
+    return ledger_position(db, item_type, item_id, at)[0]
+
+
+def consumption_between(db: Session, item_type: str, item_id: int, start: datetime, end: datetime) -> float:
+    """[start, end] 区间内的消耗量（领用审批和出库）"""
+    return ledger_position(db, item_type, item_id, end)[1] - ledger_position(db, item_type, item_id, start)[1]
+
+
+def recent_movements(db: Session, item_type: str, item_id: int, limit: int = 50) -> List[InventoryMovement]:
+    M = InventoryMovement
+    return db.query(M).filter(M.item_type == item_type, M.item_id == item_id).order_by(M.id.desc()).limit(limit).all()
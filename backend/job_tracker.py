@@ -0,0 +1,152 @@
+# backend/job_tracker.py
+
+"""
+后台任务状态跟踪
+
+记录导入/导出等长耗时后台任务的进度，进程内保存一份，
+Redis 可用时同时写入，便于多 worker 部署下任意进程查询任务状态。
+已结束超过 JOB_TTL 的任务从进程内副本中清除，与 Redis 记录同时过期。
+"""
+
+import threading
+import uuid
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from redis_cache import redis_cache
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+# 任务记录保留时间（秒）
+JOB_TTL = 24 * 3600
+
+# 单个任务保留的错误明细上限
+MAX_JOB_ERRORS = 100
+
+
+class JobTracker:
+    """后台任务进度跟踪器"""
+
+    def __init__(self, kind: str, cache=None):
+        self.kind = kind
+        self.cache = cache or redis_cache
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, job_id: str) -> str:
+        return f"jobs:{self.kind}:{job_id}"
+
+    @staticmethod
+    def _expired(job: Dict[str, Any], cutoff: str) -> bool:
+        """已结束且结束时间早于 cutoff 的任务视为过期"""
+        return (
+            job["status"] in (JOB_COMPLETED, JOB_FAILED)
+            and job["finished_at"] is not None
+            and job["finished_at"] < cutoff
+        )
+
+    @staticmethod
+    def _cutoff() -> str:
+        return (datetime.utcnow() - timedelta(seconds=JOB_TTL)).isoformat()
+
+    def _prune(self):
+        """清除过期任务的进程内副本（调用方持有锁）"""
+        cutoff = self._cutoff()
+        expired = [job_id for job_id, job in self._jobs.items() if self._expired(job, cutoff)]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _persist(self, job: Dict[str, Any]):
+        """写入Redis（不可用时仅保留进程内副本）"""
+        self.cache.set(self._key(job["id"]), job, JOB_TTL)
+
+    def create(self, owner_id: Optional[int] = None, **meta) -> Dict[str, Any]:
+        """创建任务记录"""
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": self.kind,
+            "status": JOB_PENDING,
+            "owner_id": owner_id,
+            "processed": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "errors": [],
+            "total_errors": 0,
+            "result": None,
+            "message": None,
+            "created_at": datetime.utcnow().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            **meta,
+        }
+        with self._lock:
+            self._prune()
+            self._jobs[job["id"]] = job
+            self._persist(job)
+        return dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务状态，优先读取进程内副本"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                if not self._expired(job, self._cutoff()):
+                    return dict(job)
+                del self._jobs[job_id]
+        return self.cache.get(self._key(job_id))
+
+    def update(self, job_id: str, **fields) -> Optional[Dict[str, Any]]:
+        """更新任务字段"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(fields)
+            self._persist(job)
+            return dict(job)
+
+    def start(self, job_id: str):
+        self.update(job_id, status=JOB_RUNNING, started_at=datetime.utcnow().isoformat())
+
+    def advance(self, job_id: str, processed: int = 0, succeeded: int = 0, failed: int = 0, errors=None):
+        """累加进度计数，每个批次调用一次"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["processed"] += processed
+            job["succeeded"] += succeeded
+            job["failed"] += failed
+            if errors:
+                job["total_errors"] += len(errors)
+                room = MAX_JOB_ERRORS - len(job["errors"])
+                if room > 0:
+                    job["errors"].extend(errors[:room])
+            self._persist(job)
+
+    def complete(self, job_id: str, result: Any = None, message: Optional[str] = None):
+        with self._lock:
+            self._prune()
+        self.update(
+            job_id,
+            status=JOB_COMPLETED,
+            result=result,
+            message=message,
+            finished_at=datetime.utcnow().isoformat(),
+        )
+
+    def fail(self, job_id: str, message: str):
+        logger.error(f"{self.kind} 任务 {job_id} 失败: {message}")
+        self.update(
+            job_id,
+            status=JOB_FAILED,
+            message=message,
+            finished_at=datetime.utcnow().isoformat(),
+        )
@@ -0,0 +1,369 @@
+# backend/lot_allocation.py
+
+"""
+批次分配（FEFO，先过期先出）
+
+同一产品的不同批次（批号、过期日期不同）在试剂表中各占一行。领用审批
+通过时，由 plan_allocation 从同一产品的候选批次中按过期日期建小顶堆，
+依次弹出最早过期的批次扣减，单个批次不足时跨批次拆分。每个批次的扣减
+是一条带条件的 UPDATE（库存仍然足够才扣减），并发审批抢占了同一批次
+时重新读取该批次余量，对尚未分配的数量重新规划。每个批次的扣减记
+一条 approval 库存流水。分配在调用方的事务内完成，失败时由调用方回滚。
+
+审批接口（单条和批量）都走 allocate_fefo_batch：调用方先锁定申请行，
+再按固定顺序（先试剂后耗材、按ID升序）锁定全部候选批次，在内存中
+依次分配，最后用一条 executemany UPDATE 写回，并发审批之间不会死锁。
+allocate_fefo 按 FEFO 顺序逐个加锁，不能与持有申请行锁的审批混用。
+
+耗材没有批号和过期日期，同一规格的多行按入库时间先进先出。
+"""
+
+import heapq
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+
+from models import Consumable, Reagent
+from low_stock import refresh_low_stock
+from inventory_ledger import REASON_APPROVAL, item_type_of, movement_row, record_movements
+
+# 浮点数量比较的容差
+EPSILON = 1e-9
+
+# 同一批次被并发扣减后最多重读的次数
+MAX_LOT_RETRIES = 3
+
+# 批量分配时每条加锁查询的批次数
+LOCK_CHUNK_SIZE = 500
+
+# 无过期日期 / 无入库时间的批次排在最后
+_FAR_FUTURE = datetime.max
+
+# 判定"同一产品"的列
+PRODUCT_KEYS = {
+    "reagent": ("name", "manufacturer", "product_number", "unit"),
+    "consumable": ("name", "manufacturer", "model", "specification", "unit"),
+}
+
+
+class LotNotFound(Exception):
+    """申请对应的试剂或耗材不存在"""
+
+
+class InsufficientStock(Exception):
+    """可分配批次的总库存不足"""
+
+    def __init__(self, requested: float, available: float, unit: Optional[str] = None):
+        self.requested = requested
+        self.available = available
+        self.unit = unit or ""
+        super().__init__(f"库存不足。可用库存：{available} {self.unit}，申请数量：{requested} {self.unit}")
+
+
+@dataclass
+class Lot:
+    """候选批次"""
+    id: int
+    quantity: float
+    expiry_date: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+    batch_number: Optional[str] = None
+
+    def sort_key(self) -> Tuple[datetime, datetime, int]:
+        return (self.expiry_date or _FAR_FUTURE, self.created_at or _FAR_FUTURE, self.id)
+
+
+@dataclass
+class LotAllocation:
+    """从某个批次分配的数量"""
+    lot_id: int
+    quantity: float
+    batch_number: Optional[str] = None
+    expiry_date: Optional[datetime] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "lot_id": self.lot_id,
+            "quantity": self.quantity,
+            "batch_number": self.batch_number,
+            "expiry_date": self.expiry_date.isoformat() if self.expiry_date else None,
+        }
+
+
+@dataclass
+class AllocationResult:
+    requested: float
+    unit: Optional[str]
+    remaining_stock: float  # 分配后同一产品所有可用批次的剩余库存
+    allocations: List[LotAllocation] = field(default_factory=list)
+
+    def describe(self) -> str:
+        parts = [
+            f"#{a.lot_id}" + (f"({a.batch_number})" if a.batch_number else "") + f" {a.quantity:g}"
+            for a in self.allocations
+        ]
+        return "批次分配：" + "；".join(parts)
+
+
+def plan_allocation(lots: Sequence[Lot], quantity: float) -> List[LotAllocation]:
+    """
+    纯内存的 FEFO 分配计划（不修改 lots）
+
+    堆化 O(n)，每分配一个批次 O(log n)，不需要对全部候选批次排序。
+
+    Raises:
+        InsufficientStock: 候选批次总量不足
+    """
+    available = sum(lot.quantity for lot in lots if lot.quantity > EPSILON)
+    if available + EPSILON < quantity:
+        raise InsufficientStock(quantity, available)
+
+    heap = [(lot.sort_key(), i) for i, lot in enumerate(lots) if lot.quantity > EPSILON]
+    heapq.heapify(heap)
+
+    plan = []
+    remaining = quantity
+    while remaining > EPSILON and heap:
+        _, i = heapq.heappop(heap)
+        lot = lots[i]
+        take = min(lot.quantity, remaining)
+        plan.append(LotAllocation(lot.id, take, lot.batch_number, lot.expiry_date))
+        remaining -= take
+    return plan
+
+
+def _model_for(item_type: str):
+    return Reagent if item_type == "reagent" else Consumable
+
+
+def _product_filters(model, item_type: str, anchor) -> list:
+    filters = []
+    for column_name in PRODUCT_KEYS[item_type]:
+        column = getattr(model, column_name)
+        value = getattr(anchor, column_name)
+        filters.append(column.is_(None) if value is None else column == value)
+    return filters
+
+
+def load_candidate_lots(db: Session, item_type: str, anchor, now: Optional[datetime] = None) -> List[Lot]:
+    """同一产品有库存且未过期的批次（只查询分配需要的列）"""
+    model = _model_for(item_type)
+    if item_type == "reagent":
+        now = now or datetime.utcnow()
+        rows = db.query(
+            Reagent.id, Reagent.quantity, Reagent.expiry_date, Reagent.created_at, Reagent.batch_number
+        ).filter(
+            *_product_filters(model, item_type, anchor),
+            Reagent.quantity > 0,
+            (Reagent.expiry_date.is_(None)) | (Reagent.expiry_date >= now)
+        ).all()
+        return [Lot(row.id, row.quantity, row.expiry_date, row.created_at, row.batch_number) for row in rows]
+
+    rows = db.query(Consumable.id, Consumable.quantity, Consumable.created_at).filter(
+        *_product_filters(model, item_type, anchor),
+        Consumable.quantity > 0
+    ).all()
+    return [Lot(row.id, row.quantity, None, row.created_at) for row in rows]
+
+
+def _reserve(db: Session, model, lot_id: int, take: float) -> Optional[float]:
+    """库存仍然足够时扣减，返回扣减后的库存；未扣减时返回 None"""
+    row = db.execute(
+        update(model)
+        .where(model.id == lot_id, model.quantity >= take)
+        .values(quantity=model.quantity - take, updated_at=datetime.utcnow())
+        .returning(model.quantity)
+        .execution_options(synchronize_session=False)
+    ).first()
+    return row[0] if row is not None else None
+
+
+def allocate_fefo(db: Session, item_type: str, item_id: int, quantity: float,
+                  reference_id: Optional[int] = None, user_id: Optional[int] = None) -> AllocationResult:
+    """
+    为申请的试剂/耗材按 FEFO 分配并扣减库存（不提交，调用方负责提交或回滚）
+
+    Args:
+        item_type: "reagent" 或 "consumable"
+        item_id: 申请时选择的试剂/耗材ID，用于确定产品
+        quantity: 申请数量
+        reference_id: 记入库存流水的申请ID
+        user_id: 记入库存流水的审批人ID
+
+    Raises:
+        LotNotFound: 申请的试剂/耗材不存在
+        InsufficientStock: 同一产品可用批次的总库存不足
+    """
+    item_type = getattr(item_type, "value", item_type)
+    model = _model_for(item_type)
+    anchor = db.query(model).filter(model.id == item_id).first()
+    if anchor is None:
+        raise LotNotFound(item_id)
+
+    lots = load_candidate_lots(db, item_type, anchor)
+    by_id = {lot.id: lot for lot in lots}
+    retries: Dict[int, int] = {}
+
+    allocations = []
+    movements = []
+    remaining = quantity
+    while remaining > EPSILON:
+        try:
+            plan = plan_allocation(lots, remaining)
+        except InsufficientStock as e:
+            raise InsufficientStock(quantity, quantity - remaining + e.available, anchor.unit)
+
+        for allocation in plan:
+            lot = by_id[allocation.lot_id]
+            quantity_after = _reserve(db, model, lot.id, allocation.quantity)
+            if quantity_after is None:
+                # 批次已被并发扣减：读取最新余量，对剩余数量重新规划
+                retries[lot.id] = retries.get(lot.id, 0) + 1
+                current = db.query(model.quantity).filter(model.id == lot.id).scalar()
+                lot.quantity = current if current and retries[lot.id] <= MAX_LOT_RETRIES else 0.0
+                break
+
+            allocations.append(allocation)
+            movements.append(movement_row(
+                item_type_of(model), lot.id, -allocation.quantity, quantity_after, REASON_APPROVAL, reference_id, user_id
+            ))
+            lot.quantity -= allocation.quantity
+            remaining -= allocation.quantity
+
+    # 条件 UPDATE 绕过了 ORM 事件，显式记录流水并同步低库存标记
+    record_movements(db, movements)
+    refresh_low_stock(db, model, [a.lot_id for a in allocations])
+
+    return AllocationResult(
+        requested=quantity,
+        unit=anchor.unit,
+        remaining_stock=sum(max(lot.quantity, 0.0) for lot in lots),
+        allocations=allocations,
+    )
+
+
+# ---------- 批量分配 ----------
+
+@dataclass
+class AllocationDemand:
+    """批量分配中的一项申请"""
+    key: int  # 调用方用于对应结果的键（如申请ID）
+    item_type: str
+    item_id: int
+    quantity: float
+
+
+def _lock_lots(db: Session, model, lot_ids: Sequence[int]) -> dict:
+    """
+    按ID升序锁定批次并读取最新库存（PostgreSQL 行锁，其他数据库只读取）
+
+    所有批量审批都按同一顺序加锁（先试剂后耗材、各自按ID升序），
+    并发的批量审批之间不会形成循环等待。
+    """
+    quantities = {}
+    ids = sorted(set(lot_ids))
+    lock = db.get_bind().dialect.name == "postgresql"
+    for i in range(0, len(ids), LOCK_CHUNK_SIZE):
+        query = db.query(model.id, model.quantity).filter(model.id.in_(ids[i:i + LOCK_CHUNK_SIZE])).order_by(model.id)
+        if lock:
+            query = query.with_for_update()
+        quantities.update({row.id: row.quantity or 0.0 for row in query.all()})
+    return quantities
+
+
+def allocate_fefo_batch(db: Session, demands: Sequence[AllocationDemand],
+                        user_id: Optional[int] = None) -> Dict[int, object]:
+    """
+    为一批申请按 FEFO 分配并扣减库存（不提交，调用方负责提交或回滚）
+
+    先查出所有涉及产品的候选批次，再按固定顺序一次性锁定并重读库存，
+    按 demands 的顺序在内存中依次分配（同一产品的后续申请使用前面申请
+    分配后的余量）。全部分配完成后每类物品用一条 executemany UPDATE
+    扣减库存，流水和低库存标记同样批量写入。
+
+    Returns:
+        key -> AllocationResult；分配失败的申请为 LotNotFound 或 InsufficientStock
+        异常实例，不影响其他申请
+    """
+    outcomes: Dict[int, object] = {}
+    pending = []  # (demand, model, product_key)
+    lots_by_product: Dict[tuple, List[Lot]] = {}
+    units: Dict[tuple, Optional[str]] = {}
+
+    for item_type in PRODUCT_KEYS:
+        typed = [d for d in demands if getattr(d.item_type, "value", d.item_type) == item_type]
+        if not typed:
+            continue
+        model = _model_for(item_type)
+        key_columns = PRODUCT_KEYS[item_type]
+        anchors = {
+            row.id: row for row in db.query(model.id, *[getattr(model, c) for c in key_columns]).filter(
+                model.id.in_({d.item_id for d in typed})
+            ).all()
+        }
+        for demand in typed:
+            anchor = anchors.get(demand.item_id)
+            if anchor is None:
+                outcomes[demand.key] = LotNotFound(demand.item_id)
+                continue
+            product = (item_type,) + tuple(getattr(anchor, c) for c in key_columns)
+            if product not in lots_by_product:
+                lots_by_product[product] = load_candidate_lots(db, item_type, anchor)
+                units[product] = anchor.unit
+            pending.append((demand, model, product))
+
+    # 固定顺序加锁后用最新库存替换候选批次的余量
+    for item_type in PRODUCT_KEYS:
+        model = _model_for(item_type)
+        lots = [lot for product, product_lots in lots_by_product.items() if product[0] == item_type
+                for lot in product_lots]
+        if not lots:
+            continue
+        current = _lock_lots(db, model, [lot.id for lot in lots])
+        for lot in lots:
+            lot.quantity = current.get(lot.id, 0.0)
+
+    taken: Dict[tuple, float] = {}  # (model, lot_id) -> 扣减总量
+    movements = []
+    for demand, model, product in pending:
+        lots = lots_by_product[product]
+        try:
+            plan = plan_allocation(lots, demand.quantity)
+        except InsufficientStock as e:
+            outcomes[demand.key] = InsufficientStock(demand.quantity, e.available, units[product])
+            continue
+
+        by_id = {lot.id: lot for lot in lots}
+        for allocation in plan:
+            lot = by_id[allocation.lot_id]
+            lot.quantity -= allocation.quantity
+            taken[(model, lot.id)] = taken.get((model, lot.id), 0.0) + allocation.quantity
+            movements.append(movement_row(
+                item_type_of(model), lot.id, -allocation.quantity, lot.quantity, REASON_APPROVAL, demand.key, user_id
+            ))
+        outcomes[demand.key] = AllocationResult(
+            requested=demand.quantity,
+            unit=units[product],
+            remaining_stock=sum(max(lot.quantity, 0.0) for lot in lots),
+            allocations=plan,
+        )
+
+    now = datetime.utcnow()
+    for model in (Reagent, Consumable):
+        rows = [{"lot_id": lot_id, "taken": amount} for (m, lot_id), amount in taken.items() if m is model]
+        if not rows:
+            continue
+        table = model.__table__
+        db.execute(
+            update(table)
+            .where(table.c.id == bindparam("lot_id"))
+            .values(quantity=table.c.quantity - bindparam("taken"), updated_at=now),
+            rows
+        )
+        refresh_low_stock(db, model, [row["lot_id"] for row in rows])
+    record_movements(db, movements)
+
+    return outcomes
@@ -0,0 +1,286 @@
+# backend/low_stock.py
+
+"""
+低库存标记
+
+试剂和耗材的 is_low_stock 由修改库存或阈值的写操作维护：ORM 写入在
+flush 时通过 mapper 事件重算标记，绕过 ORM 的批量写入调用
+refresh_low_stock。标记从 False 变为 True 时记录一次越线事件，事务
+提交后放入 Redis 队列（不可用时放入进程内队列），由后台任务统一发送
+低库存通知；库存回升后再次跌破阈值才会再次提醒。
+"""
+
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, case, event, inspect, not_, or_, update
+from sqlalchemy.orm import Query, Session, object_session
+
+from database import SessionLocal
+from models import Consumable, Reagent
+from redis_cache import redis_cache, invalidate_cache_pattern
+from cache_config import CacheConfig, CacheType
+
+logger = logging.getLogger(__name__)
+
+# 试剂未设置阈值时使用的默认阈值（与 Reagent.min_threshold 默认值一致）
+DEFAULT_REAGENT_THRESHOLD = 10.0
+
+KIND_REAGENT = "reagent"
+KIND_CONSUMABLE = "consumable"
+
+# 越线事件队列
+EVENT_QUEUE_KEY = "events:low_stock"
+
+# Session.info 中暂存本事务越线事件的键
+SESSION_INFO_KEY = "low_stock_crossings"
+
+# 每次从队列取出的事件数
+DRAIN_BATCH_SIZE = 500
+
+UPDATE_CHUNK_SIZE = 900
+
+# Redis 不可用时的进程内队列
+_local_queue: deque = deque()
+
+
+def reagent_is_low(quantity, min_threshold) -> bool:
+    if quantity is None:
+        return False
+    threshold = min_threshold if min_threshold is not None else DEFAULT_REAGENT_THRESHOLD
+    return quantity <= threshold
+
+
+def consumable_is_low(quantity, min_stock) -> bool:
+    if quantity is None or min_stock is None:
+        return False
+    return quantity <= min_stock
+
+
+def _threshold_column(model):
+    return Reagent.min_threshold if model is Reagent else Consumable.min_stock
+
+
+def _kind(model) -> str:
+    return KIND_REAGENT if model is Reagent else KIND_CONSUMABLE
+
+
+def low_stock_condition(model):
+    """与 reagent_is_low / consumable_is_low 等价的 SQL 条件（不会为 NULL）"""
+    if model is Reagent:
+        return and_(
+            Reagent.quantity.isnot(None),
+            Reagent.quantity <= case(
+                (Reagent.min_threshold.isnot(None), Reagent.min_threshold),
+                else_=DEFAULT_REAGENT_THRESHOLD,
+            ),
+        )
+    return and_(
+        Consumable.quantity.isnot(None),
+        Consumable.min_stock.isnot(None),
+        Consumable.quantity <= Consumable.min_stock,
+    )
+
+
+def low_stock_query(db: Session, model) -> Query:
+    """按维护的标记读取低库存行（走部分索引），按库存升序"""
+    return db.query(model).filter(model.is_low_stock == True).order_by(model.quantity)
+
+
+def _crossing(model, item_id: int, name: str, quantity, threshold) -> dict:
+    if threshold is None and model is Reagent:
+        threshold = DEFAULT_REAGENT_THRESHOLD
+    return {"kind": _kind(model), "id": item_id, "name": name, "quantity": quantity, "threshold": threshold}
+
+
+def _record_crossings(session: Optional[Session], crossings: List[dict]):
+    if session is None or not crossings:
+        return
+    session.info.setdefault(SESSION_INFO_KEY, []).extend(crossings)
+
+
+# ---------- ORM 事件：单条写入时维护标记 ----------
+
+def _apply_flag(mapper, connection, target):
+    if isinstance(target, Reagent):
+        low = reagent_is_low(target.quantity, target.min_threshold)
+    else:
+        low = consumable_is_low(target.quantity, target.min_stock)
+    if bool(target.is_low_stock) != low:
+        target.is_low_stock = low
+
+
+def _detect_crossing(mapper, connection, target):
+    # flush 完成前属性历史仍然可用：本次 flush 将标记置为 True 即为越线
+    if target.is_low_stock and inspect(target).attrs.is_low_stock.history.has_changes():
+        model = type(target)
+        threshold = target.min_threshold if model is Reagent else target.min_stock
+        _record_crossings(object_session(target), [
+            _crossing(model, target.id, target.name, target.quantity, threshold)
+        ])
+
+
+for _model in (Reagent, Consumable):
+    event.listen(_model, "before_insert", _apply_flag)
+    event.listen(_model, "before_update", _apply_flag)
+    event.listen(_model, "after_insert", _detect_crossing)
+    event.listen(_model, "after_update", _detect_crossing)
+
+
+@event.listens_for(Session, "after_commit")
+def _enqueue_after_commit(session):
+    crossings = session.info.pop(SESSION_INFO_KEY, None)
+    if crossings:
+        enqueue_crossings(crossings)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop(SESSION_INFO_KEY, None)
+
+
+# ---------- 批量写入 ----------
+
+def refresh_low_stock(db: Session, model, ids: Optional[Iterable[int]] = None) -> int:
+    """
+    按库存和阈值重算标记（用于绕过 ORM 事件的批量写入，调用方提交）
+
+    Args:
+        model: Reagent 或 Consumable
+        ids: 需要重算的ID；为空时对账整张表
+
+    Returns:
+        标记发生变化的行数
+    """
+    condition = low_stock_condition(model)
+    stale = or_(
+        and_(model.is_low_stock == False, condition),
+        and_(model.is_low_stock == True, not_(condition)),
+    )
+    new_flag = case((condition, True), else_=False)
+    threshold = _threshold_column(model)
+
+    if ids is None:
+        id_chunks = [None]
+    else:
+        ids = list(set(ids))
+        id_chunks = [ids[i:i + UPDATE_CHUNK_SIZE] for i in range(0, len(ids), UPDATE_CHUNK_SIZE)]
+
+    changed = 0
+    crossings = []
+    for chunk in id_chunks:
+        scope = [stale] if chunk is None else [stale, model.id.in_(chunk)]
+        crossed = db.query(model.id, model.name, model.quantity, threshold).filter(
+            model.is_low_stock == False, condition, *scope
+        ).all()
+        crossings.extend(_crossing(model, *row) for row in crossed)
+        result = db.execute(
+            update(model).where(*scope).values(is_low_stock=new_flag).execution_options(synchronize_session=False)
+        )
+        changed += result.rowcount or 0
+
+    _record_crossings(db, crossings)
+    return changed
+
+
+# ---------- 越线事件队列 ----------
+
+def enqueue_crossings(crossings: List[dict]):
+    if redis_cache.is_connected:
+        try:
+            redis_cache.redis_client.rpush(EVENT_QUEUE_KEY, *[json.dumps(c) for c in crossings])
+            return
+        except Exception as e:
+            logger.warning(f"低库存事件写入 Redis 失败，改用进程内队列: {e}")
+    _local_queue.extend(crossings)
+
+
+def drain_crossings(limit: int = DRAIN_BATCH_SIZE) -> List[dict]:
+    """取出一批越线事件"""
+    events = []
+    while _local_queue and len(events) < limit:
+        events.append(_local_queue.popleft())
+
+    if redis_cache.is_connected and len(events) < limit:
+        try:
+            pipe = redis_cache.redis_client.pipeline(transaction=True)
+            pipe.lrange(EVENT_QUEUE_KEY, 0, limit - len(events) - 1)
+            pipe.ltrim(EVENT_QUEUE_KEY, limit - len(events), -1)
+            raw, _ = pipe.execute()
+            events.extend(json.loads(item) for item in raw)
+        except Exception as e:
+            logger.warning(f"读取低库存事件失败: {e}")
+    return events
+
+
+def _pending_alerts(db: Session, events: List[dict]) -> List[dict]:
+    """同一物品只保留最后一条事件，并丢弃已经回到阈值以上的物品"""
+    latest: Dict[Tuple[str, int], dict] = {}
+    for item in events:
+        latest[(item["kind"], item["id"])] = item
+
+    alerts = []
+    for model in (Reagent, Consumable):
+        kind = _kind(model)
+        ids = [item_id for k, item_id in latest if k == kind]
+        for i in range(0, len(ids), UPDATE_CHUNK_SIZE):
+            rows = db.query(model.id, model.name, model.quantity, _threshold_column(model)).filter(
+                model.id.in_(ids[i:i + UPDATE_CHUNK_SIZE]),
+                model.is_low_stock == True
+            ).all()
+            alerts.extend(_crossing(model, *row) for row in rows)
+    return alerts
+
+
+def _reconcile() -> dict:
+    """对账两张表的标记，修正绕过维护路径的写入"""
+    db = SessionLocal()
+    try:
+        summary = {
+            "reagents_fixed": refresh_low_stock(db, Reagent),
+            "consumables_fixed": refresh_low_stock(db, Consumable),
+        }
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    if summary["reagents_fixed"]:
+        for pattern in CacheConfig.get_invalidation_patterns(CacheType.REAGENTS):
+            invalidate_cache_pattern(pattern)
+    if summary["consumables_fixed"]:
+        for pattern in CacheConfig.get_invalidation_patterns(CacheType.CONSUMABLES):
+            invalidate_cache_pattern(pattern)
+    return summary
+
+
+async def run_low_stock_job() -> dict:
+    """调度器入口：对账标记后，为队列中的越线事件发送低库存通知"""
+    from notification_routes import NotificationTriggers
+
+    summary = await asyncio.to_thread(_reconcile)
+    events = drain_crossings()
+    summary["events"] = len(events)
+    summary["notified"] = 0
+    if events:
+        db = SessionLocal()
+        try:
+            for alert in _pending_alerts(db, events):
+                if alert["kind"] == KIND_REAGENT:
+                    await NotificationTriggers.trigger_reagent_low_stock(
+                        db, alert["name"], alert["quantity"], alert["threshold"]
+                    )
+                else:
+                    await NotificationTriggers.trigger_consumable_low_stock(
+                        db, alert["name"], alert["quantity"], alert["threshold"]
+                    )
+                summary["notified"] += 1
+        finally:
+            db.close()
+    logger.info(f"低库存检查完成: {summary}")
+    return summary
@@ -0,0 +1,253 @@
+# backend/maintenance_scheduler.py
+
+"""
+设备维护计划后台任务
+
+周期性地根据最近一次已完成的维护记录和维护间隔，批量重算设备的
+下次维护日期；生成待维护设备快照写入缓存，供维护看板直接读取；
+对新进入提醒窗口的设备批量发送 equipment_maintenance 通知。
+"""
+
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Device, DeviceMaintenance, User
+from redis_cache import redis_cache, invalidate_cache_pattern
+from cache_config import CacheConfig, CacheType
+from notification_service import NotificationService, NotificationType, NotificationPriority
+
+logger = logging.getLogger(__name__)
+
+# 待维护快照的缓存键（不在设备缓存失效模式内，由任务和写操作显式维护）
+DUE_SNAPSHOT_KEY = "stats:maintenance:due_list"
+
+# 快照覆盖的天数范围；请求的 days_ahead 超出时回退为实时查询
+DUE_HORIZON_DAYS = 30
+
+# 提前多少天发送维护提醒
+NOTIFY_DAYS_AHEAD = 7
+
+# 快照过期时间（秒），调度停止后快照自然失效
+SNAPSHOT_TTL = 3600
+
+# 批量更新每批的行数
+UPDATE_CHUNK_SIZE = 1000
+
+# Redis 不可用时记录已提醒过的 (设备, 维护日期)，避免每轮重复提醒
+_notified_fallback: Dict[str, str] = {}
+
+
+def recompute_next_maintenance(db: Session) -> int:
+    """
+    根据最近一次已完成维护和维护间隔批量重算 last/next_maintenance
+
+    Returns:
+        更新的设备数
+    """
+    latest = db.query(
+        DeviceMaintenance.device_id.label("device_id"),
+        func.max(DeviceMaintenance.maintenance_date).label("latest"),
+    ).filter(
+        DeviceMaintenance.status == "completed"
+    ).group_by(DeviceMaintenance.device_id).subquery()
+
+    rows = db.query(
+        Device.id,
+        Device.maintenance_interval,
+        Device.purchase_date,
+        Device.last_maintenance,
+        Device.next_maintenance,
+        latest.c.latest,
+    ).outerjoin(latest, latest.c.device_id == Device.id).all()
+
+    changes = []
+    for row in rows:
+        known = [d for d in (row.latest, row.last_maintenance) if d]
+        last = max(known) if known else None
+        next_date = row.next_maintenance
+        if row.maintenance_interval:
+            if last:
+                next_date = last + timedelta(days=row.maintenance_interval)
+            elif next_date is None and row.purchase_date:
+                next_date = row.purchase_date + timedelta(days=row.maintenance_interval)
+
+        if last != row.last_maintenance or next_date != row.next_maintenance:
+            changes.append({
+                "id": row.id,
+                "last_maintenance": last,
+                "next_maintenance": next_date,
+            })
+
+    # 按主键批量 UPDATE（executemany），分批提交
+    for i in range(0, len(changes), UPDATE_CHUNK_SIZE):
+        db.execute(update(Device), changes[i:i + UPDATE_CHUNK_SIZE])
+        db.commit()
+
+    if changes:
+        for pattern in CacheConfig.get_invalidation_patterns(CacheType.DEVICES):
+            invalidate_cache_pattern(pattern)
+
+    return len(changes)
+
+
+def build_due_list(db: Session, horizon_days: int = DUE_HORIZON_DAYS,
+                   device_ids: Optional[Iterable[int]] = None) -> List[dict]:
+    """查询 horizon_days 天内需要维护的设备（不含正在维护的设备）"""
+    target_date = date.today() + timedelta(days=horizon_days)
+    query = db.query(
+        Device.id,
+        Device.name,
+        Device.status,
+        Device.location,
+        Device.next_maintenance,
+        Device.responsible_person,
+    ).filter(
+        Device.next_maintenance <= target_date,
+        Device.status != 'maintenance'
+    )
+    if device_ids is not None:
+        query = query.filter(Device.id.in_(list(device_ids)))
+
+    return [
+        {
+            "id": row.id,
+            "name": row.name,
+            "status": row.status,
+            "location": row.location,
+            "next_maintenance": row.next_maintenance.isoformat(),
+            "responsible_person": row.responsible_person,
+        }
+        for row in query.order_by(Device.next_maintenance).all()
+    ]
+
+
+def get_due_snapshot() -> Optional[dict]:
+    """读取待维护快照"""
+    return redis_cache.get(DUE_SNAPSHOT_KEY)
+
+
+def select_due(snapshot: dict, days_ahead: int, today: Optional[date] = None) -> List[dict]:
+    """从快照中筛选 days_ahead 天内到期的设备，并按当天重新计算剩余天数"""
+    today = today or date.today()
+    target = today + timedelta(days=days_ahead)
+    result = []
+    for item in snapshot.get("items", []):
+        next_date = date.fromisoformat(item["next_maintenance"])
+        if next_date <= target:
+            result.append({**item, "days_until_maintenance": (next_date - today).days})
+    return result
+
+
+def sync_due_snapshot(db: Session, device_ids: Iterable[int]):
+    """设备或维护记录变更后，按需修补快照中相关设备的条目"""
+    snapshot = get_due_snapshot()
+    if not snapshot:
+        return
+    ids = set(device_ids)
+    items = [item for item in snapshot.get("items", []) if item["id"] not in ids]
+    items.extend(build_due_list(db, snapshot.get("horizon_days", DUE_HORIZON_DAYS), ids))
+    items.sort(key=lambda item: item["next_maintenance"])
+    snapshot["items"] = items
+    redis_cache.set(DUE_SNAPSHOT_KEY, snapshot, SNAPSHOT_TTL)
+
+
+def _build_notifications(db: Session, due_items: List[dict], notified: Dict[str, str],
+                         today: date) -> Tuple[List[dict], Dict[str, str]]:
+    """为新进入提醒窗口的设备生成通知（发送给所有启用的管理员）"""
+    notify_before = today + timedelta(days=NOTIFY_DAYS_AHEAD)
+    current = {}
+    fresh = []
+    for item in due_items:
+        if date.fromisoformat(item["next_maintenance"]) > notify_before:
+            continue
+        key = str(item["id"])
+        current[key] = item["next_maintenance"]
+        # 同一设备同一维护日期只提醒一次
+        if notified.get(key) != item["next_maintenance"]:
+            fresh.append(item)
+
+    if not fresh:
+        return [], current
+
+    admin_ids = [row.id for row in db.query(User.id).filter(
+        User.role == "admin",
+        User.is_active == True
+    ).all()]
+
+    notifications = []
+    for item in fresh:
+        overdue = item["next_maintenance"] < today.isoformat()
+        for user_id in admin_ids:
+            notifications.append({
+                "user_id": user_id,
+                "title": "设备维护提醒",
+                "message": f"设备 {item['name']} 需要进行维护，预定维护日期：{item['next_maintenance']}",
+                "notification_type": NotificationType.EQUIPMENT_MAINTENANCE,
+                "priority": NotificationPriority.HIGH if overdue else NotificationPriority.NORMAL,
+                "data": {
+                    "device_id": item["id"],
+                    "device_name": item["name"],
+                    "maintenance_date": item["next_maintenance"],
+                },
+            })
+    return notifications, current
+
+
+def refresh_maintenance_schedule() -> Tuple[dict, List[Tuple[int, dict]]]:
+    """
+    重算维护日期、刷新快照并批量创建提醒
+
+    Returns:
+        (运行摘要, 待实时推送的 (user_id, 通知数据) 列表)
+    """
+    global _notified_fallback
+    db = SessionLocal()
+    try:
+        today = date.today()
+        updated = recompute_next_maintenance(db)
+        items = build_due_list(db, DUE_HORIZON_DAYS)
+
+        previous = get_due_snapshot()
+        notified = previous.get("notified", {}) if previous else _notified_fallback
+        notifications, current = _build_notifications(db, items, notified, today)
+        pushes = NotificationService.create_notifications_bulk(db, notifications)
+
+        snapshot = {
+            "generated_at": datetime.utcnow().isoformat(),
+            "horizon_days": DUE_HORIZON_DAYS,
+            "items": items,
+            "notified": current,
+        }
+        redis_cache.set(DUE_SNAPSHOT_KEY, snapshot, SNAPSHOT_TTL)
+        _notified_fallback = current
+
+        summary = {
+            "devices_updated": updated,
+            "devices_due": len(items),
+            "notifications_created": len(pushes),
+        }
+        logger.info(f"维护计划刷新完成: {summary}")
+        return summary, pushes
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def run_maintenance_job() -> dict:
+    """调度器入口：数据库工作放到线程池，完成后推送在线用户"""
+    summary, pushes = await asyncio.to_thread(refresh_maintenance_schedule)
+    if pushes:
+        db = SessionLocal()
+        try:
+            await NotificationService.push_notifications(db, pushes)
+        finally:
+            db.close()
+    return summary
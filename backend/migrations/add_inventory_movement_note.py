@@ -0,0 +1,73 @@
+"""
+数据库迁移脚本：为库存流水添加备注列
+描述：新增 inventory_movements.note，扫码出入库等批量接口提交的行备注
+      随流水一起保存
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+import logging
+
+# 数据库配置
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./lab_management.db")
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _column_exists(connection, table: str, column: str) -> bool:
+    if connection.dialect.name == "sqlite":
+        rows = connection.execute(text(f"PRAGMA table_info({table})")).fetchall()
+        return any(row[1] == column for row in rows)
+    result = connection.execute(text(
+        "SELECT 1 FROM information_schema.columns WHERE table_name = :table AND column_name = :column"
+    ), {"table": table, "column": column})
+    return result.first() is not None
+
+def upgrade():
+    """执行数据库升级"""
+    engine = create_engine(DATABASE_URL)
+
+    try:
+        with engine.connect() as connection:
+            if not _column_exists(connection, "inventory_movements", "note"):
+                connection.execute(text("ALTER TABLE inventory_movements ADD COLUMN note TEXT;"))
+                logger.info("✅ inventory_movements.note 列添加成功")
+
+            connection.commit()
+
+    except Exception as e:
+        logger.error(f"❌ 数据库迁移失败: {e}")
+        raise
+
+def downgrade():
+    """执行数据库降级（回滚）"""
+    engine = create_engine(DATABASE_URL)
+
+    try:
+        with engine.connect() as connection:
+            if _column_exists(connection, "inventory_movements", "note"):
+                # SQLite 3.35 及以上版本支持 DROP COLUMN
+                connection.execute(text("ALTER TABLE inventory_movements DROP COLUMN note;"))
+                logger.info("✅ inventory_movements.note 列删除成功")
+
+            connection.commit()
+
+    except Exception as e:
+        logger.error(f"❌ 数据库回滚失败: {e}")
+        raise
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "downgrade":
+        print("执行数据库回滚...")
+        downgrade()
+        print("回滚完成")
+    else:
+        print("执行数据库迁移...")
+        upgrade()
+        print("迁移完成")
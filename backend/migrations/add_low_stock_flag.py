@@ -0,0 +1,113 @@
+"""
+数据库迁移脚本：为试剂和耗材添加低库存标记
+描述：新增 is_low_stock 列并按当前库存回填，创建只收录低库存行的部分索引，
+      低库存列表不再需要逐行比较库存与阈值
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+import logging
+
+# 数据库配置
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./lab_management.db")
+
+# 试剂未设置阈值时使用的默认阈值（与 Reagent.min_threshold 默认值一致）
+DEFAULT_REAGENT_THRESHOLD = 10.0
+
+# (表名, 索引名, 低库存条件)
+TABLES = [
+    (
+        "reagents",
+        "ix_reagents_low_stock",
+        f"quantity IS NOT NULL AND quantity <= COALESCE(min_threshold, {DEFAULT_REAGENT_THRESHOLD})",
+    ),
+    (
+        "consumables",
+        "ix_consumables_low_stock",
+        "quantity IS NOT NULL AND min_stock IS NOT NULL AND quantity <= min_stock",
+    ),
+]
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _column_exists(connection, table: str, column: str) -> bool:
+    if connection.dialect.name == "sqlite":
+        rows = connection.execute(text(f"PRAGMA table_info({table})")).fetchall()
+        return any(row[1] == column for row in rows)
+    result = connection.execute(text(
+        "SELECT 1 FROM information_schema.columns WHERE table_name = :table AND column_name = :column"
+    ), {"table": table, "column": column})
+    return result.first() is not None
+
+def upgrade():
+    """执行数据库升级"""
+    engine = create_engine(DATABASE_URL)
+
+    try:
+        with engine.connect() as connection:
+            is_sqlite = connection.dialect.name == "sqlite"
+            false_literal = "0" if is_sqlite else "false"
+            true_literal = "1" if is_sqlite else "true"
+
+            for table, index_name, low_condition in TABLES:
+                if not _column_exists(connection, table, "is_low_stock"):
+                    connection.execute(text(
+                        f"ALTER TABLE {table} ADD COLUMN is_low_stock BOOLEAN NOT NULL DEFAULT {false_literal};"
+                    ))
+
+                # 按当前库存回填标记
+                connection.execute(text(f"""
+                UPDATE {table}
+                SET is_low_stock = CASE WHEN {low_condition} THEN {true_literal} ELSE {false_literal} END;
+                """))
+
+                connection.execute(text(f"""
+                CREATE INDEX IF NOT EXISTS {index_name}
+                ON {table} (quantity)
+                WHERE is_low_stock = {true_literal};
+                """))
+
+                logger.info(f"✅ {table} 低库存标记和部分索引创建成功")
+
+            connection.commit()
+
+    except Exception as e:
+        logger.error(f"❌ 数据库迁移失败: {e}")
+        raise
+
+def downgrade():
+    """执行数据库降级（回滚）"""
+    engine = create_engine(DATABASE_URL)
+
+    try:
+        with engine.connect() as connection:
+            for table, index_name, _ in TABLES:
+                connection.execute(text(f"DROP INDEX IF EXISTS {index_name};"))
+                if _column_exists(connection, table, "is_low_stock"):
+                    # SQLite 3.35 及以上版本支持 DROP COLUMN
+                    connection.execute(text(f"ALTER TABLE {table} DROP COLUMN is_low_stock;"))
+
+                logger.info(f"✅ {table} 低库存标记删除成功")
+
+            connection.commit()
+
+    except Exception as e:
+        logger.error(f"❌ 数据库回滚失败: {e}")
+        raise
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "downgrade":
+        print("执行数据库回滚...")
+        downgrade()
+        print("回滚完成")
+    else:
+        print("执行数据库迁移...")
+        upgrade()
+        print("迁移完成")
@@ -0,0 +1,71 @@
+"""
+数据库迁移脚本：为申请表添加审批队列索引
+描述：按 (status, id) 和 (requester_id, id) 建立复合索引，审批队列和历史的
+      游标分页只需沿索引读取一页，按状态计数无需扫描整张表；
+      (updated_at, id) 索引用于审批队列增量同步
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+import logging
+
+# 数据库配置
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./lab_management.db")
+
+# (索引名, 列)
+INDEXES = [
+    ("ix_requests_status_id", "status, id"),
+    ("ix_requests_requester_id", "requester_id, id"),
+    ("ix_requests_updated_at_id", "updated_at, id"),
+]
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def upgrade():
+    """执行数据库升级"""
+    engine = create_engine(DATABASE_URL)
+
+    try:
+        with engine.connect() as connection:
+            for index_name, columns in INDEXES:
+                connection.execute(text(f"CREATE INDEX IF NOT EXISTS {index_name} ON requests ({columns});"))
+                logger.info(f"✅ 索引 {index_name} 创建成功")
+
+            connection.commit()
+
+    except Exception as e:
+        logger.error(f"❌ 数据库迁移失败: {e}")
+        raise
+
+def downgrade():
+    """执行数据库降级（回滚）"""
+    engine = create_engine(DATABASE_URL)
+
+    try:
+        with engine.connect() as connection:
+            for index_name, _ in INDEXES:
+                connection.execute(text(f"DROP INDEX IF EXISTS {index_name};"))
+                logger.info(f"✅ 索引 {index_name} 删除成功")
+
+            connection.commit()
+
+    except Exception as e:
+        logger.error(f"❌ 数据库回滚失败: {e}")
+        raise
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "downgrade":
+        print("执行数据库回滚...")
+        downgrade()
+        print("回滚完成")
+    else:
+        print("执行数据库迁移...")
+        upgrade()
+        print("迁移完成")
@@ -0,0 +1,88 @@
+"""
+数据库迁移脚本：为设备预约添加排他约束（仅 PostgreSQL）
+描述：同一设备处于 pending/approved 状态的预约时间段不得重叠，
+      由数据库保证不会出现重复预约；SQLite 下由应用层设备锁保证，跳过本迁移
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+import logging
+
+# 数据库配置
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./lab_management.db")
+
+CONSTRAINT_NAME = "excl_device_reservations_no_overlap"
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _is_postgresql(engine) -> bool:
+    return engine.dialect.name == "postgresql"
+
+def upgrade():
+    """执行数据库升级"""
+    engine = create_engine(DATABASE_URL)
+
+    if not _is_postgresql(engine):
+        logger.info(f"当前数据库为 {engine.dialect.name}，排他约束仅适用于 PostgreSQL，跳过")
+        return
+
+    try:
+        with engine.connect() as connection:
+            # btree_gist 扩展使整数列可以参与 GiST 排他约束
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gist;"))
+
+            add_constraint_sql = f"""
+            ALTER TABLE device_reservations
+            ADD CONSTRAINT {CONSTRAINT_NAME}
+            EXCLUDE USING gist (
+                device_id WITH =,
+                tsrange(start_time, end_time, '[)') WITH &&
+            )
+            WHERE (status IN ('pending', 'approved'));
+            """
+            connection.execute(text(add_constraint_sql))
+            connection.commit()
+
+            logger.info("✅ 设备预约排他约束创建成功")
+
+    except Exception as e:
+        logger.error(f"❌ 数据库迁移失败（如已有重叠预约，请先处理冲突数据）: {e}")
+        raise
+
+def downgrade():
+    """执行数据库降级（回滚）"""
+    engine = create_engine(DATABASE_URL)
+
+    if not _is_postgresql(engine):
+        logger.info(f"当前数据库为 {engine.dialect.name}，无需回滚")
+        return
+
+    try:
+        with engine.connect() as connection:
+            connection.execute(text(
+                f"ALTER TABLE device_reservations DROP CONSTRAINT IF EXISTS {CONSTRAINT_NAME};"
+            ))
+            connection.commit()
+
+            logger.info("✅ 设备预约排他约束删除成功")
+
+    except Exception as e:
+        logger.error(f"❌ 数据库回滚失败: {e}")
+        raise
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "downgrade":
+        print("执行数据库回滚...")
+        downgrade()
+        print("回滚完成")
+    else:
+        print("执行数据库迁移...")
+        upgrade()
+        print("迁移完成")
@@ -0,0 +1,69 @@
+"""
+数据库迁移脚本：为使用记录添加时间索引
+描述：按 used_at 和 created_at 建立索引，使用统计和导出按使用时间过滤、
+      领用每日汇总按创建时间增量扫描时不再扫描整张表
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+import logging
+
+# 数据库配置
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./lab_management.db")
+
+# (索引名, 列)
+INDEXES = [
+    ("ix_usage_records_used_at", "used_at"),
+    ("ix_usage_records_created_at", "created_at"),
+]
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def upgrade():
+    """执行数据库升级"""
+    engine = create_engine(DATABASE_URL)
+
+    try:
+        with engine.connect() as connection:
+            for index_name, columns in INDEXES:
+                connection.execute(text(f"CREATE INDEX IF NOT EXISTS {index_name} ON usage_records ({columns});"))
+                logger.info(f"✅ 索引 {index_name} 创建成功")
+
+            connection.commit()
+
+    except Exception as e:
+        logger.error(f"❌ 数据库迁移失败: {e}")
+        raise
+
+def downgrade():
+    """执行数据库降级（回滚）"""
+    engine = create_engine(DATABASE_URL)
+
+    try:
+        with engine.connect() as connection:
+            for index_name, _ in INDEXES:
+                connection.execute(text(f"DROP INDEX IF EXISTS {index_name};"))
+                logger.info(f"✅ 索引 {index_name} 删除成功")
+
+            connection.commit()
+
+    except Exception as e:
+        logger.error(f"❌ 数据库回滚失败: {e}")
+        raise
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "downgrade":
+        print("执行数据库回滚...")
+        downgrade()
+        print("回滚完成")
+    else:
+        print("执行数据库迁移...")
+        upgrade()
+        print("迁移完成")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Date, ForeignKey, Boolean, Table, Text
+from sqlalchemy import Column, Integer, String, Float, DateTime, Date, ForeignKey, Boolean, Table, Text, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from backend.database import Base
@@ -79,6 +79,7 @@ class Device(Base):
     # 关系
     maintenance_records = relationship("DeviceMaintenance", back_populates="device")
     reservations = relationship("DeviceReservation", back_populates="device")
+    borrows = relationship("DeviceBorrow", back_populates="device")
 
 # 试剂表
 class Reagent(Base):
@@ -103,9 +104,16 @@ class Reagent(Base):
     safety_notes = Column(String)  # 安全注意事项
     price = Column(Float)  # 价格
     min_threshold = Column(Float, default=10.0)  # 最小库存阈值
+    is_low_stock = Column(Boolean, default=False, nullable=False)  # 库存是否低于阈值（由写操作维护）
     created_at = Column(DateTime, default=lambda: datetime.utcnow())
     updated_at = Column(DateTime, default=lambda: datetime.utcnow(), onupdate=lambda: datetime.utcnow())
 
+    # 部分索引：只收录低库存行，低库存列表按库存升序读取
+    __table_args__ = (
+        Index("ix_reagents_low_stock", quantity,
+              sqlite_where=is_low_stock == True, postgresql_where=is_low_stock == True),
+    )
+
 # 耗材表
 class Consumable(Base):
     __tablename__ = "consumables"
@@ -119,12 +127,18 @@ class Consumable(Base):
     unit = Column(String, default="个")  # 单位：个, 盒, etc.
     location = Column(String)  # 存放位置
     min_stock = Column(Integer, default=10)  # 最小库存
+    is_low_stock = Column(Boolean, default=False, nullable=False)  # 库存是否低于最小库存（由写操作维护）
     price = Column(Float)  # 单价
     supplier = Column(String)  # 供应商
     notes = Column(String)  # 备注
     created_at = Column(DateTime, default=lambda: datetime.utcnow())
     updated_at = Column(DateTime, default=lambda: datetime.utcnow(), onupdate=lambda: datetime.utcnow())
 
+    __table_args__ = (
+        Index("ix_consumables_low_stock", quantity,
+              sqlite_where=is_low_stock == True, postgresql_where=is_low_stock == True),
+    )
+
 # 实验记录表
 class ExperimentRecord(Base):
     __tablename__ = "experiment_records"
@@ -227,6 +241,14 @@ class Request(Base):
     requester = relationship("User", foreign_keys=[requester_id], back_populates="requests")
     approver = relationship("User", foreign_keys=[approved_by_id])
 
+    __table_args__ = (
+        # 审批队列和历史按状态 + ID 游标分页，按状态计数也只需扫描该索引
+        Index("ix_requests_status_id", "status", "id"),
+        Index("ix_requests_requester_id", "requester_id", "id"),
+        # 审批队列增量同步按 (更新时间, ID) 游标读取
+        Index("ix_requests_updated_at_id", "updated_at", "id"),
+    )
+
 # 使用记录表
 class UsageRecord(Base):
     __tablename__ = "usage_records"
@@ -250,6 +272,12 @@ class UsageRecord(Base):
     user = relationship("User", foreign_keys=[user_id])
     approved_by = relationship("User", foreign_keys=[approved_by_id])
 
+    __table_args__ = (
+        # 按使用时间过滤/导出，以及每日汇总按创建时间增量扫描
+        Index("ix_usage_records_used_at", "used_at"),
+        Index("ix_usage_records_created_at", "created_at"),
+    )
+
 # 更新Request模型，添加usage_record关系
 Request.usage_record = relationship("UsageRecord", back_populates="request", uselist=False)
 
@@ -270,7 +298,7 @@ class DeviceBorrow(Base):
     updated_at = Column(DateTime, default=lambda: datetime.utcnow(), onupdate=lambda: datetime.utcnow())
     
     # 关系
-    device = relationship("Device")
+    device = relationship("Device", back_populates="borrows")
     user = relationship("User")
 
 # WebSocket连接管理表
@@ -284,4 +312,130 @@ class WebSocketConnection(Base):
     created_at = Column(DateTime, default=lambda: datetime.utcnow())
     
     # 关系
-    user = relationship("User")
\ No newline at end of file
+    user = relationship("User")
+
+# 设备每日使用汇总表（由后台任务从预约、借用、维护记录增量汇总）
+class DeviceUsageDaily(Base):
+    __tablename__ = "device_usage_daily"
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), nullable=False)
+    day = Column(Date, nullable=False)  # 统计日期
+    reserved_hours = Column(Float, default=0.0)  # 有效预约时长（小时）
+    completed_hours = Column(Float, default=0.0)  # 已完成预约时长（小时）
+    borrow_hours = Column(Float, default=0.0)  # 借用时长（小时）
+    reservation_count = Column(Integer, default=0)  # 当天开始的预约数
+    completed_count = Column(Integer, default=0)  # 当天开始且已完成的预约数
+    maintenance_count = Column(Integer, default=0)  # 维护次数
+    updated_at = Column(DateTime, default=lambda: datetime.utcnow(), onupdate=lambda: datetime.utcnow())
+
+    __table_args__ = (
+        UniqueConstraint("device_id", "day", name="uq_device_usage_daily_device_day"),
+        Index("ix_device_usage_daily_day", "day"),
+    )
+
+# 领用每日汇总（按 日期 × 使用者 × 物品，后台任务按水位增量维护）
+class UsageDailyRollup(Base):
+    __tablename__ = "usage_daily_rollup"
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False)  # 使用日期
+    user_id = Column(Integer, nullable=False)  # 使用者ID
+    item_type = Column(String, nullable=False)  # 'reagent' 或 'consumable'
+    item_id = Column(Integer, nullable=False)
+    item_name = Column(String)  # 物品名称（取当天任一记录）
+    unit = Column(String)
+    record_count = Column(Integer, nullable=False, default=0)  # 使用记录数
+    quantity_total = Column(Float, nullable=False, default=0.0)  # 使用数量合计
+    updated_at = Column(DateTime, default=lambda: datetime.utcnow(), onupdate=lambda: datetime.utcnow())
+
+    __table_args__ = (
+        UniqueConstraint("day", "user_id", "item_type", "item_id", name="uq_usage_daily_rollup_key"),
+        Index("ix_usage_daily_rollup_user_day", "user_id", "day"),
+    )
+
+# 汇总任务水位表（记录各汇总任务已处理到的时间点）
+class RollupState(Base):
+    __tablename__ = "rollup_state"
+    name = Column(String, primary_key=True)  # 汇总任务名称
+    watermark = Column(DateTime)  # 已处理的源数据更新时间
+    updated_at = Column(DateTime, default=lambda: datetime.utcnow(), onupdate=lambda: datetime.utcnow())
+
+# 试剂过期时间线（按天分桶的过期索引，随试剂写入同步，每日滚动更新分桶）
+class ReagentExpiryTimeline(Base):
+    __tablename__ = "reagent_expiry_timeline"
+    reagent_id = Column(Integer, primary_key=True)  # 试剂ID（索引表，不设外键，试剂删除时同步清理）
+    expiry_day = Column(Date, nullable=False, index=True)  # 过期日期
+    bucket = Column(String, nullable=False, index=True)  # 分桶：expired, 7d, 30d, 90d, later
+    as_of = Column(Date, nullable=False)  # 分桶计算所基于的日期
+    updated_at = Column(DateTime, default=lambda: datetime.utcnow(), onupdate=lambda: datetime.utcnow())
+
+# 库存流水（只追加，记录每次库存变动；试剂/耗材删除后保留历史，不设外键）
+class InventoryMovement(Base):
+    __tablename__ = "inventory_movements"
+    id = Column(Integer, primary_key=True, index=True)
+    item_type = Column(String, nullable=False)  # 'reagent' 或 'consumable'
+    item_id = Column(Integer, nullable=False)
+    delta = Column(Float, nullable=False)  # 库存变化量，入库为正、出库为负
+    quantity_after = Column(Float)  # 变动后库存（未知时为空）
+    reason = Column(String, nullable=False)  # create, edit, receive, use, approval, batch_update, delete, reconcile
+    reference_id = Column(Integer)  # 关联单据ID（如领用申请ID）
+    user_id = Column(Integer)  # 操作人ID
+    note = Column(Text)  # 备注（如扫码出入库时填写的说明）
+    created_at = Column(DateTime, default=lambda: datetime.utcnow(), nullable=False)
+
+    __table_args__ = (
+        # 快照之后的增量按 ID 范围扫描
+        Index("ix_inventory_movements_item_id_seq", "item_type", "item_id", "id"),
+        Index("ix_inventory_movements_created_at", "created_at"),
+    )
+
+# 库存快照（定期按物品记录库存余额和累计消耗，时点查询从最近的快照开始回放）
+class InventorySnapshot(Base):
+    __tablename__ = "inventory_snapshots"
+    id = Column(Integer, primary_key=True, index=True)
+    item_type = Column(String, nullable=False)
+    item_id = Column(Integer, nullable=False)
+    taken_at = Column(DateTime, nullable=False)  # 快照时间
+    last_movement_id = Column(Integer, nullable=False, index=True)  # 快照已包含的最后一条流水ID
+    quantity = Column(Float, nullable=False)  # 快照时的库存余额
+    consumed_total = Column(Float, nullable=False, default=0.0)  # 截至快照的累计消耗量
+
+    __table_args__ = (
+        Index("ix_inventory_snapshots_item_time", "item_type", "item_id", "taken_at"),
+    )
+
+# 库存消耗预测（定期整表重算，仪表盘直接读取）
+class StockForecast(Base):
+    __tablename__ = "stock_forecasts"
+    item_type = Column(String, primary_key=True)  # 'reagent' 或 'consumable'
+    item_id = Column(Integer, primary_key=True)
+    item_name = Column(String, nullable=False)
+    unit = Column(String)
+    quantity = Column(Float, nullable=False)  # 预测时的库存
+    burn_rate_ma = Column(Float, nullable=False, default=0.0)  # 滑动平均日消耗
+    burn_rate_ewma = Column(Float, nullable=False, default=0.0)  # 指数平滑日消耗
+    burn_rate = Column(Float, nullable=False, default=0.0)  # 预测采用的日消耗（两者取大）
+    days_to_stockout = Column(Float)  # 预计耗尽天数（无消耗时为空）
+    stockout_date = Column(Date, index=True)  # 预计耗尽日期
+    reorder_point = Column(Float, nullable=False, default=0.0)  # 再订货点
+    suggested_reorder = Column(Float, nullable=False, default=0.0)  # 建议补货量（未到再订货点时为 0）
+    computed_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_stock_forecasts_days_to_stockout", "days_to_stockout"),
+    )
+
+# 归档分区目录（每个源表每月一张归档表，历史查询据此选择需要合并的分区）
+class ArchivePartition(Base):
+    __tablename__ = "archive_partitions"
+    table_name = Column(String, primary_key=True)  # 归档表名，如 usage_records_archive_202401
+    source_table = Column(String, nullable=False)  # 源表名
+    month = Column(Date, nullable=False)  # 分区月份（当月第一天）
+    row_count = Column(Integer, nullable=False, default=0)  # 已归档行数
+    min_time = Column(DateTime)  # 分区内最早的时间列取值
+    max_time = Column(DateTime)  # 分区内最晚的时间列取值
+    created_at = Column(DateTime, default=lambda: datetime.utcnow())
+    updated_at = Column(DateTime, default=lambda: datetime.utcnow(), onupdate=lambda: datetime.utcnow())
+
+    __table_args__ = (
+        UniqueConstraint("source_table", "month", name="uq_archive_partitions_source_month"),
+    )
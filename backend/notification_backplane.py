@@ -0,0 +1,285 @@
+# backend/notification_backplane.py
+
+"""
+WebSocket 推送的跨 worker 分发
+
+gunicorn 多 worker 部署时，每个 worker 只持有连接到自己的 WebSocket。
+推送消息不再直接写本进程的连接，而是封装成信封发布到背板：
+
+- RedisBackplane：发布到 Redis pub/sub 频道，每个 worker（包括发布者
+  自己）订阅后只投递给本进程内的连接，任意 worker 数量下都能送达
+- LocalBackplane：进程内直接投递，用于单 worker、Redis 不可用和测试
+
+信封格式：
+    {"id": "...", "origin": "<worker>", "channel": "notifications",
+     "user_ids": [1, 2] | null, "payload": {...}, "sent_at": <unix 时间戳>}
+
+user_ids 为 null 表示所有在线用户。各频道记录发布数、接收数、投递的
+连接数以及从发布到本 worker 投递完成的延迟分布。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+
+import redis.asyncio as aioredis
+
+from redis_cache import redis_cache
+from redis_config import redis_config
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_NOTIFICATIONS = "notifications"
+CHANNEL_REALTIME = "realtime"
+CHANNEL_APPROVAL_QUEUE = "approval_queue"
+
+CHANNELS = (CHANNEL_NOTIFICATIONS, CHANNEL_REALTIME, CHANNEL_APPROVAL_QUEUE)
+
+REDIS_CHANNEL_PREFIX = f"{redis_config.key_prefix}ws:"
+
+# 每个频道保留的延迟样本数
+LATENCY_SAMPLES = 1000
+
+# 订阅断开后的重连间隔（秒），逐次翻倍直至上限
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+
+# 投递回调：返回 (投递成功的连接数, 失败的连接数)
+Handler = Callable[[dict], Awaitable[Tuple[int, int]]]
+
+
+def make_envelope(channel: str, user_ids: Optional[Iterable[int]], payload: dict, origin: str) -> dict:
+    return {
+        "id": uuid.uuid4().hex,
+        "origin": origin,
+        "channel": channel,
+        "user_ids": sorted(set(user_ids)) if user_ids is not None else None,
+        "payload": payload,
+        "sent_at": time.time(),
+    }
+
+
+class ChannelMetrics:
+    """单个频道的投递统计"""
+
+    def __init__(self):
+        self.published = 0
+        self.received = 0
+        self.delivered = 0  # 投递成功的连接数
+        self.failed = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)  # 秒
+
+    def snapshot(self) -> dict:
+        samples = sorted(self.latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3)
+
+        return {
+            "published": self.published,
+            "received": self.received,
+            "delivered_connections": self.delivered,
+            "failed_connections": self.failed,
+            "latency_ms": {
+                "samples": len(samples),
+                "avg": round(sum(samples) / len(samples) * 1000, 3) if samples else None,
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": round(samples[-1] * 1000, 3) if samples else None,
+            },
+        }
+
+
+class LocalBackplane:
+    """进程内背板：发布即在本进程的事件循环中投递"""
+
+    name = "local"
+    distributed = False
+
+    def __init__(self):
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.metrics: Dict[str, ChannelMetrics] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handler: Optional[Handler] = None
+        # 事件循环只弱引用任务，进行中的投递在这里保留强引用
+        self._tasks: Set[asyncio.Task] = set()
+
+    def channel_metrics(self, channel: str) -> ChannelMetrics:
+        if channel not in self.metrics:
+            self.metrics[channel] = ChannelMetrics()
+        return self.metrics[channel]
+
+    async def start(self, handler: Handler):
+        self.loop = asyncio.get_running_loop()
+        self._handler = handler
+
+    async def stop(self):
+        self._handler = None
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def _spawn(self, coro):
+        """在事件循环线程中创建任务并保留引用，完成后移除"""
+        task = self.loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _schedule(self, coro) -> bool:
+        """在背板的事件循环中执行协程（可在任意线程调用），不等待结果"""
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            coro.close()
+            return False
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._spawn(coro)
+            return True
+        try:
+            loop.call_soon_threadsafe(self._spawn, coro)
+        except RuntimeError:
+            # 事件循环已关闭
+            coro.close()
+            return False
+        return True
+
+    def _dispatch(self, envelope: dict):
+        """在事件循环中执行投递（可在任意线程调用）"""
+        if self._handler is not None:
+            self._schedule(self._receive(envelope))
+
+    async def _receive(self, envelope: dict):
+        metrics = self.channel_metrics(envelope["channel"])
+        metrics.received += 1
+        try:
+            delivered, failed = await self._handler(envelope)
+        except Exception as e:
+            logger.error(f"投递 {envelope['channel']} 消息失败: {e}")
+            return
+        metrics.delivered += delivered
+        metrics.failed += failed
+        metrics.latencies.append(max(time.time() - envelope["sent_at"], 0.0))
+
+    def publish(self, channel: str, user_ids: Optional[Iterable[int]], payload: dict):
+        envelope = make_envelope(channel, user_ids, payload, self.worker_id)
+        self.channel_metrics(channel).published += 1
+        self._dispatch(envelope)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "worker_id": self.worker_id,
+            "channels": {channel: m.snapshot() for channel, m in self.metrics.items()},
+        }
+
+
+class RedisBackplane(LocalBackplane):
+    """
+    Redis pub/sub 背板：所有 worker 订阅同一组频道，各自投递本地连接
+
+    发布使用 redis.asyncio 客户端在事件循环中异步执行：同步接口（在线程池中
+    运行）和协程中调用 publish 都只是把发布任务交给事件循环，不在调用处
+    等待 Redis 往返，也不会阻塞事件循环。
+    """
+
+    name = "redis"
+    distributed = True
+
+    def __init__(self):
+        super().__init__()
+        self._task: Optional[asyncio.Task] = None
+        self._client: Optional[aioredis.Redis] = None
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        self._client = aioredis.Redis(**redis_config.get_connection_params())
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # 先取消进行中的发布和投递，再关闭发布客户端
+        await super().stop()
+        if self._client:
+            try:
+                await self._client.aclose()
+            except Exception:
+                pass
+            self._client = None
+
+    async def _listen(self):
+        delay = RECONNECT_DELAY
+        channels = [REDIS_CHANNEL_PREFIX + channel for channel in CHANNELS]
+        while True:
+            client = aioredis.Redis(**redis_config.get_connection_params())
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(*channels)
+                logger.info(f"已订阅 WebSocket 推送频道（worker {self.worker_id}）")
+                delay = RECONNECT_DELAY
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        envelope = json.loads(message["data"])
+                    except (TypeError, ValueError):
+                        logger.warning(f"忽略无效的推送消息: {message.get('data')!r}")
+                        continue
+                    # 每条消息单独投递，慢连接不阻塞后续消息
+                    self._spawn(self._receive(envelope))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"推送频道订阅中断，{delay:.0f} 秒后重连: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            finally:
+                try:
+                    await pubsub.aclose()
+                    await client.aclose()
+                except Exception:
+                    pass
+
+    async def _publish(self, envelope: dict):
+        try:
+            await self._client.publish(
+                REDIS_CHANNEL_PREFIX + envelope["channel"], json.dumps(envelope, ensure_ascii=False, default=str)
+            )
+        except Exception as e:
+            # Redis 不可用时至少投递给本进程内的连接
+            logger.warning(f"发布推送消息失败，仅投递本 worker 的连接: {e}")
+            await self._receive(envelope)
+
+    def publish(self, channel: str, user_ids: Optional[Iterable[int]], payload: dict):
+        envelope = make_envelope(channel, user_ids, payload, self.worker_id)
+        self.channel_metrics(channel).published += 1
+        if self._client is None or not self._schedule(self._publish(envelope)):
+            logger.warning("推送背板未启动，丢弃推送消息")
+
+
+def create_backplane(mode: str = "auto") -> LocalBackplane:
+    """根据配置选择背板：auto 时 Redis 可用则使用 Redis"""
+    if mode == "redis" or (mode == "auto" and redis_cache.is_connected):
+        if not redis_cache.is_connected:
+            logger.warning("Redis 未连接，WebSocket 推送退回进程内投递")
+            return LocalBackplane()
+        return RedisBackplane()
+    return LocalBackplane()
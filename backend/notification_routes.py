@@ -258,6 +258,19 @@ async def get_online_users(
         "count": len(online_user_ids)
     }
 
+@router.get("/notifications/backplane-stats")
+async def get_backplane_stats(
+    current_user: User = Depends(get_current_user_dependency)
+):
+    """本 worker 的推送背板统计：各频道发布/接收/投递数和投递延迟（管理员功能）"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="权限不足")
+    
+    return {
+        **notification_manager.backplane.stats(),
+        "local_online_users": len(notification_manager.get_online_users())
+    }
+
 @router.delete("/notifications/{notification_id}")
 async def delete_notification(
     notification_id: int,
@@ -307,7 +320,7 @@ class NotificationTriggers:
     async def trigger_reagent_low_stock(db: Session, reagent_name: str, current_stock: float, min_stock: float):
         """试剂库存不足通知"""
         # 获取需要通知的用户（管理员和相关研究人员）
-        admin_users = db.query(User).filter(User.is_admin == True).all()
+        admin_users = db.query(User).filter(User.role == "admin", User.is_active == True).all()
         
         for user in admin_users:
             await NotificationService.send_notification(
@@ -324,10 +337,30 @@ class NotificationTriggers:
                 }
             )
     
+    @staticmethod
+    async def trigger_consumable_low_stock(db: Session, consumable_name: str, current_stock: float, min_stock: float):
+        """耗材库存不足通知"""
+        admin_users = db.query(User).filter(User.role == "admin", User.is_active == True).all()
+        
+        for user in admin_users:
+            await NotificationService.send_notification(
+                db=db,
+                user_id=user.id,
+                title="耗材库存不足警告",
+                message=f"耗材 {consumable_name} 库存不足，当前库存：{current_stock}，最低库存：{min_stock}",
+                notification_type=NotificationType.CONSUMABLE_LOW_STOCK,
+                priority=NotificationPriority.HIGH,
+                data={
+                    "consumable_name": consumable_name,
+                    "current_stock": current_stock,
+                    "min_stock": min_stock
+                }
+            )
+    
     @staticmethod
     async def trigger_reagent_expiring(db: Session, reagent_name: str, expiry_date: str, days_until_expiry: int):
         """试剂即将过期通知"""
-        admin_users = db.query(User).filter(User.is_admin == True).all()
+        admin_users = db.query(User).filter(User.role == "admin", User.is_active == True).all()
         
         for user in admin_users:
             await NotificationService.send_notification(
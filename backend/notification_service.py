@@ -2,29 +2,54 @@ import json
 import asyncio
 import uuid
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Set
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from fastapi import WebSocket, WebSocketDisconnect
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 from models import Notification, WebSocketConnection, User
 from database import get_db
+from connection_heartbeats import heartbeat_tracker
+from notification_backplane import (
+    CHANNEL_NOTIFICATIONS, CHANNEL_REALTIME, LocalBackplane, create_backplane
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
 class NotificationManager:
-    """通知管理器 - 处理WebSocket连接和通知分发"""
+    """
+    通知管理器 - 处理WebSocket连接和通知分发
+
+    active_connections 只包含连接到本 worker 的 WebSocket。推送统一发布到
+    背板（见 notification_backplane），由每个 worker 投递给自己的连接。
+    """
     
     def __init__(self):
         # 活跃的WebSocket连接 {user_id: {connection_id: websocket}}
         self.active_connections: Dict[int, Dict[str, WebSocket]] = {}
         # 连接ID到用户ID的映射
         self.connection_user_map: Dict[str, int] = {}
+        # 推送背板，应用启动时按配置替换
+        self.backplane: LocalBackplane = LocalBackplane()
         
+    async def start_backplane(self, mode: str = "auto"):
+        """在应用事件循环中启动推送背板"""
+        backplane = create_backplane(mode)
+        await backplane.start(self._deliver)
+        self.backplane = backplane
+        logger.info(f"WebSocket 推送背板: {backplane.name}（worker {backplane.worker_id}）")
+    
+    async def stop_backplane(self):
+        await self.backplane.stop()
+    
     async def connect(self, websocket: WebSocket, user_id: int, db: Session) -> str:
         """建立WebSocket连接"""
         # WebSocket已经在路由中accept了，这里不需要再次accept
         
         connection_id = str(uuid.uuid4())
+        if self.backplane.loop is None:
+            # 未通过应用启动事件启动背板时（如测试），在首个连接的事件循环上启动进程内背板
+            await self.backplane.start(self._deliver)
         
         # 添加到活跃连接
         if user_id not in self.active_connections:
@@ -61,6 +86,7 @@ class NotificationManager:
                     del self.active_connections[user_id]
             
             del self.connection_user_map[connection_id]
+            heartbeat_tracker.discard(connection_id)
             
             # 更新数据库
             db_connection = db.query(WebSocketConnection).filter(
@@ -73,41 +99,12 @@ class NotificationManager:
             logger.info(f"用户 {user_id} 断开WebSocket连接: {connection_id}")
     
     async def send_notification_to_user(self, user_id: int, notification_data: dict, db: Session):
-        """向特定用户发送通知"""
-        if user_id in self.active_connections:
-            # 向该用户的所有活跃连接发送通知
-            disconnected_connections = []
-            
-            for connection_id, websocket in self.active_connections[user_id].items():
-                try:
-                    await websocket.send_text(json.dumps(notification_data, ensure_ascii=False))
-                    
-                    # 更新心跳时间
-                    db_connection = db.query(WebSocketConnection).filter(
-                        WebSocketConnection.connection_id == connection_id
-                    ).first()
-                    if db_connection:
-                        db_connection.last_ping = datetime.utcnow()
-                        db.commit()
-                        
-                except Exception as e:
-                    logger.error(f"发送通知失败，连接 {connection_id}: {e}")
-                    disconnected_connections.append(connection_id)
-            
-            # 清理断开的连接
-            for connection_id in disconnected_connections:
-                await self.disconnect(connection_id, db)
+        """向特定用户发送通知（用户可以连接在任一 worker 上）"""
+        self.backplane.publish(CHANNEL_NOTIFICATIONS, [user_id], notification_data)
     
     async def broadcast_notification(self, notification_data: dict, user_ids: Optional[List[int]] = None, db: Session = None):
-        """广播通知"""
-        if user_ids is None:
-            # 向所有在线用户广播
-            target_users = list(self.active_connections.keys())
-        else:
-            target_users = user_ids
-        
-        for user_id in target_users:
-            await self.send_notification_to_user(user_id, notification_data, db)
+        """广播通知（user_ids 为空时发给所有在线用户），整批只发布一条消息"""
+        self.backplane.publish(CHANNEL_NOTIFICATIONS, user_ids, notification_data)
     
     async def _send_unread_notifications(self, user_id: int, connection_id: str, db: Session):
         """发送未读通知"""
@@ -146,13 +143,8 @@ class NotificationManager:
                 # 心跳消息
                 await websocket.send_text(json.dumps({"type": "pong"}))
                 
-                # 更新心跳时间
-                db_connection = db.query(WebSocketConnection).filter(
-                    WebSocketConnection.connection_id == connection_id
-                ).first()
-                if db_connection:
-                    db_connection.last_ping = datetime.utcnow()
-                    db.commit()
+                # 更新心跳时间（批量写回）
+                heartbeat_tracker.touch(connection_id)
                     
             elif message_type == "mark_read":
                 # 标记通知为已读
@@ -175,12 +167,60 @@ class NotificationManager:
         except Exception as e:
             logger.error(f"处理消息失败: {e}")
     
+    async def _deliver(self, envelope: dict) -> Tuple[int, int]:
+        """背板回调：把一条消息投递给本 worker 上的目标连接"""
+        user_ids = envelope["user_ids"]
+        if user_ids is None:
+            user_ids = list(self.active_connections.keys())
+        targets = [
+            (connection_id, websocket)
+            for user_id in user_ids
+            for connection_id, websocket in list(self.active_connections.get(user_id, {}).items())
+        ]
+        if not targets:
+            return 0, 0
+
+        message = json.dumps(envelope["payload"], ensure_ascii=False)
+        delivered = []
+        failed = 0
+        for connection_id, websocket in targets:
+            try:
+                await websocket.send_text(message)
+                delivered.append(connection_id)
+            except Exception as e:
+                # 断开的连接由其所在的 WebSocket 端点清理
+                logger.warning(f"推送消息失败，连接 {connection_id}: {e}")
+                failed += 1
+
+        if delivered and envelope["channel"] == CHANNEL_NOTIFICATIONS:
+            # 通知送达即视为连接存活，心跳由周期任务批量写回
+            heartbeat_tracker.touch_many(delivered)
+        return len(delivered), failed
+
+    def publish_to_users(self, user_ids: Iterable[int], payload: dict, channel: str = CHANNEL_REALTIME) -> int:
+        """
+        向用户推送一条实时消息（不写通知表、不更新心跳）
+
+        可在任意线程调用；消息经背板送到用户所在的 worker，不在线的用户
+        直接忽略。返回发布的目标用户数。
+        """
+        targets = set(user_ids)
+        if not targets:
+            return 0
+        self.backplane.publish(channel, targets, payload)
+        return len(targets)
+
+    @property
+    def is_distributed(self) -> bool:
+        """推送是否跨 worker 分发（此时本进程的在线列表不代表全部在线用户）"""
+        return self.backplane.distributed
+
     def get_online_users(self) -> List[int]:
-        """获取在线用户列表"""
+        """获取本 worker 上的在线用户列表"""
         return list(self.active_connections.keys())
     
     def is_user_online(self, user_id: int) -> bool:
-        """检查用户是否在线"""
+        """检查用户是否连接在本 worker 上"""
         return user_id in self.active_connections
 
 # 全局通知管理器实例
@@ -217,6 +257,62 @@ class NotificationService:
         
         return notification
     
+    @staticmethod
+    def create_notifications_bulk(db: Session, notifications: List[dict]) -> List[Tuple[int, dict]]:
+        """
+        批量创建通知（一条 executemany INSERT）
+
+        Args:
+            notifications: 每项包含 user_id, title, message, notification_type，
+                可选 priority, data, expires_at
+
+        Returns:
+            [(user_id, 通知数据)]，可直接用于实时推送
+        """
+        if not notifications:
+            return []
+
+        now = datetime.utcnow()
+        rows = [
+            {
+                "user_id": n["user_id"],
+                "title": n["title"],
+                "message": n["message"],
+                "type": n["notification_type"],
+                "priority": n.get("priority", "normal"),
+                "data": json.dumps(n["data"], ensure_ascii=False) if n.get("data") else None,
+                "expires_at": n.get("expires_at"),
+                "is_read": False,
+                "created_at": now,
+            }
+            for n in notifications
+        ]
+        ids = db.scalars(
+            insert(Notification).returning(Notification.id, sort_by_parameter_order=True),
+            rows
+        ).all()
+        db.commit()
+
+        return [
+            (n["user_id"], {
+                "id": notification_id,
+                "title": n["title"],
+                "message": n["message"],
+                "type": n["notification_type"],
+                "priority": n.get("priority", "normal"),
+                "data": n.get("data"),
+                "created_at": now.isoformat(),
+                "is_read": False
+            })
+            for notification_id, n in zip(ids, notifications)
+        ]
+
+    @staticmethod
+    async def push_notifications(db: Session, pushes: List[Tuple[int, dict]]):
+        """向在线用户推送已创建的通知（不在线的用户由各 worker 投递时忽略）"""
+        for user_id, notification_data in pushes:
+            await notification_manager.send_notification_to_user(user_id, notification_data, db)
+
     @staticmethod
     async def send_notification(
         db: Session,
@@ -337,7 +433,12 @@ class NotificationService:
     
     @staticmethod
     def cleanup_inactive_connections(db: Session, timeout_minutes: int = 30) -> int:
-        """清理非活跃连接"""
+        """清理非活跃连接（先写回本进程尚未落库的心跳）"""
+        try:
+            heartbeat_tracker.flush(db)
+        except Exception as e:
+            # 写回失败时心跳已放回内存等待下次写回，不影响本次清理
+            logger.warning(f"清理前写回连接心跳失败: {e}")
         timeout_time = datetime.utcnow() - timedelta(minutes=timeout_minutes)
         
         count = db.query(WebSocketConnection).filter(
@@ -351,6 +452,7 @@ class NotificationService:
 # 通知类型常量
 class NotificationType:
     REAGENT_LOW_STOCK = "reagent_low_stock"
+    CONSUMABLE_LOW_STOCK = "consumable_low_stock"
     REAGENT_EXPIRING = "reagent_expiring"
     EQUIPMENT_MAINTENANCE = "equipment_maintenance"
     EXPERIMENT_COMPLETED = "experiment_completed"
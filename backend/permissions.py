@@ -1,10 +1,11 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import FrozenSet, Iterable, List, Optional, Set
 from database import get_db
-from models import User, Role, Permission
+from models import User, Role, Permission, user_roles, role_permissions
 from auth import get_current_user
 from functools import wraps
+import inspect
 
 class PermissionChecker:
     """权限检查器类"""
@@ -14,130 +15,161 @@ class PermissionChecker:
     
     def user_has_permission(self, user: User, permission_name: str) -> bool:
         """检查用户是否具有指定权限"""
-        # 检查用户的所有角色是否包含该权限
-        for role in user.roles:
-            if not role.is_active:
-                continue
-            for permission in role.permissions:
-                if permission.name == permission_name:
-                    return True
-        return False
+        return AuthContext.for_user(user, self.db).has_permission(permission_name)
     
     def user_has_role(self, user: User, role_name: str) -> bool:
         """检查用户是否具有指定角色"""
-        for role in user.roles:
-            if role.name == role_name and role.is_active:
-                return True
-        return False
+        return AuthContext.for_user(user, self.db).has_role(role_name)
     
     def get_user_permissions(self, user: User) -> List[str]:
         """获取用户的所有权限"""
-        permissions = set()
-        for role in user.roles:
-            if not role.is_active:
-                continue
-            for permission in role.permissions:
-                permissions.add(permission.name)
-        return list(permissions)
+        return list(AuthContext.for_user(user, self.db).permissions)
     
     def get_user_roles(self, user: User) -> List[str]:
         """获取用户的所有角色"""
-        return [role.name for role in user.roles if role.is_active]
+        return list(AuthContext.for_user(user, self.db).roles)
 
-def require_permission(permission_name: str):
-    """权限装饰器 - 要求特定权限"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            # 从依赖注入中获取当前用户和数据库会话
-            current_user = None
-            db = None
-            
-            # 查找函数参数中的current_user和db
-            for key, value in kwargs.items():
-                if isinstance(value, User):
-                    current_user = value
-                elif hasattr(value, 'query'):  # 检查是否为数据库会话
-                    db = value
-            
-            if not current_user or not db:
+class AuthContext:
+    """请求级认证上下文
+
+    每个请求只解析一次用户、激活角色和有效权限，
+    依赖函数、装饰器和端点都从这里读取，不再重复查询。
+    """
+
+    def __init__(self, user: User, roles: FrozenSet[str], permissions: FrozenSet[str]):
+        self.user = user
+        self.roles = roles
+        self.permissions = permissions
+
+    @classmethod
+    def resolve(cls, user: User, db: Optional[Session] = None) -> "AuthContext":
+        """一次查询解析用户的激活角色及其权限"""
+        if db is None:
+            # 没有会话时退回到关系加载（仅用于直接调用端点函数的场景）
+            roles = frozenset(role.name for role in user.roles if role.is_active)
+            permissions = frozenset(
+                permission.name
+                for role in user.roles if role.is_active
+                for permission in role.permissions
+            )
+            return cls(user, roles, permissions)
+
+        rows = db.query(Role.name, Permission.name).join(
+            user_roles, user_roles.c.role_id == Role.id
+        ).outerjoin(
+            role_permissions, role_permissions.c.role_id == Role.id
+        ).outerjoin(
+            Permission, Permission.id == role_permissions.c.permission_id
+        ).filter(
+            user_roles.c.user_id == user.id,
+            Role.is_active == True
+        ).all()
+
+        roles = frozenset(role_name for role_name, _ in rows)
+        permissions = frozenset(permission_name for _, permission_name in rows if permission_name)
+        return cls(user, roles, permissions)
+
+    @classmethod
+    def for_user(cls, user: User, db: Optional[Session] = None) -> "AuthContext":
+        """获取用户的认证上下文（同一用户对象只解析一次）"""
+        context = getattr(user, "_auth_context", None)
+        if context is None:
+            context = cls.resolve(user, db)
+            user._auth_context = context
+        return context
+
+    def has_permission(self, permission_name: str) -> bool:
+        return permission_name in self.permissions
+
+    def has_role(self, role_name: str) -> bool:
+        return role_name in self.roles
+
+    def require_permission(self, permission_name: str):
+        """缺少权限时抛出403"""
+        if permission_name not in self.permissions:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"权限不足：需要 {permission_name} 权限"
+            )
+
+    def require_role(self, role_name: str):
+        """缺少角色时抛出403"""
+        if role_name not in self.roles:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"权限不足：需要 {role_name} 角色"
+            )
+
+def get_auth_context(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+) -> AuthContext:
+    """请求级认证上下文依赖（FastAPI在同一请求内缓存依赖结果）"""
+    context = AuthContext.for_user(current_user, db)
+    request.state.auth_context = context
+    return context
+
+_AUTH_CONTEXT_PARAM = "_auth_context"
+
+def _context_decorator(func, check):
+    """为端点注入请求级AuthContext并在调用前执行检查
+
+    装饰时在签名中追加一个隐藏的依赖参数，FastAPI 会把与其他依赖共享的
+    AuthContext 传进来；直接调用端点函数时退回到 current_user 参数。
+    """
+    signature = inspect.signature(func)
+    parameters = list(signature.parameters.values())
+    parameters.append(inspect.Parameter(
+        _AUTH_CONTEXT_PARAM,
+        inspect.Parameter.KEYWORD_ONLY,
+        default=Depends(get_auth_context),
+        annotation=AuthContext
+    ))
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        context = kwargs.pop(_AUTH_CONTEXT_PARAM, None)
+        if not isinstance(context, AuthContext):
+            current_user = kwargs.get("current_user")
+            if not isinstance(current_user, User):
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail="权限检查失败：缺少必要参数"
                 )
-            
-            checker = PermissionChecker(db)
-            if not checker.user_has_permission(current_user, permission_name):
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail=f"权限不足：需要 {permission_name} 权限"
-                )
-            
-            return func(*args, **kwargs)
-        return wrapper
+            context = AuthContext.for_user(current_user, kwargs.get("db"))
+
+        check(context)
+        return func(*args, **kwargs)
+
+    wrapper.__signature__ = signature.replace(parameters=parameters)
+    return wrapper
+
+def require_permission(permission_name: str):
+    """权限装饰器 - 要求特定权限"""
+    def decorator(func):
+        return _context_decorator(func, lambda context: context.require_permission(permission_name))
     return decorator
 
 def require_role(role_name: str):
     """角色装饰器 - 要求特定角色"""
     def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            # 从依赖注入中获取当前用户和数据库会话
-            current_user = None
-            db = None
-            
-            for key, value in kwargs.items():
-                if isinstance(value, User):
-                    current_user = value
-                elif hasattr(value, 'query'):
-                    db = value
-            
-            if not current_user or not db:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="权限检查失败：缺少必要参数"
-                )
-            
-            checker = PermissionChecker(db)
-            if not checker.user_has_role(current_user, role_name):
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail=f"权限不足：需要 {role_name} 角色"
-                )
-            
-            return func(*args, **kwargs)
-        return wrapper
+        return _context_decorator(func, lambda context: context.require_role(role_name))
     return decorator
 
 # 权限依赖函数
 def check_permission(permission_name: str):
     """权限检查依赖函数"""
-    def permission_dependency(
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
-    ):
-        checker = PermissionChecker(db)
-        if not checker.user_has_permission(current_user, permission_name):
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=f"权限不足：需要 {permission_name} 权限"
-            )
-        return current_user
+    def permission_dependency(context: AuthContext = Depends(get_auth_context)):
+        context.require_permission(permission_name)
+        return context.user
     return permission_dependency
 
 def check_role(role_name: str):
     """角色检查依赖函数"""
-    def role_dependency(
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
-    ):
-        checker = PermissionChecker(db)
-        if not checker.user_has_role(current_user, role_name):
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=f"权限不足：需要 {role_name} 角色"
-            )
-        return current_user
+    def role_dependency(context: AuthContext = Depends(get_auth_context)):
+        context.require_role(role_name)
+        return context.user
     return role_dependency
 
 # 常用权限检查函数
@@ -150,6 +182,28 @@ def require_admin(current_user: User = Depends(get_current_user)):
         )
     return current_user
 
+def users_with_permission(db: Session, permission_name: str, user_ids: Optional[Iterable[int]] = None) -> Set[int]:
+    """通过激活角色拥有指定权限的活跃用户ID（user_ids 不为空时只在其中查找），一次查询"""
+    query = db.query(user_roles.c.user_id).join(
+        Role, Role.id == user_roles.c.role_id
+    ).join(
+        role_permissions, role_permissions.c.role_id == Role.id
+    ).join(
+        Permission, Permission.id == role_permissions.c.permission_id
+    ).join(
+        User, User.id == user_roles.c.user_id
+    ).filter(
+        Permission.name == permission_name,
+        Role.is_active == True,
+        User.is_active == True
+    )
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        query = query.filter(user_roles.c.user_id.in_(user_ids))
+    return {user_id for (user_id,) in query.distinct().all()}
+
 def get_permission_checker(db: Session = Depends(get_db)) -> PermissionChecker:
     """获取权限检查器实例"""
     return PermissionChecker(db)
@@ -6,7 +6,7 @@
 
 from sqlalchemy.orm import Session, joinedload, selectinload
 from sqlalchemy import and_, or_, func, desc, asc
-from models import Device, Reagent, Consumable, User, DeviceMaintenance, DeviceReservation, Notification
+from models import Device, Reagent, Consumable, User, DeviceReservation, Notification
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
 
@@ -54,51 +54,46 @@ class OptimizedQueries:
     
     def get_device_usage_stats(self, device_id: int, days: int = 30) -> Dict[str, Any]:
         """
-        获取设备使用统计信息
+        获取设备使用统计信息（读取每日使用汇总表）
         """
-        start_date = datetime.now() - timedelta(days=days)
-        
-        # 预约统计
-        reservations = self.db.query(DeviceReservation).filter(
-            and_(
-                DeviceReservation.device_id == device_id,
-                DeviceReservation.created_at >= start_date
-            )
-        ).all()
-        
-        # 维护统计
-        maintenance_count = self.db.query(func.count(DeviceMaintenance.id)).filter(
-            and_(
-                DeviceMaintenance.device_id == device_id,
-                DeviceMaintenance.maintenance_date >= start_date.date()
-            )
-        ).scalar()
+        from device_usage_rollup import get_usage_totals, utilization
+
+        last_day = datetime.now().date()
+        first_day = last_day - timedelta(days=max(days, 1) - 1)
+        totals = get_usage_totals(self.db, device_id, first_day, last_day)
+        used_hours = totals['completed_hours'] + totals['borrow_hours']
         
         return {
-            'total_reservations': len(reservations),
-            'completed_reservations': len([r for r in reservations if r.status == 'completed']),
-            'maintenance_count': maintenance_count,
-            'utilization_rate': len([r for r in reservations if r.status == 'completed']) / max(days, 1)
+            'total_reservations': totals['reservation_count'],
+            'completed_reservations': totals['completed_count'],
+            'maintenance_count': totals['maintenance_count'],
+            'reserved_hours': round(totals['reserved_hours'], 2),
+            'completed_hours': round(totals['completed_hours'], 2),
+            'borrow_hours': round(totals['borrow_hours'], 2),
+            'used_hours': round(used_hours, 2),
+            'utilization_rate': utilization(used_hours, days)
         }
     
     # 试剂相关优化查询
     def get_expiring_reagents(self, days_ahead: int = 30) -> List[Reagent]:
         """
-        获取即将过期的试剂
+        获取即将过期的试剂（读取过期时间线分桶）
         """
-        target_date = datetime.now() + timedelta(days=days_ahead)
-        
-        return self.db.query(Reagent).filter(
-            and_(
-                Reagent.expiry_date <= target_date,
-                Reagent.quantity > 0
-            )
-        ).order_by(Reagent.expiry_date).all()
+        from reagent_expiry import expiring_reagents_query
+
+        return expiring_reagents_query(self.db, days_ahead).filter(
+            Reagent.quantity > 0
+        ).all()
     
-    def get_low_stock_reagents(self, threshold: float = 10.0) -> List[Reagent]:
+    def get_low_stock_reagents(self, threshold: Optional[float] = None) -> List[Reagent]:
         """
-        获取库存不足的试剂
+        获取库存不足的试剂（未指定阈值时读取维护的低库存标记）
         """
+        if threshold is None:
+            from low_stock import low_stock_query
+
+            return low_stock_query(self.db, Reagent).all()
+
         return self.db.query(Reagent).filter(
             Reagent.quantity <= threshold
         ).order_by(Reagent.quantity).all()
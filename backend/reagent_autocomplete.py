@@ -0,0 +1,258 @@
+# backend/reagent_autocomplete.py
+
+"""
+试剂自动补全索引
+
+在内存中为名称、CAS号、产品货号和分子式各维护一个排序数组，前缀查询
+用 bisect 定位区间，只检查区间内的少量条目。名称同时按单词建索引
+（输入 "chloride" 可以找到 "Sodium chloride"）；CAS号只保留数字，输入
+"7647-14"、"7647 14" 或 "764714" 都能匹配。
+
+试剂经 ORM 写入并提交后本进程立即标记索引过期，同时递增 Redis 中的
+版本号；其他 worker 每秒最多检查一次版本号，发现变化（或版本键被
+reagents:* 缓存失效删除）时在下一次查询前重建索引。
+"""
+
+import logging
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from models import Reagent
+from redis_cache import redis_cache
+
+logger = logging.getLogger(__name__)
+
+FIELD_NAME = "name"
+FIELD_CAS = "cas_number"
+FIELD_PRODUCT = "product_number"
+FIELD_FORMULA = "molecular_formula"
+
+# 字段顺序即同等匹配程度下的排序优先级
+INDEXED_FIELDS = (FIELD_NAME, FIELD_CAS, FIELD_PRODUCT, FIELD_FORMULA)
+
+# 建议结果中返回的列
+RECORD_COLUMNS = ("id", "name", "cas_number", "product_number", "molecular_formula", "manufacturer")
+
+# 版本键位于 reagents: 前缀下，试剂缓存整体失效时索引也随之重建
+VERSION_KEY = "reagents:autocomplete:version"
+
+# 检查 Redis 版本号的最小间隔（秒）
+VERSION_CHECK_INTERVAL = 1.0
+
+# 每个字段最多检查的候选条目数（相对 limit 的倍数）
+SCAN_FACTOR = 20
+
+SESSION_INFO_KEY = "reagent_autocomplete_dirty"
+
+_WORD_SPLIT = re.compile(r"[\s,;/()\[\]-]+")
+_WHITESPACE = re.compile(r"\s+")
+_NON_DIGIT = re.compile(r"\D")
+_CAS_QUERY = re.compile(r"^[\d\s\-.]+$")
+
+
+def normalize(field: str, value: Optional[str]) -> str:
+    if not value:
+        return ""
+    if field == FIELD_CAS:
+        return _NON_DIGIT.sub("", value)
+    if field == FIELD_FORMULA:
+        return _WHITESPACE.sub("", value).casefold()
+    return _WHITESPACE.sub(" ", value).strip().casefold()
+
+
+def normalize_query(field: str, query: str) -> str:
+    """查询前缀的规范化；CAS号只在输入看起来像 CAS 号时参与匹配"""
+    if field == FIELD_CAS and not _CAS_QUERY.match(query.strip()):
+        return ""
+    return normalize(field, query)
+
+
+def index_keys(field: str, value: Optional[str]) -> List[str]:
+    key = normalize(field, value)
+    if not key:
+        return []
+    if field != FIELD_NAME:
+        return [key]
+    # 名称：整体 + 后续各单词
+    words = [w for w in _WORD_SPLIT.split(key) if w]
+    return [key] + [w for w in words[1:] if w != key]
+
+
+class AutocompleteIndex:
+    """不可变的前缀索引，重建时整体替换"""
+
+    def __init__(self, records: Iterable[dict]):
+        self.records: Dict[int, dict] = {}
+        entries: Dict[str, List[Tuple[str, int]]] = {field: [] for field in INDEXED_FIELDS}
+        for record in records:
+            self.records[record["id"]] = record
+            for field in INDEXED_FIELDS:
+                for key in index_keys(field, record.get(field)):
+                    entries[field].append((key, record["id"]))
+
+        self._keys: Dict[str, List[str]] = {}
+        self._ids: Dict[str, List[int]] = {}
+        for field, items in entries.items():
+            items.sort()
+            self._keys[field] = [key for key, _ in items]
+            self._ids[field] = [item_id for _, item_id in items]
+
+    def __len__(self):
+        return len(self.records)
+
+    def search(self, query: str, limit: int = 10, fields: Sequence[str] = INDEXED_FIELDS) -> List[dict]:
+        """
+        前缀查询，返回至多 limit 条去重后的建议
+
+        排序：完全匹配优先，其次按字段优先级，再按匹配键长度。
+        同名同货号同 CAS 的多个批次只返回一条。
+        """
+        scan = max(limit, 1) * SCAN_FACTOR
+        candidates = []
+        for rank, field in enumerate(INDEXED_FIELDS):
+            if field not in fields:
+                continue
+            prefix = normalize_query(field, query)
+            if not prefix:
+                continue
+            keys, ids = self._keys[field], self._ids[field]
+            start = bisect_left(keys, prefix)
+            end = min(bisect_left(keys, prefix + "\uffff", start), start + scan)
+            for i in range(start, end):
+                candidates.append((keys[i] != prefix, rank, len(keys[i]), keys[i], ids[i], field))
+
+        candidates.sort()
+        results = []
+        seen_ids = set()
+        seen_products = set()
+        for _, _, _, _, item_id, field in candidates:
+            if item_id in seen_ids:
+                continue
+            seen_ids.add(item_id)
+            record = self.records[item_id]
+            product = (record.get("name"), record.get("product_number"), record.get("cas_number"))
+            if product in seen_products:
+                continue
+            seen_products.add(product)
+            results.append({**record, "matched_field": field})
+            if len(results) >= limit:
+                break
+        return results
+
+
+class ReagentAutocomplete:
+    """按需重建的全局自动补全索引"""
+
+    def __init__(self, cache=None):
+        self.cache = cache or redis_cache
+        self._index: Optional[AutocompleteIndex] = None
+        self._version: Optional[str] = None
+        self._dirty = True
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def mark_stale(self, broadcast: bool = True):
+        """标记索引过期；broadcast 时递增 Redis 版本号通知其他 worker"""
+        self._dirty = True
+        if broadcast and self.cache.is_connected:
+            try:
+                self.cache.redis_client.incr(VERSION_KEY)
+            except Exception as e:
+                logger.warning(f"更新自动补全索引版本失败: {e}")
+
+    def _remote_version(self) -> Optional[str]:
+        if not self.cache.is_connected:
+            return None
+        try:
+            # 版本键被删除后以随机整数重新生成（仍可 INCR），保证删除也会被其他 worker 观察到
+            self.cache.redis_client.set(VERSION_KEY, uuid.uuid4().int >> 80, nx=True)
+            version = self.cache.redis_client.get(VERSION_KEY)
+            return version.decode() if isinstance(version, bytes) else version
+        except Exception as e:
+            logger.warning(f"读取自动补全索引版本失败: {e}")
+            return self._version
+
+    def _is_stale(self) -> bool:
+        if self._index is None or self._dirty:
+            return True
+        now = time.monotonic()
+        if now - self._checked_at < VERSION_CHECK_INTERVAL:
+            return False
+        self._checked_at = now
+        if self._remote_version() != self._version:
+            # 记为过期，等锁的线程在锁内再次检查时仍能看到
+            self._dirty = True
+        return self._dirty
+
+    def _rebuild_locked(self, db: Session) -> AutocompleteIndex:
+        # 先读版本号再读数据：读取期间的写入会让下一次检查再次重建
+        self._dirty = False
+        version = self._remote_version()
+        columns = [getattr(Reagent, column) for column in RECORD_COLUMNS]
+        rows = db.query(*columns).all()
+        self._index = AutocompleteIndex(dict(zip(RECORD_COLUMNS, row)) for row in rows)
+        self._version = version
+        self._checked_at = time.monotonic()
+        return self._index
+
+    def rebuild(self, db: Session) -> AutocompleteIndex:
+        """无条件重建索引"""
+        with self._lock:
+            return self._rebuild_locked(db)
+
+    def get_index(self, db: Session) -> AutocompleteIndex:
+        if not self._is_stale():
+            return self._index
+        with self._lock:
+            # 等锁期间索引可能已被其他线程重建，只有仍然过期时才重新查询
+            if self._is_stale():
+                return self._rebuild_locked(db)
+            return self._index
+
+    def suggest(self, db: Session, query: str, limit: int = 10,
+                fields: Sequence[str] = INDEXED_FIELDS) -> List[dict]:
+        return self.get_index(db).search(query, limit, fields)
+
+
+reagent_autocomplete = ReagentAutocomplete()
+
+
+# ---------- ORM 事件：试剂写入提交后标记索引过期 ----------
+
+def _mark_session(target):
+    session = object_session(target)
+    if session is not None:
+        session.info[SESSION_INFO_KEY] = True
+
+
+def _after_insert_or_delete(mapper, connection, target):
+    _mark_session(target)
+
+
+def _after_update(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[column].history.has_changes() for column in RECORD_COLUMNS if column != "id"):
+        _mark_session(target)
+
+
+event.listen(Reagent, "after_insert", _after_insert_or_delete)
+event.listen(Reagent, "after_delete", _after_insert_or_delete)
+event.listen(Reagent, "after_update", _after_update)
+
+
+@event.listens_for(Session, "after_commit")
+def _refresh_after_commit(session):
+    if session.info.pop(SESSION_INFO_KEY, False):
+        reagent_autocomplete.mark_stale()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop(SESSION_INFO_KEY, None)
@@ -0,0 +1,269 @@
+# backend/reagent_expiry.py
+
+"""
+试剂过期时间线
+
+每个有过期日期的试剂在 reagent_expiry_timeline 中对应一行，按天分桶：
+已过期、7 天内、30 天内、90 天内、更晚。试剂写入时通过 ORM 事件同步
+对应行；每日滚动任务先为缺少时间线行的试剂补建行，再用一条 CASE
+表达式重算分桶，并根据分桶变化发送即将过期提醒。过期列表和看板直接
+读取分桶，缓存键按天稳定。
+"""
+
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, delete, event, func, insert, inspect
+from sqlalchemy.orm import Query, Session
+
+from database import SessionLocal
+from models import Reagent, ReagentExpiryTimeline
+
+logger = logging.getLogger(__name__)
+
+BUCKET_EXPIRED = "expired"
+BUCKET_7D = "7d"
+BUCKET_30D = "30d"
+BUCKET_90D = "90d"
+BUCKET_LATER = "later"
+
+# (天数上限, 分桶)，按从近到远排列
+BUCKET_LIMITS = [(7, BUCKET_7D), (30, BUCKET_30D), (90, BUCKET_90D)]
+
+# 分桶紧急程度，数值越大越紧急
+BUCKET_RANK = {BUCKET_LATER: 0, BUCKET_90D: 1, BUCKET_30D: 2, BUCKET_7D: 3, BUCKET_EXPIRED: 4}
+
+# 常用查询天数对应的分桶集合（与原 expiry_date <= now + days 语义一致，包含已过期）
+BUCKETS_WITHIN = {
+    7: [BUCKET_EXPIRED, BUCKET_7D],
+    30: [BUCKET_EXPIRED, BUCKET_7D, BUCKET_30D],
+    90: [BUCKET_EXPIRED, BUCKET_7D, BUCKET_30D, BUCKET_90D],
+}
+
+# 进入这些分桶时发送即将过期提醒
+NOTIFY_BUCKETS = (BUCKET_30D, BUCKET_7D)
+
+INSERT_CHUNK_SIZE = 1000
+
+
+def timeline_today() -> date:
+    """分桶基准日期（与试剂过期时间一致使用 UTC）"""
+    return datetime.utcnow().date()
+
+
+def bucket_for(expiry_day: date, today: date) -> str:
+    days = (expiry_day - today).days
+    if days < 0:
+        return BUCKET_EXPIRED
+    for limit, bucket in BUCKET_LIMITS:
+        if days <= limit:
+            return bucket
+    return BUCKET_LATER
+
+
+def _bucket_case(today: date):
+    """与 bucket_for 等价的 SQL CASE 表达式"""
+    T = ReagentExpiryTimeline
+    whens = [(T.expiry_day < today, BUCKET_EXPIRED)]
+    whens += [(T.expiry_day <= today + timedelta(days=limit), bucket) for limit, bucket in BUCKET_LIMITS]
+    return case(*whens, else_=BUCKET_LATER)
+
+
+def _to_day(value) -> Optional[date]:
+    if value is None:
+        return None
+    return value.date() if isinstance(value, datetime) else value
+
+
+def write_timeline_rows(connection, items: Iterable[Tuple[int, object]], today: Optional[date] = None):
+    """
+    替换指定试剂的时间线行
+
+    Args:
+        connection: Session 或 Connection（ORM 事件中为当前 flush 的连接）
+        items: (试剂ID, 过期时间)，过期时间为空时只删除
+    """
+    today = today or timeline_today()
+    items = list(items)
+    if not items:
+        return
+    table = ReagentExpiryTimeline.__table__
+    ids = [reagent_id for reagent_id, _ in items]
+    for i in range(0, len(ids), INSERT_CHUNK_SIZE):
+        connection.execute(delete(table).where(table.c.reagent_id.in_(ids[i:i + INSERT_CHUNK_SIZE])))
+
+    now = datetime.utcnow()
+    rows = []
+    for reagent_id, expiry in items:
+        expiry_day = _to_day(expiry)
+        if expiry_day is None:
+            continue
+        rows.append({
+            "reagent_id": reagent_id,
+            "expiry_day": expiry_day,
+            "bucket": bucket_for(expiry_day, today),
+            "as_of": today,
+            "updated_at": now,
+        })
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        connection.execute(insert(table), rows[i:i + INSERT_CHUNK_SIZE])
+
+
+def refresh_expiry_timeline(db: Session, reagent_ids: Iterable[int]):
+    """按试剂ID从试剂表重新同步时间线（用于绕过 ORM 事件的批量写入，调用方提交）"""
+    ids = list(set(reagent_ids))
+    if not ids:
+        return
+    found = {}
+    for i in range(0, len(ids), INSERT_CHUNK_SIZE):
+        found.update(db.query(Reagent.id, Reagent.expiry_date).filter(
+            Reagent.id.in_(ids[i:i + INSERT_CHUNK_SIZE])
+        ).all())
+    write_timeline_rows(db, [(reagent_id, found.get(reagent_id)) for reagent_id in ids])
+
+
+def backfill_expiry_timeline(db: Session, today: Optional[date] = None) -> int:
+    """为有过期日期但缺少时间线行的试剂补建行（调用方提交），返回补建数量"""
+    T = ReagentExpiryTimeline
+    rows = db.query(Reagent.id, Reagent.expiry_date).outerjoin(
+        T, T.reagent_id == Reagent.id
+    ).filter(
+        Reagent.expiry_date.isnot(None),
+        T.reagent_id.is_(None)
+    ).all()
+    write_timeline_rows(db, rows, today)
+    return len(rows)
+
+
+def rebuild_expiry_timeline(db: Session, today: Optional[date] = None) -> int:
+    """全量重建时间线"""
+    today = today or timeline_today()
+    db.execute(delete(ReagentExpiryTimeline.__table__))
+    rows = db.query(Reagent.id, Reagent.expiry_date).filter(Reagent.expiry_date.isnot(None)).all()
+    write_timeline_rows(db, rows, today)
+    db.commit()
+    return len(rows)
+
+
+# ---------- ORM 事件：单条试剂写入时同步时间线 ----------
+
+@event.listens_for(Reagent, "after_insert")
+def _timeline_after_insert(mapper, connection, target):
+    write_timeline_rows(connection, [(target.id, target.expiry_date)])
+
+
+@event.listens_for(Reagent, "after_update")
+def _timeline_after_update(mapper, connection, target):
+    if inspect(target).attrs.expiry_date.history.has_changes():
+        write_timeline_rows(connection, [(target.id, target.expiry_date)])
+
+
+@event.listens_for(Reagent, "after_delete")
+def _timeline_after_delete(mapper, connection, target):
+    write_timeline_rows(connection, [(target.id, None)])
+
+
+# ---------- 每日滚动 ----------
+
+def rollover_expiry_timeline(db: Session, today: Optional[date] = None) -> Tuple[dict, List[dict]]:
+    """
+    按当天日期重算分桶
+
+    Returns:
+        (摘要, 进入提醒分桶的试剂列表)
+    """
+    today = today or timeline_today()
+    T = ReagentExpiryTimeline
+
+    # 时间线上线前已存在的试剂（以及绕过 ORM 事件写入的试剂）没有对应行，
+    # 每次滚动先按反连接补齐，补建的行直接按当天分桶
+    backfilled = backfill_expiry_timeline(db, today)
+
+    new_bucket = _bucket_case(today)
+    changed = db.query(T.reagent_id, T.expiry_day, T.bucket, new_bucket.label("new_bucket")).filter(
+        T.bucket != new_bucket
+    ).all()
+
+    if changed:
+        db.query(T).filter(T.bucket != new_bucket).update(
+            {T.bucket: new_bucket, T.as_of: today}, synchronize_session=False
+        )
+    db.query(T).filter(T.as_of != today).update({T.as_of: today}, synchronize_session=False)
+    db.commit()
+
+    transitions = [
+        {"reagent_id": row.reagent_id, "expiry_day": row.expiry_day, "from": row.bucket, "to": row.new_bucket}
+        for row in changed
+        if row.new_bucket in NOTIFY_BUCKETS and BUCKET_RANK[row.new_bucket] > BUCKET_RANK[row.bucket]
+    ]
+    summary = {"mode": "rollover", "backfilled": backfilled, "changed": len(changed), "notify": len(transitions)}
+    return summary, transitions
+
+
+def _run_rollover() -> Tuple[dict, List[dict]]:
+    db = SessionLocal()
+    try:
+        return rollover_expiry_timeline(db)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def run_expiry_rollover() -> dict:
+    """调度器入口：滚动分桶后为有库存且新进入提醒窗口的试剂发送提醒"""
+    from notification_routes import NotificationTriggers
+
+    summary, transitions = await asyncio.to_thread(_run_rollover)
+    if transitions:
+        db = SessionLocal()
+        try:
+            expiry_by_id = {t["reagent_id"]: t["expiry_day"] for t in transitions}
+            reagents = db.query(Reagent.id, Reagent.name).filter(
+                Reagent.id.in_(list(expiry_by_id)),
+                Reagent.quantity > 0
+            ).all()
+            today = timeline_today()
+            for reagent in reagents:
+                expiry_day = expiry_by_id[reagent.id]
+                await NotificationTriggers.trigger_reagent_expiring(
+                    db, reagent.name, expiry_day.isoformat(), (expiry_day - today).days
+                )
+            summary["notified"] = len(reagents)
+        finally:
+            db.close()
+    logger.info(f"试剂过期时间线滚动完成: {summary}")
+    return summary
+
+
+# ---------- 查询 ----------
+
+def expiring_reagents_query(db: Session, days: int, today: Optional[date] = None) -> Query:
+    """expiry <= 今天 + days 的试剂（含已过期），常用天数直接按分桶筛选"""
+    T = ReagentExpiryTimeline
+    query = db.query(Reagent).join(T, T.reagent_id == Reagent.id)
+    if days in BUCKETS_WITHIN:
+        query = query.filter(T.bucket.in_(BUCKETS_WITHIN[days]))
+    else:
+        today = today or timeline_today()
+        query = query.filter(T.expiry_day <= today + timedelta(days=days))
+    return query.order_by(T.expiry_day)
+
+
+def expiring_cache_identifier(days: int) -> str:
+    """按天稳定的缓存标识，同一天内的请求共用缓存"""
+    return f"expiring:{days}:{timeline_today().isoformat()}"
+
+
+def get_bucket_counts(db: Session) -> Dict[str, int]:
+    """各分桶的试剂数量（仅统计有库存的试剂）"""
+    T = ReagentExpiryTimeline
+    rows = db.query(T.bucket, func.count(T.reagent_id)).join(
+        Reagent, Reagent.id == T.reagent_id
+    ).filter(Reagent.quantity > 0).group_by(T.bucket).all()
+    counts = {bucket: 0 for bucket in BUCKET_RANK}
+    counts.update({bucket: count for bucket, count in rows})
+    return counts
@@ -4,7 +4,7 @@ import redis
 import json
 import pickle
 import logging
-from typing import Any, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 from datetime import datetime, timedelta
 from functools import wraps
 import os
@@ -54,6 +54,9 @@ class RedisCache:
     
     def _deserialize(self, data: bytes) -> Any:
         """反序列化数据"""
+        # 连接开启了 decode_responses 时返回的是字符串
+        if isinstance(data, str):
+            return json.loads(data)
         try:
             # 尝试JSON反序列化
             return json.loads(data.decode('utf-8'))
@@ -149,6 +152,73 @@ class RedisCache:
             logger.error(f"Failed to delete keys with pattern {pattern}: {e}")
             return 0
     
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """批量获取缓存（MGET）
+        
+        Args:
+            keys: 缓存键列表
+        
+        Returns:
+            dict: 命中的键及其值，未命中的键不包含在内
+        """
+        if not self.is_connected or not keys:
+            return {}
+        
+        try:
+            values = self.redis_client.mget(keys)
+            return {
+                key: self._deserialize(value)
+                for key, value in zip(keys, values)
+                if value is not None
+            }
+        except Exception as e:
+            logger.error(f"Failed to get {len(keys)} cache keys: {e}")
+            return {}
+    
+    def set_many(self, mapping: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+        """批量设置缓存（单次管道往返）
+        
+        Args:
+            mapping: 缓存键到值的映射
+            ttl: 过期时间（秒）
+        
+        Returns:
+            bool: 是否设置成功
+        """
+        if not self.is_connected or not mapping:
+            return False
+        
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, value in mapping.items():
+                if ttl:
+                    pipe.setex(key, ttl, self._serialize(value))
+                else:
+                    pipe.set(key, self._serialize(value))
+            pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to set {len(mapping)} cache keys: {e}")
+            return False
+    
+    def delete_many(self, keys: List[str]) -> int:
+        """批量删除缓存
+        
+        Args:
+            keys: 缓存键列表
+        
+        Returns:
+            int: 删除的键数量
+        """
+        if not self.is_connected or not keys:
+            return 0
+        
+        try:
+            return self.redis_client.delete(*keys)
+        except Exception as e:
+            logger.error(f"Failed to delete {len(keys)} cache keys: {e}")
+            return 0
+    
     def exists(self, key: str) -> bool:
         """检查键是否存在
         
@@ -0,0 +1,134 @@
+# backend/reservation_locks.py
+
+"""
+设备预约锁
+
+预约的冲突检查和写入必须在同一把设备锁内完成：进程内按设备ID
+分条（striping）使用线程锁，多 worker 部署时再叠加一把按设备ID
+命名的 Redis 锁。不同设备的预约互不阻塞，同一设备的预约串行执行。
+锁等待时间按来源统计，便于观察争用情况。
+"""
+
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict
+
+from redis_cache import redis_cache
+
+logger = logging.getLogger(__name__)
+
+# 进程内锁条数
+LOCK_STRIPES = 64
+
+# Redis 锁自动过期时间（秒），防止进程崩溃后锁不释放
+REDIS_LOCK_TIMEOUT = 10
+
+# 获取锁的最长等待时间（秒）
+LOCK_WAIT_TIMEOUT = 5
+
+REDIS_LOCK_PREFIX = "locks:device_reservation:"
+
+
+class LockTimeout(Exception):
+    """在等待时间内未能获取设备锁"""
+
+
+class LockWaitStats:
+    """锁等待时间统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, kind: str, wait: float, timed_out: bool = False):
+        with self._lock:
+            entry = self._stats.setdefault(kind, {
+                "acquired": 0, "timeouts": 0, "total_wait": 0.0, "max_wait": 0.0,
+            })
+            if timed_out:
+                entry["timeouts"] += 1
+            else:
+                entry["acquired"] += 1
+                entry["total_wait"] += wait
+                entry["max_wait"] = max(entry["max_wait"], wait)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            result = {}
+            for kind, entry in self._stats.items():
+                acquired = entry["acquired"]
+                result[kind] = {
+                    "acquired": acquired,
+                    "timeouts": entry["timeouts"],
+                    "avg_wait_ms": round(entry["total_wait"] / acquired * 1000, 3) if acquired else 0.0,
+                    "max_wait_ms": round(entry["max_wait"] * 1000, 3),
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class DeviceLockManager:
+    """按设备加锁（进程内分条线程锁 + 跨进程 Redis 锁）"""
+
+    def __init__(self, stripes: int = LOCK_STRIPES, cache=None):
+        self.stripes = stripes
+        self.cache = cache or redis_cache
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self.stats = LockWaitStats()
+
+    @contextmanager
+    def device_lock(self, device_id: int, wait_timeout: float = LOCK_WAIT_TIMEOUT):
+        """
+        持有指定设备的预约锁
+
+        Raises:
+            LockTimeout: 等待超时
+        """
+        started = time.perf_counter()
+        local = self._locks[device_id % self.stripes]
+        if not local.acquire(timeout=wait_timeout):
+            self.stats.record("local", time.perf_counter() - started, timed_out=True)
+            raise LockTimeout(f"设备 {device_id} 正在被其他预约占用")
+        local_acquired = time.perf_counter()
+        self.stats.record("local", local_acquired - started)
+
+        remote = None
+        try:
+            if self.cache.is_connected:
+                remote = self.cache.redis_client.lock(
+                    f"{REDIS_LOCK_PREFIX}{device_id}",
+                    timeout=REDIS_LOCK_TIMEOUT,
+                    blocking_timeout=max(wait_timeout - (local_acquired - started), 0.01),
+                )
+                try:
+                    acquired = remote.acquire()
+                except Exception as e:
+                    # Redis 故障时退化为仅进程内加锁，数据库约束兜底
+                    logger.warning(f"获取设备 {device_id} 的 Redis 锁失败: {e}")
+                    remote, acquired = None, True
+                if not acquired:
+                    remote = None
+                    self.stats.record("redis", time.perf_counter() - local_acquired, timed_out=True)
+                    raise LockTimeout(f"设备 {device_id} 正在被其他预约占用")
+                if remote is not None:
+                    self.stats.record("redis", time.perf_counter() - local_acquired)
+
+            self.stats.record("total", time.perf_counter() - started)
+            yield
+        finally:
+            if remote is not None:
+                try:
+                    remote.release()
+                except Exception as e:
+                    # 持锁时间超过自动过期时间时锁可能已被释放
+                    logger.warning(f"释放设备 {device_id} 的 Redis 锁失败: {e}")
+            local.release()
+
+
+# 全局设备锁管理器
+device_locks = DeviceLockManager()
@@ -6,5 +6,6 @@ from . import reagents
 from . import consumables
 from . import approvals
 from . import usage_records
+from . import inventory
 
-__all__ = ["auth", "users", "records", "reagents", "consumables", "approvals", "usage_records"]
\ No newline at end of file
+__all__ = ["auth", "users", "records", "reagents", "consumables", "approvals", "usage_records", "inventory"]
\ No newline at end of file
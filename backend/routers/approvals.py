@@ -1,14 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List, Optional
-from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
 from enum import Enum
 
 from backend.database import get_db
-from backend.models import User, Request
+from backend.models import User, Request, UsageRecord
 from backend.auth import get_current_user
 from backend.permissions import require_permission, Permissions
-from pydantic import BaseModel
+from backend.lot_allocation import allocate_fefo_batch, AllocationDemand, LotNotFound, InsufficientStock
+from backend.cache_config import CacheType, invalidate_related_cache
+from backend.approval_events import (
+    EVENT_CREATED, EVENT_DECIDED, decode_cursor, encode_cursor, publish_request_events, request_payload
+)
+from pydantic import BaseModel, Field
 
 # 创建路由器
 router = APIRouter(prefix="/api/approvals", tags=["approvals"])
@@ -24,6 +30,16 @@ class RequestType(str, Enum):
     REAGENT = "reagent"
     CONSUMABLE = "consumable"
 
+# 每页最大条数
+MAX_PAGE_SIZE = 200
+
+# 单次批量审批的最大申请数
+MAX_BATCH_SIZE = 500
+
+# 增量同步只返回更新时间早于该秒数之前的变更，等待进行中的事务提交，
+# 避免较早时间戳的变更晚于游标提交而被跳过（实时变更由 WebSocket 推送）
+CHANGES_SETTLE_SECONDS = 2
+
 # Pydantic模型
 class ApprovalRequest(BaseModel):
     request_id: int
@@ -49,35 +65,193 @@ class ApprovalResponse(BaseModel):
     status: RequestStatus
     approved_by: str
     approved_at: datetime
+    allocations: Optional[List[dict]] = None  # 按批次的扣减明细（仅批准时）
+
+class ApprovalPage(BaseModel):
+    items: List[ApprovalRequest]
+    next_cursor: Optional[int] = None  # 下一页的游标（本页最后一条申请ID），没有更多时为空
+    has_more: bool
+
+class BatchApprovalAction(BaseModel):
+    request_ids: List[int] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+    action: str  # "approve" or "reject"
+    notes: Optional[str] = None
+
+class BatchApprovalOutcome(BaseModel):
+    request_id: int
+    success: bool
+    status: Optional[RequestStatus] = None
+    message: str
+    allocations: Optional[List[dict]] = None
+
+class BatchApprovalResponse(BaseModel):
+    message: str
+    processed_count: int
+    failed_count: int
+    results: List[BatchApprovalOutcome]
+
+class ApprovalCounts(BaseModel):
+    pending: int
+    approved: int
+    rejected: int
+    total: int
+
+def _to_approval_request(req: Request) -> ApprovalRequest:
+    return ApprovalRequest(
+        request_id=req.id,
+        request_type=RequestType(req.request_type),
+        item_id=req.item_id,
+        item_name=req.item_name,
+        quantity=req.quantity,
+        unit=req.unit,
+        purpose=req.purpose,
+        notes=req.notes,
+        requester_id=req.requester_id,
+        requester_name=req.requester.username if req.requester else "",
+        created_at=req.created_at,
+        status=RequestStatus(req.status)
+    )
+
+def _filter_requests(query, request_type: Optional[RequestType], requester_id: Optional[int],
+                     date_from: Optional[datetime], date_to: Optional[datetime]):
+    """按类型、申请人和申请时间过滤"""
+    if request_type:
+        query = query.filter(Request.request_type == request_type.value)
+    if requester_id is not None:
+        query = query.filter(Request.requester_id == requester_id)
+    if date_from:
+        query = query.filter(Request.created_at >= date_from)
+    if date_to:
+        query = query.filter(Request.created_at <= date_to)
+    return query
+
+def _keyset_page(query, cursor: Optional[int], limit: int, descending: bool) -> ApprovalPage:
+    """
+    按申请ID做游标分页：只取游标之后的 limit + 1 条，多取的一条用于判断是否还有下一页。
+    申请人一并 JOIN 加载，避免逐行查询用户。
+    """
+    if cursor is not None:
+        query = query.filter(Request.id < cursor if descending else Request.id > cursor)
+    order = Request.id.desc() if descending else Request.id.asc()
+    rows = query.options(joinedload(Request.requester)).order_by(order).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return ApprovalPage(
+        items=[_to_approval_request(req) for req in rows],
+        next_cursor=rows[-1].id if has_more else None,
+        has_more=has_more
+    )
 
 # 使用数据库存储申请数据
 
-@router.get("/", response_model=List[ApprovalRequest])
+@router.get("/", response_model=ApprovalPage)
 @require_permission(Permissions.REQUEST_APPROVE)
-def get_pending_requests(db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    """获取待审批的申请列表"""
-    # 从数据库查询所有待审批的申请
-    pending_requests = db.query(Request).filter(Request.status == RequestStatus.PENDING).all()
-    
-    # 转换为响应模型格式
-    result = []
-    for req in pending_requests:
-        result.append(ApprovalRequest(
-            request_id=req.id,
-            request_type=RequestType(req.request_type),
-            item_id=req.item_id,
-            item_name=req.item_name,
-            quantity=req.quantity,
-            unit=req.unit,
-            purpose=req.purpose,
-            notes=req.notes,
-            requester_id=req.requester_id,
-            requester_name=req.requester.username,
-            created_at=req.created_at,
-            status=RequestStatus(req.status)
-        ))
+def get_pending_requests(
+    cursor: Optional[int] = Query(None, description="上一页返回的 next_cursor"),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    request_type: Optional[RequestType] = None,
+    requester_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """获取待审批的申请列表（按申请先后排列，游标分页）"""
+    query = db.query(Request).filter(Request.status == RequestStatus.PENDING.value)
+    query = _filter_requests(query, request_type, requester_id, date_from, date_to)
+    return _keyset_page(query, cursor, limit, descending=False)
+
+@router.get("/counts", response_model=ApprovalCounts)
+@require_permission(Permissions.REQUEST_APPROVE)
+def get_request_counts(
+    request_type: Optional[RequestType] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """各状态的申请数量（审批标签页角标），一条 GROUP BY 查询"""
+    query = db.query(Request.status, func.count(Request.id))
+    if request_type:
+        query = query.filter(Request.request_type == request_type.value)
+    counts: Dict[str, int] = dict(query.group_by(Request.status).all())
+    return ApprovalCounts(
+        pending=counts.get(RequestStatus.PENDING.value, 0),
+        approved=counts.get(RequestStatus.APPROVED.value, 0),
+        rejected=counts.get(RequestStatus.REJECTED.value, 0),
+        total=sum(counts.values())
+    )
+
+@router.get("/history/", response_model=ApprovalPage)
+@require_permission(Permissions.REQUEST_APPROVE)
+def get_approval_history(
+    cursor: Optional[int] = Query(None, description="上一页返回的 next_cursor"),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    status: Optional[RequestStatus] = None,
+    request_type: Optional[RequestType] = None,
+    requester_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """获取审批历史记录（最新在前，游标分页）"""
+    if status == RequestStatus.PENDING:
+        raise HTTPException(status_code=400, detail="审批历史不包含待审批的申请")
+    if status:
+        query = db.query(Request).filter(Request.status == status.value)
+    else:
+        query = db.query(Request).filter(Request.status != RequestStatus.PENDING.value)
+    query = _filter_requests(query, request_type, requester_id, date_from, date_to)
+    return _keyset_page(query, cursor, limit, descending=True)
+
+@router.get("/changes", response_model=dict)
+@require_permission(Permissions.REQUEST_APPROVE)
+def get_request_changes(
+    since: Optional[str] = Query(None, description="上次同步返回的 cursor；为空时从最早的变更开始"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    增量同步：返回游标之后创建或更新的申请（任意状态），按 (更新时间, ID) 排序
+
+    客户端按 request_id 更新本地列表，用返回的 cursor 继续同步，
+    has_more 为真时立即再次请求。WebSocket 推送不带游标，重连后从
+    最后一次同步返回的 cursor 继续。
+    """
+    query = db.query(Request).options(joinedload(Request.requester)).filter(
+        Request.updated_at <= datetime.utcnow() - timedelta(seconds=CHANGES_SETTLE_SECONDS)
+    )
+    if since:
+        try:
+            since_at, since_id = decode_cursor(since)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="无效的同步游标")
+        query = query.filter(
+            (Request.updated_at > since_at) | ((Request.updated_at == since_at) & (Request.id > since_id))
+        )
+    rows = query.order_by(Request.updated_at, Request.id).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "requests": [request_payload(req) for req in rows],
+        "cursor": encode_cursor(rows[-1].updated_at, rows[-1].id) if rows else since,
+        "has_more": has_more
+    }
+
+# 获取当前用户的申请记录
+@router.get("/my-requests", response_model=List[ApprovalRequest])
+def get_my_requests(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """获取当前用户的所有申请记录"""
+    requests = db.query(Request).filter(
+        Request.requester_id == current_user.id
+    ).order_by(Request.created_at.desc()).all()
     
-    return result
+    return [_to_approval_request(req) for req in requests]
 
 @router.get("/{request_id}", response_model=ApprovalRequest)
 @require_permission(Permissions.REQUEST_APPROVE)
@@ -87,27 +261,22 @@ def get_request_detail(request_id: int, db: Session = Depends(get_db), current_u
     if not request:
         raise HTTPException(status_code=404, detail="申请不存在")
     
-    return ApprovalRequest(
-        request_id=request.id,
-        request_type=RequestType(request.request_type),
-        item_id=request.item_id,
-        item_name=request.item_name,
-        quantity=request.quantity,
-        unit=request.unit,
-        purpose=request.purpose,
-        notes=request.notes,
-        requester_id=request.requester_id,
-        requester_name=request.requester.username,
-        created_at=request.created_at,
-        status=RequestStatus(request.status)
-    )
+    return _to_approval_request(request)
 
 @router.post("/{request_id}/approve", response_model=ApprovalResponse)
 @require_permission(Permissions.REQUEST_APPROVE)
-def approve_request(request_id: int, action: ApprovalAction, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    """审批申请（批准或拒绝）"""
+def approve_request(request_id: int, action: ApprovalAction, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    审批申请（批准或拒绝）
+
+    与批量审批使用同一加锁顺序：先锁申请行，批准时再由 allocate_fefo_batch
+    按ID升序锁定库存批次，单条审批与批量审批并发时不会形成循环等待。
+    """
     # 查找申请
-    request = db.query(Request).filter(Request.id == request_id).first()
+    query = db.query(Request).filter(Request.id == request_id)
+    if db.get_bind().dialect.name == "postgresql":
+        query = query.with_for_update(of=Request)
+    request = query.first()
     if not request:
         raise HTTPException(status_code=404, detail="申请不存在")
     
@@ -116,48 +285,34 @@ def approve_request(request_id: int, action: ApprovalAction, db: Session = Depen
         raise HTTPException(status_code=400, detail="申请已经被处理")
     
     # 更新申请状态
+    allocations = None
     if action.action == "approve":
-        # 批准前进行库存检查和扣减
+        # 批准前按先过期先出从同一产品的各批次分配并扣减库存
         try:
             # 导入模型
-            from backend.models import Reagent, Consumable, UsageRecord
-            
-            # 根据申请类型检查库存
-            if request.request_type == RequestType.REAGENT:
-                item = db.query(Reagent).filter(Reagent.id == request.item_id).first()
-                if not item:
-                    raise HTTPException(status_code=404, detail="试剂不存在")
-                
-                # 检查库存是否充足
-                if item.quantity < request.quantity:
-                    raise HTTPException(
-                        status_code=400, 
-                        detail=f"库存不足。当前库存：{item.quantity} {item.unit}，申请数量：{request.quantity} {request.unit}"
-                    )
-                
-                # 扣减库存
-                item.quantity -= request.quantity
-                item.updated_at = datetime.utcnow()
-                
-            elif request.request_type == RequestType.CONSUMABLE:
-                item = db.query(Consumable).filter(Consumable.id == request.item_id).first()
-                if not item:
-                    raise HTTPException(status_code=404, detail="耗材不存在")
-                
-                # 检查库存是否充足
-                if item.quantity < request.quantity:
-                    raise HTTPException(
-                        status_code=400, 
-                        detail=f"库存不足。当前库存：{item.quantity} {item.unit}，申请数量：{request.quantity} {request.unit}"
-                    )
-                
-                # 扣减库存
-                item.quantity -= request.quantity
-                item.updated_at = datetime.utcnow()
+            from backend.models import UsageRecord
             
-            else:
+            if request.request_type not in (RequestType.REAGENT, RequestType.CONSUMABLE):
                 raise HTTPException(status_code=400, detail="不支持的申请类型")
             
+            allocation = allocate_fefo_batch(
+                db,
+                [AllocationDemand(request.id, request.request_type, request.item_id, request.quantity)],
+                user_id=current_user.id
+            )[request.id]
+            if isinstance(allocation, LotNotFound):
+                db.rollback()
+                raise HTTPException(
+                    status_code=404,
+                    detail="试剂不存在" if request.request_type == RequestType.REAGENT else "耗材不存在"
+                )
+            if isinstance(allocation, InsufficientStock):
+                db.rollback()
+                raise HTTPException(status_code=400, detail=str(allocation))
+            
+            allocations = [a.to_dict() for a in allocation.allocations]
+            allocation_notes = allocation.describe()
+            
             # 创建使用记录
             usage_record = UsageRecord(
                 request_id=request.id,
@@ -167,9 +322,9 @@ def approve_request(request_id: int, action: ApprovalAction, db: Session = Depen
                 quantity_used=request.quantity,
                 unit=request.unit,
                 user_id=request.requester_id,
-                approved_by_id=current_user["id"],
+                approved_by_id=current_user.id,
                 purpose=request.purpose,
-                notes=action.notes,
+                notes=f"{action.notes}\n{allocation_notes}" if action.notes else allocation_notes,
                 used_at=datetime.utcnow(),
                 created_at=datetime.utcnow()
             )
@@ -177,7 +332,7 @@ def approve_request(request_id: int, action: ApprovalAction, db: Session = Depen
             db.add(usage_record)
             
             new_status = RequestStatus.APPROVED
-            message = f"申请已批准，库存已扣减。剩余库存：{item.quantity} {item.unit}"
+            message = f"申请已批准，库存已扣减。剩余库存：{allocation.remaining_stock} {allocation.unit or ''}"
             
         except HTTPException:
             # 重新抛出HTTP异常
@@ -195,10 +350,11 @@ def approve_request(request_id: int, action: ApprovalAction, db: Session = Depen
     
     # 更新申请记录
     request.status = new_status
-    request.approved_by_id = current_user["id"]
+    request.approved_by_id = current_user.id
     request.approved_at = datetime.utcnow()
     request.approval_notes = action.notes
     request.updated_at = datetime.utcnow()
+    payload = request_payload(request)
     
     try:
         db.commit()
@@ -206,70 +362,145 @@ def approve_request(request_id: int, action: ApprovalAction, db: Session = Depen
         db.rollback()
         raise HTTPException(status_code=500, detail=f"保存数据时发生错误：{str(e)}")
     
+    publish_request_events(db, EVENT_DECIDED, [payload])
+    
+    if allocations:
+        invalidate_related_cache(
+            CacheType.REAGENTS if request.request_type == RequestType.REAGENT else CacheType.CONSUMABLES
+        )
+    
     return ApprovalResponse(
         message=message,
         request_id=request_id,
         status=new_status,
-        approved_by=current_user["username"],
-        approved_at=datetime.utcnow()
+        approved_by=current_user.username,
+        approved_at=datetime.utcnow(),
+        allocations=allocations
     )
 
-@router.get("/history/", response_model=List[ApprovalRequest])
+@router.post("/batch", response_model=BatchApprovalResponse)
 @require_permission(Permissions.REQUEST_APPROVE)
-def get_approval_history(db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    """获取审批历史记录"""
-    # 从数据库查询所有已处理的申请
-    processed_requests = db.query(Request).filter(Request.status != RequestStatus.PENDING).all()
-    
-    # 转换为响应模型格式
-    result = []
-    for req in processed_requests:
-        result.append(ApprovalRequest(
-            request_id=req.id,
-            request_type=RequestType(req.request_type),
-            item_id=req.item_id,
-            item_name=req.item_name,
-            quantity=req.quantity,
-            unit=req.unit,
-            purpose=req.purpose,
-            notes=req.notes,
-            requester_id=req.requester_id,
-            requester_name=req.requester.username,
-            created_at=req.created_at,
-            status=RequestStatus(req.status)
-        ))
-    
-    return result
-
-# 获取当前用户的申请记录
-@router.get("/my-requests", response_model=List[ApprovalRequest])
-def get_my_requests(
+def batch_approve_requests(
+    batch: BatchApprovalAction,
     db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user)
+    current_user: User = Depends(get_current_user)
 ):
-    """获取当前用户的所有申请记录"""
-    requests = db.query(Request).filter(
-        Request.requester_id == current_user["id"]
-    ).order_by(Request.created_at.desc()).all()
-    
-    result = []
-    for req in requests:
-        result.append(ApprovalRequest(
-            request_id=req.id,
-            request_type=RequestType(req.request_type),
-            item_id=req.item_id,
-            item_name=req.item_name,
-            quantity=req.quantity,
-            unit=req.unit,
-            purpose=req.purpose,
-            notes=req.notes,
-            requester_id=req.requester_id,
-            requester_name=current_user["username"],
-            created_at=req.created_at,
-            status=RequestStatus(req.status)
-        ))
-    
-    return result
+    """
+    批量审批（批准或拒绝），整批一个事务，逐条返回结果
+
+    申请按ID升序加锁读取；批准时所有涉及的库存批次按固定顺序一次性锁定
+    后在内存中分配，库存扣减、使用记录和申请状态批量写入。库存不足或
+    已被处理的申请单独返回失败，不影响同批其他申请。
+    """
+    if batch.action not in ("approve", "reject"):
+        raise HTTPException(status_code=400, detail="无效的操作")
+
+    request_ids = sorted(set(batch.request_ids))
+    query = db.query(Request).options(joinedload(Request.requester)).filter(
+        Request.id.in_(request_ids)
+    ).order_by(Request.id)
+    if db.get_bind().dialect.name == "postgresql":
+        query = query.with_for_update(of=Request)
+    requests = {req.id: req for req in query.all()}
+
+    outcomes: Dict[int, BatchApprovalOutcome] = {}
+    decided: List[Request] = []
+    for request_id in request_ids:
+        req = requests.get(request_id)
+        if req is None:
+            outcomes[request_id] = BatchApprovalOutcome(request_id=request_id, success=False, message="申请不存在")
+        elif req.status != RequestStatus.PENDING.value:
+            outcomes[request_id] = BatchApprovalOutcome(
+                request_id=request_id, success=False, status=RequestStatus(req.status), message="申请已经被处理"
+            )
+        elif req.request_type not in (RequestType.REAGENT.value, RequestType.CONSUMABLE.value):
+            outcomes[request_id] = BatchApprovalOutcome(request_id=request_id, success=False, message="不支持的申请类型")
+        else:
+            decided.append(req)
+
+    now = datetime.utcnow()
+    touched_types = set()
+    try:
+        if batch.action == "approve":
+            allocations = allocate_fefo_batch(
+                db,
+                [AllocationDemand(req.id, req.request_type, req.item_id, req.quantity) for req in decided],
+                user_id=current_user.id
+            )
+            approved = []
+            usage_records = []
+            for req in decided:
+                result = allocations[req.id]
+                if isinstance(result, LotNotFound):
+                    outcomes[req.id] = BatchApprovalOutcome(
+                        request_id=req.id, success=False,
+                        message="试剂不存在" if req.request_type == RequestType.REAGENT.value else "耗材不存在"
+                    )
+                    continue
+                if isinstance(result, InsufficientStock):
+                    outcomes[req.id] = BatchApprovalOutcome(request_id=req.id, success=False, message=str(result))
+                    continue
+
+                allocation_notes = result.describe()
+                usage_records.append(UsageRecord(
+                    request_id=req.id,
+                    item_type=req.request_type.lower(),
+                    item_id=req.item_id,
+                    item_name=req.item_name,
+                    quantity_used=req.quantity,
+                    unit=req.unit,
+                    user_id=req.requester_id,
+                    approved_by_id=current_user.id,
+                    purpose=req.purpose,
+                    notes=f"{batch.notes}\n{allocation_notes}" if batch.notes else allocation_notes,
+                    used_at=now,
+                    created_at=now
+                ))
+                approved.append(req)
+                touched_types.add(req.request_type)
+                outcomes[req.id] = BatchApprovalOutcome(
+                    request_id=req.id,
+                    success=True,
+                    status=RequestStatus.APPROVED,
+                    message=f"申请已批准。剩余库存：{result.remaining_stock} {result.unit or ''}",
+                    allocations=[a.to_dict() for a in result.allocations]
+                )
+            db.add_all(usage_records)
+            decided, new_status = approved, RequestStatus.APPROVED
+        else:
+            for req in decided:
+                outcomes[req.id] = BatchApprovalOutcome(
+                    request_id=req.id, success=True, status=RequestStatus.REJECTED, message="申请已拒绝"
+                )
+            new_status = RequestStatus.REJECTED
+
+        # 同列的 UPDATE 在 flush 时合并为 executemany
+        for req in decided:
+            req.status = new_status.value
+            req.approved_by_id = current_user.id
+            req.approved_at = now
+            req.approval_notes = batch.notes
+            req.updated_at = now
+        payloads = [request_payload(req) for req in decided]
+
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"批量审批时发生错误：{str(e)}")
+
+    publish_request_events(db, EVENT_DECIDED, payloads)
+
+    for request_type in touched_types:
+        invalidate_related_cache(CacheType.REAGENTS if request_type == RequestType.REAGENT.value else CacheType.CONSUMABLES)
+
+    results = [outcomes[request_id] for request_id in request_ids]
+    processed = sum(1 for outcome in results if outcome.success)
+    return BatchApprovalResponse(
+        message=f"已处理 {processed} 条申请" + (f"，{len(results) - processed} 条失败" if processed < len(results) else ""),
+        processed_count=processed,
+        failed_count=len(results) - processed,
+        results=results
+    )
 
 # 内部函数：添加新申请到数据库（由其他模块调用）
 def add_request(request_type: RequestType, item_id: int, item_name: str, quantity: float, unit: str, purpose: str, requester_id: int, requester_name: str, notes: str = None):
@@ -295,6 +526,8 @@ def add_request(request_type: RequestType, item_id: int, item_name: str, quantit
         db.commit()
         db.refresh(new_request)
         
+        publish_request_events(db, EVENT_CREATED, [request_payload(new_request)])
+        
         return new_request.id
     finally:
         db.close()
\ No newline at end of file
@@ -0,0 +1,80 @@
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from datetime import date, datetime, timedelta
+from pydantic import BaseModel
+
+from backend.database import get_db
+from backend.models import User
+from backend.auth import require_admin
+from backend.data_archive import SOURCES, history_query, list_partitions, run_archive_job
+
+# 创建路由器
+router = APIRouter(prefix="/api/archive", tags=["archive"])
+
+# 历史查询单次返回的最大行数
+MAX_HISTORY_LIMIT = 1000
+
+# Pydantic模型
+class ArchivePartitionResponse(BaseModel):
+    table_name: str
+    source_table: str
+    month: date
+    row_count: int
+    min_time: Optional[datetime]
+    max_time: Optional[datetime]
+    updated_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+def _check_source(source: str):
+    if source not in SOURCES:
+        raise HTTPException(status_code=404, detail=f"不支持归档的数据表: {source}")
+
+@router.get("/partitions", response_model=List[ArchivePartitionResponse])
+def get_partitions(
+    source: Optional[str] = Query(None, description="源表名：usage_records / notifications / device_reservations"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_admin)
+):
+    """归档分区目录"""
+    if source:
+        _check_source(source)
+    return list_partitions(db, source)
+
+@router.post("/run", response_model=dict)
+def run_archive(
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(require_admin)
+):
+    """后台立即执行一次归档"""
+    background_tasks.add_task(run_archive_job)
+    return {"message": "归档任务已提交"}
+
+@router.get("/{source}/history", response_model=List[dict])
+def get_history(
+    source: str,
+    start_date: Optional[date] = Query(None, description="开始日期（含）"),
+    end_date: Optional[date] = Query(None, description="结束日期（含）"),
+    user_id: Optional[int] = Query(None, description="过滤用户ID"),
+    limit: int = Query(100, ge=1, le=MAX_HISTORY_LIMIT),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_admin)
+):
+    """历史记录查询：热表与归档分区合并后按时间倒序返回"""
+    _check_source(source)
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="开始日期不能晚于结束日期")
+
+    start = datetime.combine(start_date, datetime.min.time()) if start_date else None
+    end = datetime.combine(end_date + timedelta(days=1), datetime.min.time()) if end_date else None
+    history = history_query(db, source, start, end)
+    time_column = history.c[SOURCES[source].time_column]
+
+    stmt = select(history)
+    if user_id is not None:
+        stmt = stmt.where(history.c.user_id == user_id)
+    stmt = stmt.order_by(time_column.desc(), history.c.id.desc()).limit(limit)
+    return [dict(row._mapping) for row in db.execute(stmt)]
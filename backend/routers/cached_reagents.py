@@ -1,6 +1,7 @@
 # backend/routers/cached_reagents.py
 
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import delete, update
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime
@@ -12,6 +13,12 @@ from backend.models import Reagent, User
 from backend.auth import get_current_user, require_admin
 from backend.permissions import require_permission, Permissions
 from pydantic import BaseModel
+from backend.reagent_expiry import expiring_reagents_query, expiring_cache_identifier, refresh_expiry_timeline
+from backend.low_stock import low_stock_query, refresh_low_stock
+from backend.reagent_autocomplete import reagent_autocomplete
+from backend.inventory_ledger import (
+    ITEM_REAGENT, REASON_BATCH_UPDATE, REASON_DELETE, movement_row, record_movements
+)
 from backend.redis_cache import redis_cache, cache_result, invalidate_cache_pattern
 from backend.redis_config import redis_config
 from backend.cache_config import CacheType, CacheConfig, invalidate_related_cache, cache_key_for_list, cache_key_for_item
@@ -384,37 +391,32 @@ def get_expiring_reagents(
     current_user: dict = Depends(get_current_user)
 ):
     """获取即将过期的试剂（带缓存）"""
-    cache_key = CacheConfig.get_cache_key(CacheType.REAGENTS, f"expiring:{days}")
+    # 缓存键按天稳定，试剂写入时随 reagents:* 一起失效
+    cache_key = CacheConfig.get_cache_key(CacheType.REAGENTS, expiring_cache_identifier(days))
     
     # 尝试从缓存获取
     cached_result = redis_cache.get(cache_key)
     if cached_result:
         return _deserialize_reagents(cached_result)
     
-    # 从数据库查询
-    from datetime import timedelta
-    
-    expiry_threshold = datetime.utcnow() + timedelta(days=days)
-    reagents = db.query(Reagent).filter(
-        Reagent.expiry_date.isnot(None),
-        Reagent.expiry_date <= expiry_threshold
-    ).all()
+    # 从过期时间线分桶查询
+    reagents = expiring_reagents_query(db, days).all()
     
     # 序列化并缓存
     serialized_reagents = _serialize_reagents(reagents)
-    ttl = CacheConfig.get_ttl(CacheType.REAGENTS) // 2  # 过期数据缓存时间较短
+    ttl = CacheConfig.get_ttl(CacheType.REAGENTS)
     redis_cache.set(cache_key, serialized_reagents, ttl)
     
     return reagents
 
 @router.get("/low-stock/list", response_model=List[ReagentResponse])
 def get_low_stock_reagents(
-    threshold: float = 10.0,
+    threshold: Optional[float] = None,
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """获取库存不足的试剂（带缓存）"""
-    cache_key = CacheConfig.get_cache_key(CacheType.REAGENTS, f"low_stock:{threshold}")
+    """获取库存不足的试剂（带缓存）；不指定 threshold 时按各试剂自身的最小库存阈值判断"""
+    cache_key = CacheConfig.get_cache_key(CacheType.REAGENTS, f"low_stock:{threshold if threshold is not None else 'own'}")
     
     # 尝试从缓存获取
     cached_result = redis_cache.get(cache_key)
@@ -422,9 +424,12 @@ def get_low_stock_reagents(
         return _deserialize_reagents(cached_result)
     
     # 从数据库查询
-    reagents = db.query(Reagent).filter(
-        Reagent.quantity <= threshold
-    ).all()
+    if threshold is None:
+        reagents = low_stock_query(db, Reagent).all()
+    else:
+        reagents = db.query(Reagent).filter(
+            Reagent.quantity <= threshold
+        ).order_by(Reagent.quantity).all()
     
     # 序列化并缓存
     serialized_reagents = _serialize_reagents(reagents)
@@ -521,6 +526,44 @@ def warmup_reagent_cache(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"缓存预热失败: {str(e)}")
 
+# 批量写入每条语句的ID数量
+BATCH_CHUNK_SIZE = 500
+
+# 批量写入后需要整体失效的聚合缓存（单个试剂的缓存按ID修补或删除）
+REAGENT_VIEW_PATTERNS = [
+    "reagents:list*",
+    "reagents:categories",
+    "reagents:expiring*",
+    "reagents:low_stock*",
+    "stats:reagents:*",
+]
+
+# Reagent 表的列名，批量更新只写入实际存在的列
+REAGENT_COLUMNS = set(Reagent.__table__.columns.keys())
+
+def _unique_ids(ids: List[int]) -> List[int]:
+    return list(dict.fromkeys(ids))
+
+def _invalidate_reagent_views():
+    for pattern in REAGENT_VIEW_PATTERNS:
+        invalidate_cache_pattern(pattern)
+    # 批量语句不触发 ORM 事件，显式让自动补全索引重建
+    reagent_autocomplete.mark_stale()
+
+def _patch_item_caches(reagent_ids: List[int], values: dict):
+    """把批量更新的字段写入已缓存的单个试剂，未缓存的试剂不处理"""
+    keys = [cache_key_for_item(CacheType.REAGENTS, reagent_id) for reagent_id in reagent_ids]
+    patch = {k: v.isoformat() if isinstance(v, datetime) else v for k, v in values.items()}
+    cached = redis_cache.get_many(keys)
+    if cached:
+        redis_cache.set_many(
+            {key: {**item, **patch} for key, item in cached.items()},
+            CacheConfig.get_ttl(CacheType.REAGENTS)
+        )
+
+def _evict_item_caches(reagent_ids: List[int]):
+    redis_cache.delete_many([cache_key_for_item(CacheType.REAGENTS, reagent_id) for reagent_id in reagent_ids])
+
 # 批量删除试剂
 class ReagentBatchDelete(BaseModel):
     reagent_ids: List[int]
@@ -531,42 +574,56 @@ def batch_delete_reagents(
     db: Session = Depends(get_db),
     current_user: User = Depends(require_admin)
 ):
-    """批量删除试剂（仅管理员）"""
+    """批量删除试剂（仅管理员）：按ID分块执行 DELETE ... RETURNING，任一ID不存在则整体回滚"""
     if not delete_request.reagent_ids:
         raise HTTPException(status_code=400, detail="试剂ID列表不能为空")
     
-    # 查找所有要删除的试剂
-    reagents = db.query(Reagent).filter(Reagent.id.in_(delete_request.reagent_ids)).all()
-    found_ids = [reagent.id for reagent in reagents]
-    missing_ids = [reagent_id for reagent_id in delete_request.reagent_ids if reagent_id not in found_ids]
-    
-    if missing_ids:
-        raise HTTPException(
-            status_code=404,
-            detail=f"以下试剂不存在: {missing_ids}"
-        )
+    reagent_ids = _unique_ids(delete_request.reagent_ids)
     
     try:
-        # 删除试剂
-        for reagent in reagents:
-            db.delete(reagent)
-        
-        db.commit()
+        deleted_ids = []
+        movements = []
+        for i in range(0, len(reagent_ids), BATCH_CHUNK_SIZE):
+            chunk = reagent_ids[i:i + BATCH_CHUNK_SIZE]
+            result = db.execute(
+                delete(Reagent).where(Reagent.id.in_(chunk)).returning(Reagent.id, Reagent.quantity),
+                execution_options={"synchronize_session": False}
+            )
+            for reagent_id, quantity in result:
+                deleted_ids.append(reagent_id)
+                if quantity:
+                    movements.append(movement_row(
+                        ITEM_REAGENT, reagent_id, -quantity, 0.0, REASON_DELETE, user_id=current_user.id
+                    ))
         
-        # 清除相关缓存
-        patterns = CacheConfig.get_invalidation_patterns(CacheType.REAGENTS)
-        for pattern in patterns:
-            invalidate_cache_pattern(pattern)
+        missing_ids = sorted(set(reagent_ids) - set(deleted_ids))
+        if missing_ids:
+            db.rollback()
+            raise HTTPException(
+                status_code=404,
+                detail=f"以下试剂不存在: {missing_ids}"
+            )
         
-        return {
-            "message": "批量删除试剂成功",
-            "deleted_count": len(reagents),
-            "deleted_ids": found_ids
-        }
+        # 批量语句不触发 ORM 事件，记录库存流水并同步清理过期时间线
+        record_movements(db, movements)
+        refresh_expiry_timeline(db, deleted_ids)
+        db.commit()
         
+    except HTTPException:
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"批量删除试剂失败: {str(e)}")
+    
+    # 删除这些试剂的单条缓存，聚合缓存整体失效
+    _evict_item_caches(deleted_ids)
+    _invalidate_reagent_views()
+    
+    return {
+        "message": "批量删除试剂成功",
+        "deleted_count": len(deleted_ids),
+        "deleted_ids": deleted_ids
+    }
 
 # 批量更新试剂
 class ReagentBatchUpdate(BaseModel):
@@ -579,48 +636,79 @@ def batch_update_reagents(
     db: Session = Depends(get_db),
     current_user: User = Depends(require_admin)
 ):
-    """批量更新试剂信息（仅管理员）"""
+    """批量更新试剂信息（仅管理员）：按ID分块执行 UPDATE ... RETURNING，任一ID不存在则整体回滚"""
     if not update_request.reagent_ids:
         raise HTTPException(status_code=400, detail="试剂ID列表不能为空")
     
     if not any(update_request.updates.dict().values()):
         raise HTTPException(status_code=400, detail="更新内容不能为空")
     
-    # 查找所有要更新的试剂
-    reagents = db.query(Reagent).filter(Reagent.id.in_(update_request.reagent_ids)).all()
-    found_ids = [reagent.id for reagent in reagents]
-    missing_ids = [reagent_id for reagent_id in update_request.reagent_ids if reagent_id not in found_ids]
+    reagent_ids = _unique_ids(update_request.reagent_ids)
     
-    if missing_ids:
-        raise HTTPException(
-            status_code=404,
-            detail=f"以下试剂不存在: {missing_ids}"
-        )
+    # 未设置或为空的字段不更新；不是试剂表列的字段忽略
+    update_data = update_request.updates.dict(exclude_unset=True)
+    values = {
+        key: value for key, value in update_data.items()
+        if value is not None and key in REAGENT_COLUMNS
+    }
+    if not values:
+        raise HTTPException(status_code=400, detail="更新内容不能为空")
+    updated_fields = list(values.keys())
+    values["updated_at"] = datetime.utcnow()
     
     try:
-        # 更新试剂信息
-        update_data = update_request.updates.dict(exclude_unset=True)
+        updated_ids = []
+        movements = []
+        for i in range(0, len(reagent_ids), BATCH_CHUNK_SIZE):
+            chunk = reagent_ids[i:i + BATCH_CHUNK_SIZE]
+            if "quantity" in values:
+                # 改库存时先锁定并读取旧值，用于记录库存流水
+                previous = db.query(Reagent.id, Reagent.quantity).filter(
+                    Reagent.id.in_(chunk)
+                ).with_for_update().all()
+                movements.extend(
+                    movement_row(
+                        ITEM_REAGENT, reagent_id, values["quantity"] - (quantity or 0.0), values["quantity"],
+                        REASON_BATCH_UPDATE, user_id=current_user.id
+                    )
+                    for reagent_id, quantity in previous
+                    if (quantity or 0.0) != values["quantity"]
+                )
+            result = db.execute(
+                update(Reagent).where(Reagent.id.in_(chunk)).values(**values).returning(Reagent.id),
+                execution_options={"synchronize_session": False}
+            )
+            updated_ids.extend(row[0] for row in result)
         
-        for reagent in reagents:
-            for key, value in update_data.items():
-                if value is not None:
-                    setattr(reagent, key, value)
-            reagent.updated_at = datetime.utcnow()
+        missing_ids = sorted(set(reagent_ids) - set(updated_ids))
+        if missing_ids:
+            db.rollback()
+            raise HTTPException(
+                status_code=404,
+                detail=f"以下试剂不存在: {missing_ids}"
+            )
         
+        # 批量语句不触发 ORM 事件，按需记录库存流水、同步过期时间线和低库存标记
+        record_movements(db, movements)
+        if "expiry_date" in values:
+            refresh_expiry_timeline(db, updated_ids)
+        if "quantity" in values or "min_threshold" in values:
+            refresh_low_stock(db, Reagent, updated_ids)
         db.commit()
         
-        # 清除相关缓存
-        patterns = CacheConfig.get_invalidation_patterns(CacheType.REAGENTS)
-        for pattern in patterns:
-            invalidate_cache_pattern(pattern)
-        
-        return {
-            "message": "批量更新试剂成功",
-            "updated_count": len(reagents),
-            "updated_ids": found_ids,
-            "updated_fields": list(update_data.keys())
-        }
-        
+    except HTTPException:
+        raise
     except Exception as e:
         db.rollback()
-        raise HTTPException(status_code=500, detail=f"批量更新试剂失败: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"批量更新试剂失败: {str(e)}")
+    
+    # 修补这些试剂的单条缓存，聚合缓存整体失效
+    _patch_item_caches(updated_ids, values)
+    _invalidate_reagent_views()
+    
+    return {
+        "message": "批量更新试剂成功",
+        "updated_count": len(updated_ids),
+        "updated_ids": updated_ids,
+        "updated_fields": updated_fields
+    }
\ No newline at end of file
@@ -7,7 +7,11 @@ from backend.database import get_db
 from backend.models import Consumable, User
 from backend.auth import get_current_user, require_admin
 from backend.permissions import require_permission, Permissions
-from pydantic import BaseModel
+from backend.low_stock import low_stock_query
+from backend.inventory_ledger import REASON_RECEIVE, REASON_USE, set_movement_context
+from backend.consumable_movements import MAX_LINES, STATUS_OK, MovementLine, StockConflict, apply_movements
+from backend.cache_config import CacheType, invalidate_related_caches
+from pydantic import BaseModel, Field
 
 # 创建路由器
 router = APIRouter(prefix="/api/consumables", tags=["consumables"])
@@ -74,6 +78,16 @@ class ConsumableRequest(BaseModel):
     purpose: str
     notes: Optional[str] = None
 
+class ConsumableMovementLine(BaseModel):
+    consumable_id: Optional[int] = None
+    barcode: Optional[str] = None  # 扫码内容，consumable_id 为空时使用
+    delta: int  # 正数入库，负数出库
+    note: Optional[str] = None
+
+class ConsumableMovementBatch(BaseModel):
+    lines: List[ConsumableMovementLine] = Field(..., min_length=1, max_length=MAX_LINES)
+    atomic: bool = False  # 任一行失败时整批不写入
+
 # 认证依赖已从主app导入
 
 # 分页响应模型
@@ -122,7 +136,7 @@ def get_consumables(
     
     # 库存不足筛选
     if low_stock:
-        query = query.filter(Consumable.quantity <= Consumable.min_stock)
+        query = query.filter(Consumable.is_low_stock == True)
     
     # 排序
     if sort_by and hasattr(Consumable, sort_by):
@@ -233,6 +247,7 @@ def receive_consumable(
         raise HTTPException(status_code=404, detail="耗材不存在")
     
     # 更新库存
+    set_movement_context(db, REASON_RECEIVE, user_id=current_user.id)
     db_consumable.quantity = (db_consumable.quantity or 0) + quantity
     db_consumable.updated_at = datetime.now(timezone.utc)
     
@@ -265,6 +280,7 @@ def use_consumable(
         raise HTTPException(status_code=400, detail="库存不足")
     
     # 更新库存
+    set_movement_context(db, REASON_USE, user_id=current_user.id)
     db_consumable.quantity = (db_consumable.quantity or 0) - quantity
     db_consumable.updated_at = datetime.now(timezone.utc)
     
@@ -276,6 +292,40 @@ def use_consumable(
         "used_quantity": quantity
     }
 
+@router.post("/movements/batch", response_model=dict)
+def batch_consumable_movements(
+    batch: ConsumableMovementBatch,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """批量出入库（扫码入库/批量领用），整批一个事务，逐行返回结果"""
+    # 入库需要管理员权限，与单条入库接口一致
+    if any(line.delta > 0 for line in batch.lines):
+        require_admin(current_user)
+
+    lines = [MovementLine(line.delta, line.consumable_id, line.barcode, line.note) for line in batch.lines]
+    try:
+        results = apply_movements(db, lines, user_id=current_user.id, atomic=batch.atomic)
+        applied = sum(1 for r in results if r["status"] == STATUS_OK)
+        failed = len(results) - applied
+        db.commit()
+    except StockConflict as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"批量出入库失败: {str(e)}")
+
+    if applied:
+        invalidate_related_caches([CacheType.CONSUMABLES])
+
+    return {
+        "message": "批量出入库完成" if not failed else f"批量出入库完成，{failed} 行失败",
+        "applied_count": applied,
+        "failed_count": failed,
+        "results": results
+    }
+
 @router.get("/categories/list", response_model=List[str])
 def get_consumable_categories(
     db: Session = Depends(get_db),
@@ -291,9 +341,7 @@ def get_low_stock_consumables(
     current_user: dict = Depends(get_current_user)
 ):
     """获取库存不足的耗材"""
-    consumables = db.query(Consumable).filter(
-        Consumable.quantity <= Consumable.min_stock
-    ).all()
+    consumables = low_stock_query(db, Consumable).all()
     
     return consumables
 
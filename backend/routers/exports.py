@@ -0,0 +1,98 @@
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from fastapi.responses import FileResponse
+from typing import Optional
+from datetime import date
+from enum import Enum
+import os
+
+from backend.models import User
+from backend.auth import require_admin
+from backend.job_tracker import JOB_COMPLETED
+from backend.analytics_export import (
+    DATASETS, FORMAT_ARROW, FORMAT_MEDIA_TYPES, FORMAT_PARQUET, PYARROW_AVAILABLE,
+    describe_datasets, download_name, export_path, export_tracker, run_analytics_export
+)
+from pydantic import BaseModel
+
+# 创建路由器
+router = APIRouter(prefix="/api/exports", tags=["exports"])
+
+class ExportFormat(str, Enum):
+    PARQUET = FORMAT_PARQUET
+    ARROW = FORMAT_ARROW
+
+# Pydantic模型
+class ExportJobCreate(BaseModel):
+    format: ExportFormat = ExportFormat.PARQUET
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+
+def _get_job(job_id: str) -> dict:
+    job = export_tracker.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="导出任务不存在")
+    return job
+
+@router.get("/datasets", response_model=dict)
+def list_datasets(current_user: User = Depends(require_admin)):
+    """可导出的数据集及列类型"""
+    return {"available": PYARROW_AVAILABLE, "datasets": describe_datasets()}
+
+@router.post("/{dataset}", response_model=dict)
+def create_export(
+    dataset: str,
+    payload: ExportJobCreate,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(require_admin)
+):
+    """创建列式导出任务，后台分批写出，返回任务ID"""
+    if dataset not in DATASETS:
+        raise HTTPException(status_code=404, detail=f"未知数据集: {dataset}")
+    if not PYARROW_AVAILABLE:
+        raise HTTPException(status_code=503, detail="服务器未安装 pyarrow，暂不支持 Parquet/Arrow 导出")
+    if payload.start_date and payload.end_date and payload.start_date > payload.end_date:
+        raise HTTPException(status_code=400, detail="开始日期不能晚于结束日期")
+    if DATASETS[dataset].time_column is None and (payload.start_date or payload.end_date):
+        raise HTTPException(status_code=400, detail=f"数据集 {dataset} 不支持日期过滤")
+
+    fmt = payload.format.value
+    job = export_tracker.create(
+        owner_id=current_user.id,
+        dataset=dataset,
+        format=fmt,
+        start_date=payload.start_date.isoformat() if payload.start_date else None,
+        end_date=payload.end_date.isoformat() if payload.end_date else None,
+    )
+    background_tasks.add_task(run_analytics_export, job["id"], dataset, fmt, payload.start_date, payload.end_date)
+
+    return {
+        "message": "导出任务已创建",
+        "job_id": job["id"],
+        "status_url": f"/api/exports/jobs/{job['id']}",
+        "download_url": f"/api/exports/jobs/{job['id']}/download"
+    }
+
+@router.get("/jobs/{job_id}", response_model=dict)
+def get_export_job(
+    job_id: str,
+    current_user: User = Depends(require_admin)
+):
+    """查询导出任务进度"""
+    return _get_job(job_id)
+
+@router.get("/jobs/{job_id}/download")
+def download_export(
+    job_id: str,
+    current_user: User = Depends(require_admin)
+):
+    """下载已完成的导出文件"""
+    job = _get_job(job_id)
+    if job["status"] != JOB_COMPLETED:
+        raise HTTPException(status_code=409, detail=f"导出任务尚未完成（当前状态：{job['status']}）")
+
+    path = export_path(job_id, job["format"])
+    if not os.path.exists(path):
+        # 文件已过期清理，或任务在其他节点上执行
+        raise HTTPException(status_code=410, detail="导出文件已不可用，请重新导出")
+
+    return FileResponse(path, media_type=FORMAT_MEDIA_TYPES[job["format"]], filename=download_name(job))
@@ -0,0 +1,164 @@
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from datetime import date, datetime, timezone
+from pydantic import BaseModel
+
+from backend.database import get_db
+from backend.models import User
+from backend.auth import get_current_user, require_admin
+from backend.inventory_ledger import (
+    ITEM_MODELS, consumption_between, ledger_position, recent_movements, run_inventory_snapshot
+)
+from backend.consumption_forecast import forecast_as_of, forecast_for, run_forecast_job, upcoming_stockouts
+
+# 创建路由器
+router = APIRouter(prefix="/api/inventory", tags=["inventory"])
+
+# Pydantic模型
+class InventoryMovementResponse(BaseModel):
+    id: int
+    item_type: str
+    item_id: int
+    delta: float
+    quantity_after: Optional[float]
+    reason: str
+    reference_id: Optional[int]
+    user_id: Optional[int]
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class StockForecastResponse(BaseModel):
+    item_type: str
+    item_id: int
+    item_name: str
+    unit: Optional[str]
+    quantity: float
+    burn_rate_ma: float
+    burn_rate_ewma: float
+    burn_rate: float
+    days_to_stockout: Optional[float]
+    stockout_date: Optional[date]
+    reorder_point: float
+    suggested_reorder: float
+    computed_at: datetime
+
+    class Config:
+        from_attributes = True
+
+def _check_item_type(item_type: str):
+    if item_type not in ITEM_MODELS:
+        raise HTTPException(status_code=400, detail="物品类型必须是 reagent 或 consumable")
+
+def _naive_utc(value: datetime) -> datetime:
+    """流水时间以不带时区的 UTC 存储"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+@router.get("/forecast", response_model=dict)
+def get_stockout_forecast(
+    item_type: Optional[str] = None,
+    within_days: Optional[float] = Query(None, ge=0, description="只返回预计在该天数内耗尽的物品"),
+    reorder_only: bool = False,
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """预计最先耗尽的物品及建议补货量（读取定期任务的预测结果）"""
+    if item_type:
+        _check_item_type(item_type)
+    forecasts = upcoming_stockouts(db, item_type, within_days, reorder_only, limit)
+    computed_at = forecast_as_of(db)
+    return {
+        "computed_at": computed_at.isoformat() if computed_at else None,
+        "items": [StockForecastResponse.from_orm(f) for f in forecasts]
+    }
+
+@router.post("/forecast/run", response_model=dict)
+def run_forecast(
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(require_admin)
+):
+    """后台立即重算一次消耗预测"""
+    background_tasks.add_task(run_forecast_job)
+    return {"message": "消耗预测任务已提交"}
+
+@router.get("/{item_type}/{item_id}/forecast", response_model=StockForecastResponse)
+def get_item_forecast(
+    item_type: str,
+    item_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """单个物品的消耗预测"""
+    _check_item_type(item_type)
+    forecast = forecast_for(db, item_type, item_id)
+    if forecast is None:
+        raise HTTPException(status_code=404, detail="暂无该物品的预测结果")
+    return forecast
+
+@router.get("/{item_type}/{item_id}/stock-at", response_model=dict)
+def get_stock_at(
+    item_type: str,
+    item_id: int,
+    at: datetime = Query(..., description="查询时刻（UTC）"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """查询某一时刻的库存余额"""
+    _check_item_type(item_type)
+    at = _naive_utc(at)
+    quantity, consumed = ledger_position(db, item_type, item_id, at)
+    return {
+        "item_type": item_type,
+        "item_id": item_id,
+        "at": at.isoformat(),
+        "quantity": quantity,
+        "consumed_total": consumed
+    }
+
+@router.get("/{item_type}/{item_id}/consumption", response_model=dict)
+def get_consumption(
+    item_type: str,
+    item_id: int,
+    start: datetime = Query(..., description="开始时刻（UTC）"),
+    end: datetime = Query(..., description="结束时刻（UTC）"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """查询时间区间内的消耗量（领用审批和出库）"""
+    _check_item_type(item_type)
+    start, end = _naive_utc(start), _naive_utc(end)
+    if end < start:
+        raise HTTPException(status_code=400, detail="结束时间不能早于开始时间")
+    return {
+        "item_type": item_type,
+        "item_id": item_id,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "consumed": consumption_between(db, item_type, item_id, start, end)
+    }
+
+@router.get("/{item_type}/{item_id}/movements", response_model=List[InventoryMovementResponse])
+def get_movements(
+    item_type: str,
+    item_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """最近的库存流水"""
+    _check_item_type(item_type)
+    return recent_movements(db, item_type, item_id, limit)
+
+@router.post("/snapshots/run", response_model=dict)
+def run_snapshots(
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(require_admin)
+):
+    """后台立即生成一次库存快照并对账"""
+    background_tasks.add_task(run_inventory_snapshot)
+    return {"message": "库存快照任务已提交"}
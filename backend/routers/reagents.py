@@ -8,6 +8,8 @@ from backend.models import Reagent, User
 from backend.auth import get_current_user, require_admin
 from backend.permissions import check_permission, Permissions
 from pydantic import BaseModel
+from backend.reagent_expiry import expiring_reagents_query
+from backend.low_stock import low_stock_query
 
 # 创建路由器
 router = APIRouter(prefix="/api/reagents", tags=["reagents"])
@@ -255,26 +257,21 @@ def get_expiring_reagents(
     current_user: dict = Depends(get_current_user)
 ):
     """获取即将过期的试剂"""
-    from datetime import timedelta
-    
-    expiry_threshold = datetime.utcnow() + timedelta(days=days)
-    reagents = db.query(Reagent).filter(
-        Reagent.expiry_date.isnot(None),
-        Reagent.expiry_date <= expiry_threshold
-    ).all()
-    
-    return reagents
+    return expiring_reagents_query(db, days).all()
 
 @router.get("/low-stock/list", response_model=List[ReagentResponse])
 def get_low_stock_reagents(
-    threshold: float = 10.0,
+    threshold: Optional[float] = None,
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """获取库存不足的试剂"""
+    """获取库存不足的试剂；不指定 threshold 时按各试剂自身的最小库存阈值判断"""
+    if threshold is None:
+        return low_stock_query(db, Reagent).all()
+
     reagents = db.query(Reagent).filter(
         Reagent.quantity <= threshold
-    ).all()
+    ).order_by(Reagent.quantity).all()
     
     return reagents
 
@@ -1,18 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, aliased
 from sqlalchemy import desc, and_, or_
 from typing import List, Optional
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from pydantic import BaseModel
 import csv
 import io
+import zlib
 
 from fastapi import APIRouter, Depends, Query, HTTPException
-from fastapi.responses import Response
+from fastapi.responses import StreamingResponse
 
-from backend.database import get_db
+from backend.database import SessionLocal, get_db
 from backend.models import UsageRecord, User, Reagent, Consumable
 from backend.auth import get_current_user
+from backend.usage_rollup import get_usage_summary
+from backend.data_archive import archive_boundary, history_query
 
 router = APIRouter()
 
@@ -149,6 +152,142 @@ async def get_my_usage_records(
     
     return result
 
+# 获取使用统计
+@router.get("/stats/summary")
+async def get_usage_stats(
+    start_date: Optional[date] = Query(None, description="开始日期"),
+    end_date: Optional[date] = Query(None, description="结束日期"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """获取使用统计信息（含两端日期；历史日期读取每日汇总表，近期日期直接聚合）"""
+    return get_usage_summary(db, start_date, end_date)
+
+# 导出使用记录为CSV
+EXPORT_CHUNK_ROWS = 1000  # 每次从数据库读取并写出的行数
+
+CSV_HEADER = [
+    '记录ID', '申请ID', '物品类型', '物品ID', '物品名称',
+    '使用数量', '单位', '使用者ID', '使用者名称', '批准人ID',
+    '批准人名称', '使用目的', '备注', '使用时间', '创建时间'
+]
+
+def _usage_export_source(db: Session, start_date: Optional[date], end_date: Optional[date]):
+    """导出的读取源：开始日期早于归档边界（或未指定）时连同归档分区一起读取"""
+    boundary = archive_boundary(db, "usage_records")
+    if boundary is None or (start_date and start_date >= boundary):
+        return UsageRecord.__table__
+    start = datetime.combine(start_date, datetime.min.time()) if start_date else None
+    end = datetime.combine(end_date + timedelta(days=1), datetime.min.time()) if end_date else None
+    return history_query(db, "usage_records", start, end)
+
+def _usage_export_query(db: Session, item_type: Optional[str], user_id: Optional[int],
+                        start_date: Optional[date], end_date: Optional[date]):
+    """导出查询：使用者和批准人名称在同一条查询中 JOIN，按 yield_per 分批读取"""
+    Requester = aliased(User)
+    Approver = aliased(User)
+    records = _usage_export_source(db, start_date, end_date).c
+    query = db.query(
+        records.id, records.request_id, records.item_type, records.item_id,
+        records.item_name, records.quantity_used, records.unit,
+        records.user_id, Requester.username, records.approved_by_id, Approver.username,
+        records.purpose, records.notes, records.used_at, records.created_at
+    ).outerjoin(
+        Requester, Requester.id == records.user_id
+    ).outerjoin(
+        Approver, Approver.id == records.approved_by_id
+    )
+    
+    # 应用过滤条件
+    if item_type:
+        query = query.filter(records.item_type == item_type)
+    
+    if user_id:
+        query = query.filter(records.user_id == user_id)
+    
+    if start_date:
+        query = query.filter(records.used_at >= datetime.combine(start_date, datetime.min.time()))
+    
+    # 结束日期包含当天，与统计接口一致
+    if end_date:
+        query = query.filter(records.used_at < datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
+    
+    # 按使用时间倒序排列
+    return query.order_by(desc(records.used_at), desc(records.id)).yield_per(EXPORT_CHUNK_ROWS)
+
+def _iter_usage_csv(item_type: Optional[str], user_id: Optional[int], start_date: Optional[date],
+                    end_date: Optional[date], compress: bool):
+    """
+    逐块生成CSV（可选 gzip），内存占用与导出行数无关
+
+    响应开始发送时请求依赖的会话已经关闭，生成器使用自己的会话。
+    """
+    db = SessionLocal()
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    
+    def drain() -> bytes:
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+        return compressor.compress(data) if compressor else data
+    
+    try:
+        writer.writerow(CSV_HEADER)
+        rows = _usage_export_query(db, item_type, user_id, start_date, end_date)
+        for count, row in enumerate(rows, 1):
+            (record_id, request_id, record_item_type, item_id, item_name, quantity_used, unit,
+             record_user_id, user_name, approved_by_id, approved_by_name, purpose, notes, used_at, created_at) = row
+            writer.writerow([
+                record_id,
+                request_id,
+                record_item_type,
+                item_id,
+                item_name,
+                quantity_used,
+                unit,
+                record_user_id,
+                user_name or "未知用户",
+                approved_by_id,
+                approved_by_name or "未知管理员",
+                purpose,
+                notes or "",
+                used_at.isoformat() if used_at else "",
+                created_at.isoformat() if created_at else ""
+            ])
+            if count % EXPORT_CHUNK_ROWS == 0:
+                chunk = drain()
+                if chunk:
+                    yield chunk
+        
+        chunk = drain()
+        if compressor:
+            chunk += compressor.flush()
+        if chunk:
+            yield chunk
+    finally:
+        db.close()
+
+@router.get("/export-csv")
+async def export_usage_records_csv(
+    item_type: Optional[str] = Query(None, description="过滤物品类型: reagent 或 consumable"),
+    user_id: Optional[int] = Query(None, description="过滤使用者ID"),
+    start_date: Optional[date] = Query(None, description="开始日期"),
+    end_date: Optional[date] = Query(None, description="结束日期"),
+    gzip: bool = Query(False, description="以 gzip 压缩下载（.csv.gz）"),
+    current_user: User = Depends(get_current_user)
+):
+    """导出使用记录为CSV格式（流式输出）"""
+    filename = "usage_records.csv.gz" if gzip else "usage_records.csv"
+    return StreamingResponse(
+        _iter_usage_csv(item_type, user_id, start_date, end_date, gzip),
+        media_type="application/gzip" if gzip else "text/csv",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}"
+        }
+    )
+
 # 获取使用记录详情
 @router.get("/{record_id}", response_model=UsageRecordResponse)
 async def get_usage_record(
@@ -182,130 +321,3 @@ async def get_usage_record(
         used_at=record.used_at,
         created_at=record.created_at
     )
-
-# 获取使用统计
-@router.get("/stats/summary")
-async def get_usage_stats(
-    start_date: Optional[date] = Query(None, description="开始日期"),
-    end_date: Optional[date] = Query(None, description="结束日期"),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    """获取使用统计信息"""
-    
-    query = db.query(UsageRecord)
-    
-    if start_date:
-        query = query.filter(UsageRecord.used_at >= start_date)
-    
-    if end_date:
-        query = query.filter(UsageRecord.used_at <= end_date)
-    
-    records = query.all()
-    
-    # 统计数据
-    total_records = len(records)
-    reagent_records = len([r for r in records if r.item_type == 'reagent'])
-    consumable_records = len([r for r in records if r.item_type == 'consumable'])
-    
-    # 按用户统计
-    user_stats = {}
-    for record in records:
-        user_id = record.user_id
-        if user_id not in user_stats:
-            user = db.query(User).filter(User.id == user_id).first()
-            user_stats[user_id] = {
-                'user_name': user.username if user else '未知用户',
-                'total_usage': 0,
-                'reagent_usage': 0,
-                'consumable_usage': 0
-            }
-        
-        user_stats[user_id]['total_usage'] += 1
-        if record.item_type == 'reagent':
-            user_stats[user_id]['reagent_usage'] += 1
-        else:
-            user_stats[user_id]['consumable_usage'] += 1
-    
-    return {
-        'total_records': total_records,
-        'reagent_records': reagent_records,
-        'consumable_records': consumable_records,
-        'user_stats': list(user_stats.values())
-    }
-
-# 导出使用记录为CSV
-@router.get("/export-csv")
-async def export_usage_records_csv(
-    item_type: Optional[str] = Query(None, description="过滤物品类型: reagent 或 consumable"),
-    user_id: Optional[int] = Query(None, description="过滤使用者ID"),
-    start_date: Optional[date] = Query(None, description="开始日期"),
-    end_date: Optional[date] = Query(None, description="结束日期"),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    """导出使用记录为CSV格式"""
-    
-    query = db.query(UsageRecord)
-    
-    # 应用过滤条件
-    if item_type:
-        query = query.filter(UsageRecord.item_type == item_type)
-    
-    if user_id:
-        query = query.filter(UsageRecord.user_id == user_id)
-    
-    if start_date:
-        query = query.filter(UsageRecord.used_at >= start_date)
-    
-    if end_date:
-        query = query.filter(UsageRecord.used_at <= end_date)
-    
-    # 按使用时间倒序排列
-    records = query.order_by(desc(UsageRecord.used_at)).all()
-    
-    # 创建CSV文件
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # 写入表头
-    writer.writerow([
-        '记录ID', '申请ID', '物品类型', '物品ID', '物品名称', 
-        '使用数量', '单位', '使用者ID', '使用者名称', '批准人ID', 
-        '批准人名称', '使用目的', '备注', '使用时间', '创建时间'
-    ])
-    
-    # 写入数据行
-    for record in records:
-        user = db.query(User).filter(User.id == record.user_id).first()
-        approved_by = db.query(User).filter(User.id == record.approved_by_id).first()
-        
-        writer.writerow([
-            record.id,
-            record.request_id,
-            record.item_type,
-            record.item_id,
-            record.item_name,
-            record.quantity_used,
-            record.unit,
-            record.user_id,
-            user.username if user else "未知用户",
-            record.approved_by_id,
-            approved_by.username if approved_by else "未知管理员",
-            record.purpose,
-            record.notes or "",
-            record.used_at.isoformat() if record.used_at else "",
-            record.created_at.isoformat() if record.created_at else ""
-        ])
-    
-    # 创建响应
-    output.seek(0)
-    response = Response(
-        content=output.getvalue(),
-        media_type="text/csv",
-        headers={
-            "Content-Disposition": "attachment; filename=usage_records.csv"
-        }
-    )
-    
-    return response
\ No newline at end of file
@@ -4,7 +4,7 @@ from typing import List, Optional
 from backend.database import get_db
 from backend.models import User, Role, Permission
 from backend.auth import get_current_user
-from backend.permissions import check_permission, check_role, Permissions, Roles, get_permission_checker
+from backend.permissions import check_permission, check_role, Permissions, Roles, get_permission_checker, AuthContext, get_auth_context
 from pydantic import BaseModel
 from passlib.context import CryptContext
 
@@ -479,17 +479,12 @@ def get_user_details(
 # 获取当前用户的权限
 @router.get("/me/permissions")
 def get_my_permissions(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    auth: AuthContext = Depends(get_auth_context)
 ):
     """获取当前用户的权限列表"""
-    checker = get_permission_checker(db)
-    user_permissions = checker.get_user_permissions(current_user)
-    user_roles = checker.get_user_roles(current_user)
-    
     return {
-        "permissions": user_permissions,
-        "roles": user_roles
+        "permissions": sorted(auth.permissions),
+        "roles": sorted(auth.roles)
     }
 
 # 修改用户密码（仅管理员）
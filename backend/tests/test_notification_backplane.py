@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from connection_heartbeats import heartbeat_tracker
+from notification_backplane import CHANNEL_NOTIFICATIONS, CHANNEL_REALTIME, LocalBackplane
+from notification_service import NotificationManager
+
+
+class FakeWebSocket:
+    """只记录发送内容的 WebSocket"""
+
+    def __init__(self, fail: bool = False):
+        self.sent = []
+        self.fail = fail
+
+    async def send_text(self, message: str):
+        if self.fail:
+            raise RuntimeError("connection closed")
+        self.sent.append(message)
+
+
+async def _wait_received(backplane: LocalBackplane, channel: str, count: int = 1, timeout: float = 1.0):
+    """等待背板在事件循环中处理完指定数量的消息"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while asyncio.get_running_loop().time() < deadline:
+        metrics = backplane.metrics.get(channel)
+        if metrics and metrics.received >= count and len(metrics.latencies) >= count:
+            return metrics
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"{channel} 消息未在 {timeout} 秒内投递")
+
+
+@pytest.fixture
+def manager():
+    manager = NotificationManager()
+    manager.active_connections = {
+        1: {"c1": FakeWebSocket(), "c2": FakeWebSocket()},
+        2: {"c3": FakeWebSocket()},
+    }
+    manager.connection_user_map = {"c1": 1, "c2": 1, "c3": 2}
+    heartbeat_tracker.drain()
+    yield manager
+    heartbeat_tracker.drain()
+
+
+class TestLocalBackplane:
+    """进程内背板：publish → _deliver → 投递统计"""
+
+    @pytest.mark.asyncio
+    async def test_publish_delivers_to_target_user(self, manager):
+        await manager.backplane.start(manager._deliver)
+
+        manager.backplane.publish(CHANNEL_NOTIFICATIONS, [1], {"title": "hello"})
+        metrics = await _wait_received(manager.backplane, CHANNEL_NOTIFICATIONS)
+
+        assert manager.active_connections[1]["c1"].sent == ['{"title": "hello"}']
+        assert manager.active_connections[1]["c2"].sent == ['{"title": "hello"}']
+        assert manager.active_connections[2]["c3"].sent == []
+        assert metrics.published == 1
+        assert metrics.received == 1
+        assert metrics.delivered == 2
+        assert metrics.failed == 0
+        assert len(metrics.latencies) == 1
+
+    @pytest.mark.asyncio
+    async def test_notification_delivery_touches_heartbeats(self, manager):
+        await manager.backplane.start(manager._deliver)
+
+        manager.backplane.publish(CHANNEL_NOTIFICATIONS, [1], {"title": "hello"})
+        manager.backplane.publish(CHANNEL_REALTIME, [2], {"type": "refresh"})
+        await _wait_received(manager.backplane, CHANNEL_NOTIFICATIONS)
+        await _wait_received(manager.backplane, CHANNEL_REALTIME)
+
+        # 只有通知频道的送达刷新心跳
+        assert set(heartbeat_tracker.drain()) == {"c1", "c2"}
+
+    @pytest.mark.asyncio
+    async def test_broadcast_and_failed_connections(self, manager):
+        manager.active_connections[2]["c3"].fail = True
+        await manager.backplane.start(manager._deliver)
+
+        manager.backplane.publish(CHANNEL_REALTIME, None, {"type": "refresh"})
+        metrics = await _wait_received(manager.backplane, CHANNEL_REALTIME)
+
+        assert metrics.delivered == 2
+        assert metrics.failed == 1
+        snapshot = manager.backplane.stats()["channels"][CHANNEL_REALTIME]
+        assert snapshot["delivered_connections"] == 2
+        assert snapshot["failed_connections"] == 1
+        assert snapshot["latency_ms"]["samples"] == 1
+
+    @pytest.mark.asyncio
+    async def test_publish_from_worker_thread(self, manager):
+        await manager.backplane.start(manager._deliver)
+
+        # 同步接口在线程池中调用 publish_to_users，投递在事件循环中完成
+        targets = await asyncio.to_thread(manager.publish_to_users, [2], {"type": "refresh"})
+        metrics = await _wait_received(manager.backplane, CHANNEL_REALTIME)
+
+        assert targets == 1
+        assert manager.active_connections[2]["c3"].sent == ['{"type": "refresh"}']
+        assert metrics.delivered == 1
+
+    def test_publish_before_start_is_counted_but_not_delivered(self, manager):
+        manager.backplane.publish(CHANNEL_NOTIFICATIONS, [1], {"title": "hello"})
+
+        metrics = manager.backplane.metrics[CHANNEL_NOTIFICATIONS]
+        assert metrics.published == 1
+        assert metrics.received == 0
+        assert manager.active_connections[1]["c1"].sent == []
+
+    @pytest.mark.asyncio
+    async def test_stop_cancels_pending_deliveries(self, manager):
+        started = asyncio.Event()
+
+        async def slow_handler(envelope):
+            started.set()
+            await asyncio.sleep(60)
+            return 0, 0
+
+        await manager.backplane.start(slow_handler)
+        manager.backplane.publish(CHANNEL_REALTIME, None, {"type": "refresh"})
+        await asyncio.wait_for(started.wait(), 1.0)
+        assert len(manager.backplane._tasks) == 1
+
+        await manager.backplane.stop()
+
+        assert manager.backplane._tasks == set()
+        assert len(manager.backplane.metrics[CHANNEL_REALTIME].latencies) == 0
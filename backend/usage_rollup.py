@@ -0,0 +1,251 @@
+# backend/usage_rollup.py
+
+"""
+领用每日汇总
+
+后台任务按水位增量扫描新增的使用记录，只重算受影响的日期，写入
+usage_daily_rollup（日期 × 使用者 × 物品）。使用统计对水位之前的日期
+读取汇总表，水位之后的少量日期直接对使用记录做 GROUP BY，结果与
+全量聚合一致而不必扫描全部记录。
+"""
+
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import delete, func, insert
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import RollupState, UsageDailyRollup, UsageRecord, User
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_NAME = "usage_daily"
+
+# 水位回退量，容忍提交时间晚于 created_at 的写入（重算是幂等的）
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+# 每批重算的天数
+DAY_CHUNK_SIZE = 31
+
+ITEM_TYPES = ("reagent", "consumable")
+
+
+def _as_date(value) -> date:
+    # SQLite 的 date() 返回字符串
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _day_bounds(first: date, last: date):
+    return datetime.combine(first, time.min), datetime.combine(last + timedelta(days=1), time.min)
+
+
+def compute_rollup(db: Session, days: List[date], now: Optional[datetime] = None) -> List[dict]:
+    """从使用记录重新计算指定日期的汇总行"""
+    if not days:
+        return []
+    now = now or datetime.utcnow()
+    U = UsageRecord
+    lo, hi = _day_bounds(min(days), max(days))
+    day = func.date(U.used_at)
+    rows = db.query(
+        day.label("day"), U.user_id, U.item_type, U.item_id,
+        func.max(U.item_name), func.max(U.unit), func.count(U.id), func.coalesce(func.sum(U.quantity_used), 0.0)
+    ).filter(
+        U.used_at >= lo, U.used_at < hi
+    ).group_by(day, U.user_id, U.item_type, U.item_id).all()
+
+    wanted = set(days)
+    result = []
+    for row_day, user_id, item_type, item_id, item_name, unit, count, quantity in rows:
+        row_day = _as_date(row_day)
+        if row_day in wanted:
+            result.append({
+                "day": row_day,
+                "user_id": user_id,
+                "item_type": item_type,
+                "item_id": item_id,
+                "item_name": item_name,
+                "unit": unit,
+                "record_count": count,
+                "quantity_total": quantity,
+                "updated_at": now,
+            })
+    return result
+
+
+def write_rollup(db: Session, days: List[date], rows: List[dict]):
+    """删除这些日期的旧汇总行并批量写入新行（同一事务）"""
+    if days:
+        db.execute(delete(UsageDailyRollup).where(UsageDailyRollup.day.in_(days)))
+    if rows:
+        db.execute(insert(UsageDailyRollup), rows)
+
+
+def _process(db: Session, days: Set[date], now: datetime) -> int:
+    """按日期分批重算并提交，返回写入的汇总行数"""
+    written = 0
+    ordered = sorted(days)
+    for i in range(0, len(ordered), DAY_CHUNK_SIZE):
+        chunk = ordered[i:i + DAY_CHUNK_SIZE]
+        rows = compute_rollup(db, chunk, now)
+        write_rollup(db, chunk, rows)
+        db.commit()
+        written += len(rows)
+    return written
+
+
+def _set_watermark(db: Session, watermark: datetime):
+    state = db.get(RollupState, ROLLUP_NAME)
+    if state is None:
+        db.add(RollupState(name=ROLLUP_NAME, watermark=watermark))
+    else:
+        state.watermark = watermark
+    db.commit()
+
+
+def _record_days(db: Session, created_since: Optional[datetime] = None) -> Set[date]:
+    day = func.date(UsageRecord.used_at)
+    query = db.query(day).filter(UsageRecord.used_at.isnot(None))
+    if created_since is not None:
+        query = query.filter(UsageRecord.created_at > created_since)
+    return {_as_date(d) for (d,) in query.distinct().all()}
+
+
+def _archive_boundary(db: Session) -> Optional[date]:
+    from data_archive import archive_boundary  # 避免循环导入
+
+    return archive_boundary(db, UsageRecord.__tablename__)
+
+
+def rebuild_all(db: Session) -> dict:
+    """全量重建汇总表（归档边界之前的日期源记录已移走，保留原汇总行）"""
+    now = datetime.utcnow()
+    boundary = _archive_boundary(db)
+    stale = delete(UsageDailyRollup)
+    if boundary is not None:
+        stale = stale.where(UsageDailyRollup.day >= boundary)
+    db.execute(stale)
+    db.commit()
+    days = {d for d in _record_days(db) if boundary is None or d >= boundary}
+    written = _process(db, days, now)
+    _set_watermark(db, now)
+    return {"mode": "rebuild", "days": len(days), "rows_written": written}
+
+
+def refresh_incremental(db: Session) -> dict:
+    """根据水位重算新增记录涉及的日期；首次运行时全量重建"""
+    state = db.get(RollupState, ROLLUP_NAME)
+    if state is None or state.watermark is None:
+        return rebuild_all(db)
+
+    now = datetime.utcnow()
+    boundary = _archive_boundary(db)
+    days = {d for d in _record_days(db, state.watermark - WATERMARK_OVERLAP) if boundary is None or d >= boundary}
+    written = _process(db, days, now)
+    _set_watermark(db, now)
+    return {"mode": "incremental", "days": len(days), "rows_written": written}
+
+
+def run_usage_daily_rollup(rebuild: bool = False) -> dict:
+    """调度器/后台任务入口"""
+    db = SessionLocal()
+    try:
+        result = rebuild_all(db) if rebuild else refresh_incremental(db)
+        logger.info(f"领用每日汇总完成: {result}")
+        return result
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+# ---------- 查询 ----------
+
+def rollup_cutoff(db: Session) -> Optional[date]:
+    """早于该日期的汇总行已完整；无水位时返回 None（全部直接聚合）"""
+    state = db.get(RollupState, ROLLUP_NAME)
+    if state is None or state.watermark is None:
+        return None
+    return (state.watermark - WATERMARK_OVERLAP).date()
+
+
+def _new_bucket(**extra) -> dict:
+    return {"total_usage": 0, "reagent_usage": 0, "consumable_usage": 0, "quantity_total": 0.0, **extra}
+
+
+def _add(bucket: dict, item_type: str, count: int, quantity: float):
+    bucket["total_usage"] += count
+    bucket["quantity_total"] += quantity or 0.0
+    if item_type in ITEM_TYPES:
+        bucket[f"{item_type}_usage"] += count
+
+
+def get_usage_summary(db: Session, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                      top_items: int = 10) -> dict:
+    """
+    使用统计：总数、按类型计数、按使用者和按物品汇总
+
+    [start_date, end_date]（含两端）中早于汇总水位的日期读取汇总表，
+    其余日期对使用记录直接 GROUP BY，两部分在内存中合并（结果行数为
+    使用者数和物品数量级）。
+    """
+    cutoff = rollup_cutoff(db)
+    R, U = UsageDailyRollup, UsageRecord
+
+    parts = []
+    if cutoff is not None and (start_date is None or start_date < cutoff):
+        rolled_end = cutoff - timedelta(days=1) if end_date is None else min(end_date, cutoff - timedelta(days=1))
+        query = db.query(
+            R.user_id, User.username, R.item_type, R.item_id, func.max(R.item_name), func.max(R.unit),
+            func.sum(R.record_count), func.sum(R.quantity_total)
+        ).outerjoin(User, User.id == R.user_id).filter(R.day <= rolled_end)
+        if start_date:
+            query = query.filter(R.day >= start_date)
+        parts.append(query.group_by(R.user_id, User.username, R.item_type, R.item_id).all())
+        live_start = cutoff if start_date is None or start_date < cutoff else start_date
+    else:
+        live_start = start_date
+
+    if end_date is None or cutoff is None or end_date >= cutoff:
+        query = db.query(
+            U.user_id, User.username, U.item_type, U.item_id, func.max(U.item_name), func.max(U.unit),
+            func.count(U.id), func.coalesce(func.sum(U.quantity_used), 0.0)
+        ).outerjoin(User, User.id == U.user_id)
+        if live_start:
+            query = query.filter(U.used_at >= datetime.combine(live_start, time.min))
+        if end_date:
+            query = query.filter(U.used_at < datetime.combine(end_date + timedelta(days=1), time.min))
+        parts.append(query.group_by(U.user_id, User.username, U.item_type, U.item_id).all())
+
+    totals = _new_bucket()
+    by_user: Dict[int, dict] = {}
+    by_item: Dict[tuple, dict] = {}
+    for rows in parts:
+        for user_id, username, item_type, item_id, item_name, unit, count, quantity in rows:
+            count = int(count or 0)
+            _add(totals, item_type, count, quantity)
+            if user_id not in by_user:
+                by_user[user_id] = _new_bucket(user_id=user_id, user_name=username or "未知用户")
+            _add(by_user[user_id], item_type, count, quantity)
+            key = (item_type, item_id)
+            if key not in by_item:
+                by_item[key] = _new_bucket(item_type=item_type, item_id=item_id, item_name=item_name, unit=unit)
+            _add(by_item[key], item_type, count, quantity)
+
+    user_stats = sorted(by_user.values(), key=lambda s: -s["total_usage"])
+    items = sorted(by_item.values(), key=lambda s: -s["total_usage"])[:top_items]
+    for item in items:
+        for field in ("reagent_usage", "consumable_usage"):
+            item.pop(field, None)
+
+    return {
+        "total_records": totals["total_usage"],
+        "reagent_records": totals["reagent_usage"],
+        "consumable_records": totals["consumable_usage"],
+        "user_stats": user_stats,
+        "top_items": items,
+        "rollup_through": (cutoff - timedelta(days=1)).isoformat() if cutoff else None,
+    }